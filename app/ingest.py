@@ -0,0 +1,304 @@
+"""Fila de ingestão: processamento de documentos fora do threadpool do servidor web.
+
+Uploads entram numa fila de prioridade limitada, consumida por um número fixo de
+threads worker. A extração de PDF e de EPUB grandes, que é a parte pesada de CPU,
+continua indo para processos (ProcessPoolExecutor em processing.py); os workers só
+coordenam e tokenizam, publicando tokens em `db` como antes.
+
+Os workers são threads, e não processos, de propósito: o processamento publica os
+tokens aos poucos na entrada de `db` (leituras durante o processamento) e para entre
+páginas pelo `cancel_event`, e as duas coisas dependem de memória compartilhada com a
+API. Num processo separado, cada lote de tokens voltaria por IPC e seria
+desserializado no servidor, um custo da mesma ordem da própria tokenização. Para
+limitar a disputa pelo GIL com o event loop, os workers são poucos
+(LEITOR_INGEST_WORKERS, padrão até 2).
+
+- Fila cheia: `submit` levanta QueueFull e a API responde 429 com Retry-After.
+- Cancelamento: jobs na fila saem dela; jobs em execução param entre páginas.
+- Desligamento: jobs pendentes (e os interrompidos) vão para data/ingest_queue.json
+  e são retomados no próximo startup.
+"""
+import heapq
+import itertools
+import json
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .metrics import counter, gauge, histogram
+from .processing import ProcessingCancelled, _available_cpus, process_pdf
+from .storage import DATA_DIR, get_document_meta
+
+
+INGEST_WORKERS = int(os.environ.get("LEITOR_INGEST_WORKERS", "0")) or max(1, min(2, _available_cpus()))
+INGEST_QUEUE_MAX = int(os.environ.get("LEITOR_INGEST_QUEUE_MAX", "32"))
+QUEUE_STATE_PATH = DATA_DIR / "ingest_queue.json"
+# Quanto tempo DELETE espera um job em execução parar antes de remover os arquivos
+CANCEL_WAIT_SECONDS = 10.0
+# Jobs concluídos mantidos para consulta de status
+FINISHED_JOBS_KEPT = 1000
+
+# Menor valor = maior prioridade
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 10
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+class QueueFull(Exception):
+    def __init__(self, retry_after: int) -> None:
+        super().__init__("Fila de processamento cheia")
+        self.retry_after = retry_after
+
+
+class Job:
+    def __init__(self, document_id: str, file_path: str, priority: int) -> None:
+        self.document_id = document_id
+        self.file_path = file_path
+        self.priority = priority
+        self.status = QUEUED
+        self.error: Optional[str] = None
+        self.enqueued_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.cancel_event = threading.Event()
+        self.done = threading.Event()
+        # Mesmo sinal de `done` para quem espera de forma assíncrona (asyncio.wrap_future)
+        self.future: "Future[str]" = Future()
+
+    def finish(self, status: str) -> None:
+        self.status = status
+        self.finished_at = time.time()
+        self.done.set()
+        self.future.set_result(status)
+
+    @property
+    def active(self) -> bool:
+        return self.status in (QUEUED, RUNNING)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "document_id": self.document_id,
+            "status": self.status,
+            "priority": self.priority,
+            "enqueued_at": self.enqueued_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+        }
+
+
+class IngestQueue:
+    def __init__(self, runner: Callable[..., None], workers: int, max_depth: int) -> None:
+        self._runner = runner
+        self.workers = workers
+        self.max_depth = max_depth
+        self._cond = threading.Condition()
+        self._heap: List[Any] = []
+        self._seq = itertools.count()
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._queued = 0
+        self._running = 0
+        self._threads: List[threading.Thread] = []
+        self._stopping = False
+        # Média móvel da duração dos jobs, base do Retry-After
+        self._avg_seconds = 5.0
+
+    # --- consulta ---
+
+    def get(self, document_id: str) -> Optional[Job]:
+        with self._cond:
+            return self._jobs.get(document_id)
+
+    def depth(self) -> int:
+        return self._queued
+
+    def running(self) -> int:
+        return self._running
+
+    def is_full(self) -> bool:
+        return self._queued >= self.max_depth
+
+    def position(self, job: Job) -> int:
+        """Posição na fila (0 = próximo a rodar); -1 se não está na fila."""
+        with self._cond:
+            if job.status != QUEUED:
+                return -1
+            # Um job promovido pode ter mais de uma entrada no heap; vale a de maior prioridade
+            key = min((p, s) for p, s, other in self._heap if other is job)
+            return len({id(other) for p, s, other in self._heap if other.status == QUEUED and (p, s) < key})
+
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self._avg_seconds * (self._queued + self._running) / max(1, self.workers)))
+
+    # --- operações ---
+
+    def submit(self, document_id: str, file_path: str, priority: int = PRIORITY_NORMAL, force: bool = False) -> Job:
+        """Enfileira o processamento. Se já há job ativo para o documento, devolve o mesmo.
+        `force` ignora o limite da fila (retomada no startup, reprocessamento).
+        """
+        return self.join_or_submit(document_id, file_path, priority, force)[0]
+
+    def join_or_submit(self, document_id: str, file_path: str, priority: int = PRIORITY_NORMAL, force: bool = False) -> Tuple[Job, bool]:
+        """Como `submit`, indicando se o job foi criado agora (True) ou já existia (False).
+        Um job ativo por documento: chamadas concorrentes esperam o mesmo resultado.
+        """
+        with self._cond:
+            existing = self._jobs.get(document_id)
+            if existing is not None and existing.active:
+                if priority < existing.priority and existing.status == QUEUED:
+                    # Leitor esperando: promove o job já enfileirado
+                    existing.priority = priority
+                    heapq.heappush(self._heap, (priority, next(self._seq), existing))
+                return existing, False
+            if not force and self._queued >= self.max_depth:
+                INGEST_REJECTED.inc()
+                raise QueueFull(self.retry_after())
+            job = Job(document_id, file_path, priority)
+            self._remember(job)
+            heapq.heappush(self._heap, (priority, next(self._seq), job))
+            self._queued += 1
+            self._cond.notify()
+            return job, True
+
+    def cancel(self, document_id: str, wait: float | None = None) -> bool:
+        """Cancela o job do documento. Com `wait`, espera o job em execução parar."""
+        with self._cond:
+            job = self._jobs.get(document_id)
+            if job is None or not job.active:
+                return False
+            job.cancel_event.set()
+            if job.status == QUEUED:
+                # Remoção preguiçosa: o worker descarta jobs cancelados ao retirá-los do heap
+                self._queued -= 1
+                job.finish(CANCELLED)
+                return True
+        if wait is not None:
+            job.done.wait(wait)
+        return True
+
+    def start(self) -> None:
+        with self._cond:
+            if self._threads:
+                return
+            self._stopping = False
+        self._resume_persisted()
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker, name=f"ingest-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self, timeout: float = CANCEL_WAIT_SECONDS) -> None:
+        """Para os workers; jobs pendentes e interrompidos são gravados para retomada."""
+        with self._cond:
+            self._stopping = True
+            pending: List[Job] = []
+            for _, _, job in sorted(self._heap):
+                if job.status == QUEUED and job not in pending:
+                    pending.append(job)
+            running = [job for job in self._jobs.values() if job.status == RUNNING]
+            for job in running:
+                job.cancel_event.set()
+            self._cond.notify_all()
+        for job in running:
+            job.done.wait(timeout)
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+        # Interrompidos voltam na frente, na prioridade original
+        self._persist(running + pending)
+
+    # --- internos ---
+
+    def _remember(self, job: Job) -> None:
+        self._jobs[job.document_id] = job
+        self._jobs.move_to_end(job.document_id)
+        while len(self._jobs) > FINISHED_JOBS_KEPT:
+            oldest_id, oldest = next(iter(self._jobs.items()))
+            if oldest.active:
+                break
+            del self._jobs[oldest_id]
+
+    def _next_job(self) -> Optional[Job]:
+        with self._cond:
+            while True:
+                if self._stopping:
+                    return None
+                while self._heap:
+                    _, _, job = heapq.heappop(self._heap)
+                    if job.status == QUEUED:
+                        job.status = RUNNING
+                        job.started_at = time.time()
+                        self._queued -= 1
+                        self._running += 1
+                        return job
+                self._cond.wait()
+
+    def _worker(self) -> None:
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            INGEST_WAIT_SECONDS.observe(job.started_at - job.enqueued_at)
+            try:
+                self._runner(job.document_id, job.file_path, cancel_event=job.cancel_event)
+                status = COMPLETED
+            except ProcessingCancelled:
+                status = CANCELLED
+            except Exception as e:
+                status = FAILED
+                job.error = str(e) or e.__class__.__name__
+            with self._cond:
+                self._running -= 1
+                if status == COMPLETED:
+                    self._avg_seconds = 0.8 * self._avg_seconds + 0.2 * (time.time() - job.started_at)
+                job.finish(status)
+
+    def _persist(self, jobs: List[Job]) -> None:
+        if not jobs:
+            if QUEUE_STATE_PATH.exists():
+                QUEUE_STATE_PATH.unlink()
+            return
+        data = [{"document_id": j.document_id, "file_path": j.file_path, "priority": j.priority} for j in jobs]
+        tmp = QUEUE_STATE_PATH.with_suffix(".json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp, QUEUE_STATE_PATH)
+
+    def _resume_persisted(self) -> None:
+        if not QUEUE_STATE_PATH.exists():
+            return
+        try:
+            with open(QUEUE_STATE_PATH, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception:
+            data = []
+        for item in data:
+            try:
+                meta = get_document_meta(item["document_id"])
+            except Exception:
+                continue
+            # Só retoma documentos que ainda existem e não terminaram nesse meio tempo
+            if not meta or meta.get("status") != "processing" or not os.path.exists(item["file_path"]):
+                continue
+            self.submit(item["document_id"], item["file_path"], item.get("priority", PRIORITY_NORMAL), force=True)
+        try:
+            QUEUE_STATE_PATH.unlink()
+        except Exception:
+            pass
+
+
+ingest_queue = IngestQueue(process_pdf, INGEST_WORKERS, INGEST_QUEUE_MAX)
+
+INGEST_REJECTED = counter("leitor_ingest_rejected_total", "Uploads recusados com a fila de processamento cheia")
+INGEST_WAIT_SECONDS = histogram("leitor_ingest_wait_seconds", "Tempo dos jobs na fila até começar a rodar")
+gauge("leitor_ingest_queue_depth", "Jobs aguardando na fila de processamento", fn=ingest_queue.depth)
+gauge("leitor_ingest_jobs_running", "Jobs em execução na fila de processamento", fn=ingest_queue.running)
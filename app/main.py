@@ -1,26 +1,95 @@
+import asyncio
 import os
+import hashlib
+import time
 import mimetypes
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Optional
+from typing import Any, Dict, Optional
 
-from fastapi import FastAPI, UploadFile, File, BackgroundTasks, HTTPException
+import aiofiles
+import aiofiles.os
+import pydantic_core
+from fastapi import FastAPI, UploadFile, File, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.responses import JSONResponse, FileResponse, Response
 from fastapi import status
 
-from .models import DocumentStatus, DocumentUploadResponse, DocumentWords, DocumentTokens
-from .storage import db, init_db, insert_document_record, list_documents, update_document_after_processing, get_document_meta, update_last_read_page, delete_document_record, load_tokens_cache, update_progress
-from .processing import process_pdf
+from . import metrics
+from .metrics import HTTP_IN_PROGRESS, HTTP_REQUEST_SECONDS, REPROCESS_ON_MISS
+from .ingest import CANCEL_WAIT_SECONDS, COMPLETED, PRIORITY_HIGH, QueueFull, ingest_queue
+from .processing import PDF_BACKEND, PDF_BACKENDS, _available_cpus, document_extraction_async, load_current_tokens_cache_async, meta_extraction, shutdown_extraction_pool, tokens_variant
+from .models import DocumentStatus, DocumentUploadResponse, DocumentWords, DocumentTokens, JobStatus, LibrarySearchResults, SearchResults, SeekResult
+from .search import LibrarySearchUnavailable, remove_library_document_async, search_document_async, search_library_async
+from .storage import content_key, db, init_db, mapping_released, PAYLOAD_ENCODINGS, tokens_payload_path, save_tokens_payloads, update_progress, start_progress_flusher, stop_progress_flusher, insert_document_record_async, list_documents_async, update_document_after_processing_async, get_document_meta_async, delete_document_record_async, find_completed_by_hash_async, count_documents_by_hash_async, tokens_cache_exists_async, delete_tokens_cache_async
+from .textutils import build_cost_prefix, build_page_index, classification_cache_info, ms_per_word, token_at_cost
 
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 UPLOADS_DIR = BASE_DIR / "uploads"
 UPLOADS_DIR.mkdir(parents=True, exist_ok=True)
+# Upload gravado em blocos: memória por upload fica constante
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+MAX_UPLOAD_BYTES = int(os.environ.get("LEITOR_MAX_UPLOAD_MB", "512")) * 1024 * 1024
+# Quanto uma leitura espera o reprocessamento (sem cache) antes de responder 202
+REPROCESS_WAIT_SECONDS = float(os.environ.get("LEITOR_REPROCESS_WAIT_SECONDS", "20"))
+# Montagem de respostas grandes (/tokens, /words): pool próprio, limitado ao número de CPUs,
+# para que janelas pesadas não ocupem o pool de I/O nem disputem o GIL com o event loop
+RESPONSE_THREADS = int(os.environ.get("LEITOR_RESPONSE_THREADS", "0")) or _available_cpus()
+# Itens serializados por vez: trechos curtos devolvem o GIL ao event loop entre um e outro
+RESPONSE_CHUNK_ITEMS = 8192
+_response_executor = ThreadPoolExecutor(max_workers=RESPONSE_THREADS, thread_name_prefix="response")
+# Tokens de um documento concluído só mudam com a versão do tokenizador ou do extrator (ETag cobre isso);
+# o arquivo original nunca muda para um mesmo id
+TOKENS_CACHE_CONTROL = "public, max-age=86400"
+FILE_CACHE_CONTROL = "public, max-age=31536000, immutable"
 
 
 app = FastAPI(title="Leitor Rápido PDF API", version="0.1.0")
 
+# Multipart acrescenta cabeçalhos e delimitadores ao arquivo: folga no limite do corpo
+UPLOAD_BODY_OVERHEAD = 64 * 1024
+UPLOAD_TOO_LARGE = "Arquivo excede o tamanho máximo permitido"
+
+
+class UploadSizeLimit:
+    """Recusa uploads grandes antes de o Starlette gravar o corpo inteiro no arquivo
+    temporário do multipart: pelo Content-Length, sem ler nada, ou contando os bytes
+    conforme chegam (corpo sem Content-Length). O tamanho exato do arquivo continua
+    conferido no handler, enquanto ele é gravado.
+    """
+
+    def __init__(self, app, max_body: int) -> None:
+        self.app = app
+        self.max_body = max_body
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] != "/documents":
+            await self.app(scope, receive, send)
+            return
+        declared = next((value for name, value in scope["headers"] if name == b"content-length"), None)
+        if declared is not None and declared.isdigit() and int(declared) > self.max_body:
+            await JSONResponse({"detail": UPLOAD_TOO_LARGE}, status_code=413)(scope, receive, send)
+            return
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body:
+                    # Interrompe a leitura do formulário; vira 413 como qualquer HTTPException
+                    raise HTTPException(status_code=413, detail=UPLOAD_TOO_LARGE)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+# Antes do CORS: a resposta 413 também leva os cabeçalhos de CORS
+app.add_middleware(UploadSizeLimit, max_body=MAX_UPLOAD_BYTES + UPLOAD_BODY_OVERHEAD)
+
 # CORS para permitir acesso local e via IP de rede
 app.add_middleware(
     CORSMiddleware,
@@ -38,24 +107,89 @@ app.add_middleware(
 )
 
 
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    method = request.method
+    start = time.perf_counter()
+    status_code = 500
+    HTTP_IN_PROGRESS.inc(method=method)
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        HTTP_IN_PROGRESS.dec(method=method)
+        # Rótulo pelo molde da rota ("/documents/{document_id}/tokens"), não pela URL, para não explodir a cardinalidade
+        route = request.scope.get("route")
+        HTTP_REQUEST_SECONDS.observe(
+            time.perf_counter() - start,
+            method=method,
+            route=getattr(route, "path", "unmatched"),
+            status=str(status_code),
+        )
+
+
+@app.get("/metrics")
+async def get_metrics() -> Response:
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
 @app.get("/health")
-def health() -> JSONResponse:
+async def health() -> JSONResponse:
     return JSONResponse({"status": "ok"})
 
 
+@app.get("/cache/stats")
+async def cache_stats() -> JSONResponse:
+    return JSONResponse({**db.stats(), "classification": classification_cache_info()})
+
+
 @app.on_event("startup")
 def on_startup() -> None:
     init_db()
+    start_progress_flusher()
+    ingest_queue.start()
+
+
+@app.on_event("shutdown")
+def on_shutdown() -> None:
+    ingest_queue.stop()
+    shutdown_extraction_pool()
+    stop_progress_flusher()
+
+
+def _queue_full(retry_after: int) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail="Fila de processamento cheia, tente novamente mais tarde",
+        headers={"Retry-After": str(retry_after)},
+    )
+
+
+async def _wait_for_job(job, timeout: float) -> bool:
+    """Espera o job da fila sem bloquear o event loop. O shield impede que o timeout
+    cancele o future compartilhado com as outras requisições que esperam o mesmo job.
+    """
+    try:
+        await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(job.future)), timeout)
+        return True
+    except asyncio.TimeoutError:
+        return False
 
 
 @app.post("/documents", response_model=DocumentUploadResponse, status_code=202)
 async def upload_document(
-    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
+    pdf_backend: Optional[str] = Query(None, description="extrator de PDF (padrão: LEITOR_PDF_BACKEND)"),
 ):
     allowed = {"application/pdf", "text/plain", "text/markdown", "application/epub+zip"}
     if file.content_type not in allowed:
         raise HTTPException(status_code=400, detail="Formato não suportado")
+    if pdf_backend is not None and pdf_backend not in PDF_BACKENDS:
+        raise HTTPException(status_code=400, detail=f"Extrator de PDF indisponível; use um de: {', '.join(PDF_BACKENDS)}")
+    # Recusa cedo, antes de receber o arquivo, se a fila já está cheia
+    if ingest_queue.is_full():
+        raise _queue_full(ingest_queue.retry_after())
 
     document_id = str(uuid.uuid4())
     # Determina extensão correta
@@ -68,129 +202,489 @@ async def upload_document(
         "application/epub+zip": ".epub",
     }
     ext = original_suffix if original_suffix in {".pdf", ".txt", ".md", ".epub"} else mime_to_ext.get(file.content_type, ".bin")
-    dest_path = UPLOADS_DIR / f"{document_id}{ext}"
-
-    content = await file.read()
-    with open(dest_path, "wb") as f:
-        f.write(content)
+    # O extrator fica gravado no documento: reprocessamentos usam o mesmo
+    backend = (pdf_backend or PDF_BACKEND) if ext == ".pdf" else None
+
+    # Grava em blocos num arquivo temporário, calculando o hash na mesma passada
+    tmp_path = UPLOADS_DIR / f"{document_id}{ext}.part"
+    hasher = hashlib.sha256()
+    size = 0
+    try:
+        async with aiofiles.open(tmp_path, "wb") as f:
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > MAX_UPLOAD_BYTES:
+                    raise HTTPException(status_code=413, detail=UPLOAD_TOO_LARGE)
+                hasher.update(chunk)
+                await f.write(chunk)
+        content_hash = hasher.hexdigest()
+        # Armazenamento endereçado por conteúdo: uploads iguais compartilham o mesmo arquivo
+        dest_path = UPLOADS_DIR / f"{content_hash}{ext}"
+        if not await aiofiles.os.path.exists(dest_path):
+            await aiofiles.os.replace(tmp_path, dest_path)
+    finally:
+        if await aiofiles.os.path.exists(tmp_path):
+            try:
+                await aiofiles.os.remove(tmp_path)
+            except Exception:
+                pass
+
+    # Conteúdo já processado no mesmo formato: reaproveita tokens (e o extrator com que foram gerados)
+    existing = await find_completed_by_hash_async(content_hash, ext)
+    if existing is not None and await tokens_cache_exists_async(existing["id"]):
+        shared_backend = (existing["pdf_backend"] or "pdfplumber") if backend else None
+        if pdf_backend is not None and backend and pdf_backend != shared_backend:
+            # Uploads iguais compartilham um único cache de tokens: não dá para ter dois extratores
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=(
+                    f"Este conteúdo já foi processado com o extrator '{shared_backend}' "
+                    f"(documento {existing['id']}); para trocar, use "
+                    f"python -m app.rebuild --pdf-backend {pdf_backend} --ids {existing['id']}"
+                ),
+            )
+        await insert_document_record_async(document_id, file.filename, str(dest_path), file.content_type, status="completed", content_hash=content_hash, pdf_backend=shared_backend)
+        await update_document_after_processing_async(document_id, existing["page_count"], status="completed")
+        return DocumentUploadResponse(document_id=document_id, status="completed")
 
     db[document_id] = {"status": "processing", "words": []}
-    insert_document_record(document_id, file.filename, str(dest_path), file.content_type, status="processing")
+    await insert_document_record_async(document_id, file.filename, str(dest_path), file.content_type, status="processing", content_hash=content_hash, pdf_backend=backend)
 
-    background_tasks.add_task(process_pdf, document_id, str(dest_path))
+    try:
+        ingest_queue.submit(document_id, str(dest_path))
+    except QueueFull as e:
+        # Fila encheu durante o upload: desfaz o registro e o arquivo, se não compartilhado
+        try:
+            del db[document_id]
+        except KeyError:
+            pass
+        await delete_document_record_async(document_id)
+        if await count_documents_by_hash_async(content_hash, ext) == 0 and await aiofiles.os.path.exists(dest_path):
+            try:
+                await aiofiles.os.remove(dest_path)
+            except Exception:
+                pass
+        raise _queue_full(e.retry_after)
 
     return DocumentUploadResponse(document_id=document_id, status="processing")
 
 
 @app.get("/documents")
-def list_all_documents():
-    return list_documents()
+async def list_all_documents():
+    return await list_documents_async()
 
 
 @app.get("/documents/{document_id}/status", response_model=DocumentStatus)
-def get_document_status(document_id: str):
-    if document_id not in db:
+async def get_document_status(document_id: str):
+    entry = db.get(document_id)
+    if entry is None:
         # Pode ter reiniciado o servidor; tenta pegar do meta e indicar status
-        meta = get_document_meta(document_id)
+        meta = await get_document_meta_async(document_id)
         if not meta:
             raise HTTPException(status_code=404, detail="Documento não encontrado")
         status = meta.get("status", "processing")
+        page_count = meta.get("page_count", 0)
         # Caso completed mas tokens não estejam em memória, força word_count 0
-        return DocumentStatus(status=status, word_count=0)
-    entry = db[document_id]
+        return DocumentStatus(status=status, word_count=0, pages_done=page_count if status == "completed" else 0, page_count=page_count)
     words = entry.get("words") or []
     status = entry.get("status", "processing")
     word_count = len(words) if status == "completed" else 0
-    return DocumentStatus(status=status, word_count=word_count)
+    page_count = entry.get("page_count", 0)
+    pages_done = page_count if status == "completed" else entry.get("pages_done", 0)
+    return DocumentStatus(status=status, word_count=word_count, pages_done=pages_done, page_count=page_count)
+
+
+@app.get("/documents/{document_id}/job", response_model=JobStatus)
+async def get_document_job(document_id: str):
+    """Situação do job de processamento do documento na fila de ingestão."""
+    job = ingest_queue.get(document_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Nenhum job para este documento")
+    return JobStatus(**job.to_dict(), position=ingest_queue.position(job))
+
+
+def _as_list(values) -> list:
+    return values.tolist() if hasattr(values, "tolist") else list(values)
+
+
+async def _cached_document_entry(document_id: str, variant: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """Entrada do documento em memória ou, se houver, carregada do cache de tokens
+    (retokenizado antes, se for de outra versão do tokenizador).
+
+    Com `variant` (tokens_variant dos metadados), uma entrada concluída de outra
+    variante — tokens regravados com outro extrator por `python -m app.rebuild`, em
+    outro processo — sai de `db` e é recarregada do disco. O mesmo vale para uma entrada
+    cujo mapeamento já foi fechado (arquivo regravado depois de ela ser carregada).
+    """
+    entry = db.get(document_id)
+    if entry is not None:
+        current = variant is None or entry.get("status") != "completed" or entry.get("variant") == variant
+        if current and not mapping_released(entry):
+            return entry
+        try:
+            del db[document_id]
+        except KeyError:
+            pass
+    cached = await load_current_tokens_cache_async(document_id)
+    if cached is not None:
+        if variant is None:
+            variant = tokens_variant((await document_extraction_async(document_id))[1])
+        tokens = cached.get("tokens", [])
+        token_pages = cached.get("pages", [])
+        page_count = cached.get("page_count", 0)
+        entry = {
+            "status": "completed",
+            "words": [],
+            "tokens": tokens,
+            "token_pages": token_pages,
+            "token_weights": cached.get("weights", []),
+            "page_count": page_count,
+            "page_index": cached.get("page_index") or build_page_index(token_pages, page_count),
+            "token_costs": cached.get("costs"),
+            "mapping": cached.get("mapping"),
+            "variant": variant,
+        }
+        db[document_id] = entry
+        return entry
+    return None
+
+
+async def _load_document_entry(document_id: str, variant: Optional[str] = None) -> Dict[str, Any]:
+    """Entrada do documento em memória; carrega do cache de tokens ou reprocessa do disco.
+
+    O reprocessamento roda na fila de ingestão, com prioridade sobre uploads, e é único
+    por documento: requisições concorrentes esperam o mesmo job. Se ele não terminar em
+    REPROCESS_WAIT_SECONDS, responde 202 com Retry-After. `variant` como em
+    _cached_document_entry.
+    """
+    entry = await _cached_document_entry(document_id, variant)
+    if entry is not None:
+        return entry
+    meta = await get_document_meta_async(document_id)
+    if not meta or not meta.get("file_path") or not await aiofiles.os.path.exists(meta["file_path"]):
+        raise HTTPException(status_code=404, detail="Documento não encontrado")
+    job, created = ingest_queue.join_or_submit(document_id, meta["file_path"], priority=PRIORITY_HIGH, force=True)
+    if created:
+        REPROCESS_ON_MISS.inc()
+    if not await _wait_for_job(job, REPROCESS_WAIT_SECONDS):
+        # O job pode já ter publicado parte dos tokens (entrada "processing" em db)
+        entry = db.get(document_id)
+        if entry is not None:
+            return entry
+        raise HTTPException(
+            status_code=status.HTTP_202_ACCEPTED,
+            detail="Documento em reprocessamento",
+            headers={"Retry-After": str(ingest_queue.retry_after())},
+        )
+    entry = await _cached_document_entry(document_id, variant) if job.status == COMPLETED else None
+    if entry is None:
+        raise HTTPException(status_code=422, detail="Falha ao carregar documento")
+    return entry
 
 
 @app.get("/documents/{document_id}/words", response_model=DocumentWords)
-def get_document_words(document_id: str):
-    if document_id not in db:
-        cached = load_tokens_cache(document_id)
-        if cached is not None:
-            db[document_id] = {
-                "status": "completed",
-                "words": [],
-                "tokens": cached.get("tokens", []),
-                "token_pages": cached.get("pages", []),
-                "token_weights": cached.get("weights", []),
-                "page_count": cached.get("page_count", 0),
-            }
-        else:
-            # tenta reprocessar do disco
-            meta = get_document_meta(document_id)
-            if not meta or not meta.get("file_path") or not os.path.exists(meta["file_path"]):
-                raise HTTPException(status_code=404, detail="Documento não encontrado")
-            try:
-                process_pdf(document_id, meta["file_path"])  # repopula memória
-            except Exception:
-                raise HTTPException(status_code=422, detail="Falha ao carregar documento")
-    entry = db[document_id]
+async def get_document_words(document_id: str):
+    entry = await _load_document_entry(document_id)
     status = entry.get("status", "processing")
     if status != "completed":
         raise HTTPException(status_code=422, detail="Documento ainda não processado")
     words = entry.get("words") or []
-    return DocumentWords(words=words)
+    return await _run_response(lambda: _json_object({"words": _json_array(words, 0, len(words))}))
+
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    """If-None-Match com comparação fraca (ignora o prefixo W/)."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    tags = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return etag.removeprefix("W/") in tags
+
+
+def _not_modified(etag: str, cache_control: str) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag, "Cache-Control": cache_control})
+
+
+def _tokens_etag(meta: Dict[str, Any], variant: str, offset: int, limit: Optional[int], page_from: Optional[int], page_to: Optional[int]) -> str:
+    """ETag estável: hash do conteúdo + variante dos tokens (versões do tokenizador e da
+    camada de palavras, com o extrator de PDF) (+ a janela pedida).
+    Fraca porque a mesma representação é servida com e sem compressão.
+    """
+    tag = f"{content_key(meta['id'], meta.get('content_hash'), meta.get('file_path'))}.t{variant}"
+    if offset or limit is not None or page_from is not None or page_to is not None:
+        tag += f".{offset}-{limit or ''}-{page_from or ''}-{page_to or ''}"
+    return f'W/"{tag}"'
+
+
+def _accepted_payload_encoding(request: Request) -> Optional[str]:
+    accepted = set()
+    for part in request.headers.get("accept-encoding", "").split(","):
+        name, _, params = part.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0"):
+            continue
+        accepted.add(name.strip().lower())
+    for encoding in PAYLOAD_ENCODINGS:
+        if encoding in accepted:
+            return encoding
+    return None
+
+
+def _tokens_payload_file(document_id: str, entry: Dict[str, Any], encoding: str, variant: str) -> Path:
+    """Payload completo comprimido. O processamento e a reconstrução já o gravam; aqui
+    ele só é gerado (na primeira requisição) para documentos anteriores a isso. A
+    entrada já foi conferida contra `variant` (_cached_document_entry).
+    """
+    path = tokens_payload_path(document_id, encoding, variant)
+    if not path.exists():
+        body = _tokens_window_response(entry, 0, None, None, None).body
+        path = save_tokens_payloads(document_id, body, variant)[encoding]
+    return path
 
 
 @app.get("/documents/{document_id}/tokens", response_model=DocumentTokens)
-def get_document_tokens(document_id: str):
-    if document_id not in db:
-        cached = load_tokens_cache(document_id)
-        if cached is not None:
-            db[document_id] = {
-                "status": "completed",
-                "words": [],
-                "tokens": cached.get("tokens", []),
-                "token_pages": cached.get("pages", []),
-                "token_weights": cached.get("weights", []),
-                "page_count": cached.get("page_count", 0),
-            }
-        else:
-            # tenta reprocessar do disco
-            meta = get_document_meta(document_id)
-            if not meta or not meta.get("file_path") or not os.path.exists(meta["file_path"]):
-                raise HTTPException(status_code=404, detail="Documento não encontrado")
-            try:
-                process_pdf(document_id, meta["file_path"])  # repopula memória
-            except Exception:
-                raise HTTPException(status_code=422, detail="Falha ao carregar documento")
-    entry = db[document_id]
+async def get_document_tokens(
+    request: Request,
+    document_id: str,
+    offset: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=1),
+    page_from: Optional[int] = Query(None, ge=1),
+    page_to: Optional[int] = Query(None, ge=1),
+):
+    """Tokens do documento, inteiros ou numa janela.
+
+    - `offset`/`limit`: janela por índice de token.
+    - `page_from`/`page_to`: janela por páginas (inclusive), resolvida pelo índice
+      página -> token; `limit` ainda limita o tamanho da janela. Sozinho, `page_to`
+      corta a janela que começa em `offset`.
+
+    Documentos concluídos respondem com ETag e Cache-Control (304 com If-None-Match).
+    O documento inteiro é servido pré-comprimido (br/gzip) a partir do disco.
+    """
+    meta = await get_document_meta_async(document_id)
+    etag = None
+    variant = tokens_variant(meta_extraction(meta)[1]) if meta else None
+    if meta and meta.get("status") == "completed":
+        # Decide o 304 antes de carregar qualquer token
+        etag = _tokens_etag(meta, variant, offset, limit, page_from, page_to)
+        if _etag_matches(request, etag):
+            return _not_modified(etag, TOKENS_CACHE_CONTROL)
+    entry = await _load_document_entry(document_id, variant)
     status = entry.get("status", "processing")
-    if status != "completed":
+    if status not in ("completed", "processing"):
         raise HTTPException(status_code=422, detail="Documento ainda não processado")
+
+    def window(entry: Dict[str, Any]) -> Response:
+        return _tokens_window_response(entry, offset, limit, page_from, page_to)
+
+    if status != "completed" or etag is None:
+        # Conteúdo ainda crescendo: nada de cache
+        response = await _run_entry_response(document_id, variant, entry, window)
+        response.headers["Cache-Control"] = "no-store"
+        return response
+    headers = {"ETag": etag, "Cache-Control": TOKENS_CACHE_CONTROL, "Vary": "Accept-Encoding"}
+    full = not offset and limit is None and page_from is None and page_to is None
+    encoding = _accepted_payload_encoding(request) if full else None
+    if encoding is not None:
+        path = await _run_entry_response(
+            document_id, variant, entry, lambda entry: _tokens_payload_file(document_id, entry, encoding, variant)
+        )
+        return FileResponse(path, media_type="application/json", headers={**headers, "Content-Encoding": encoding})
+    # Fatiar o mmap e serializar a janela é o trabalho pesado: roda fora do event loop
+    response = await _run_entry_response(document_id, variant, entry, window)
+    response.headers.update(headers)
+    return response
+
+
+def _run_response(fn, *args) -> "asyncio.Future[Response]":
+    return asyncio.get_running_loop().run_in_executor(_response_executor, fn, *args)
+
+
+async def _run_entry_response(document_id: str, variant: Optional[str], entry: Dict[str, Any], fn):
+    """`fn(entry)` fora do event loop. Se o cache mapeado da entrada foi regravado ou
+    apagado no meio da leitura (`release_mapped` fecha o mapeamento e as visões dão
+    ValueError), recarrega a entrada e tenta de novo, uma vez.
+    """
+    try:
+        return await _run_response(fn, entry)
+    except ValueError:
+        if not mapping_released(entry):
+            raise
+    entry = await _load_document_entry(document_id, variant)
+    return await _run_response(fn, entry)
+
+
+def _json_array(values, start: int, end: int) -> bytes:
+    """Serializa values[start:end] como array JSON, em trechos de RESPONSE_CHUNK_ITEMS.
+    Funciona com listas e com as visões do cache binário (só o trecho é materializado).
+    """
+    parts = []
+    for i in range(start, end, RESPONSE_CHUNK_ITEMS):
+        chunk = values[i:min(end, i + RESPONSE_CHUNK_ITEMS)]
+        parts.append(pydantic_core.to_json(_as_list(chunk))[1:-1])
+    return b"[" + b",".join(parts) + b"]"
+
+
+def _json_object(fields: Dict[str, Any]) -> Response:
+    # Campos já serializados (bytes) entram como estão; os demais são escalares
+    body = b",".join(
+        pydantic_core.to_json(key) + b":" + (value if isinstance(value, bytes) else pydantic_core.to_json(value))
+        for key, value in fields.items()
+    )
+    return Response(b"{" + body + b"}", media_type="application/json")
+
+
+def _tokens_window_response(entry: Dict[str, Any], offset: int, limit: Optional[int], page_from: Optional[int], page_to: Optional[int]) -> Response:
+    status = entry.get("status", "processing")
     tokens = entry.get("tokens") or []
-    token_pages = entry.get("token_pages") or [1] * len(tokens)
-    token_weights = entry.get("token_weights") or [1] * len(tokens)
+    # Durante o processamento serve apenas o trecho já publicado
+    complete = status == "completed"
+    total = len(tokens) if complete else entry.get("available", 0)
+    token_pages = entry.get("token_pages") or [1] * total
+    token_weights = entry.get("token_weights") or [1] * total
     page_count = entry.get("page_count", 0)
-    return DocumentTokens(tokens=tokens, pages=token_pages, page_count=page_count, weights=token_weights)
+
+    end = total
+    if page_from is not None or page_to is not None:
+        page_index = entry.get("page_index") or build_page_index(token_pages[:total], page_count)
+        last_page = len(page_index) - 1
+        if page_from is not None:
+            offset = page_index[page_from - 1] if page_from <= last_page else total
+        if page_to is not None:
+            end = page_index[min(page_to, last_page)]
+    offset = min(offset, total)
+    if limit is not None:
+        end = min(end, offset + limit)
+    end = max(end, offset)
+    # Mesmo formato de DocumentTokens, montado direto em bytes a partir da janela
+    return _json_object({
+        "tokens": _json_array(tokens, offset, end),
+        "pages": _json_array(token_pages, offset, end),
+        "page_count": page_count,
+        "weights": _json_array(token_weights, offset, end),
+        "offset": offset,
+        "total": total,
+        "complete": complete,
+    })
+
+
+@app.get("/search", response_model=LibrarySearchResults)
+async def search_library_endpoint(
+    q: str = Query(..., min_length=1),
+    offset: int = Query(0, ge=0),
+    limit: int = Query(20, ge=1, le=100),
+):
+    """Busca em todos os documentos concluídos, do trecho mais relevante ao menos.
+
+    Termos soltos precisam aparecer todos no trecho; "entre aspas" vira frase.
+    """
+    try:
+        return await search_library_async(q, offset, limit)
+    except LibrarySearchUnavailable:
+        raise HTTPException(status_code=503, detail="Busca na biblioteca indisponível")
+
+
+@app.get("/documents/{document_id}/search", response_model=SearchResults)
+async def search_in_document(
+    document_id: str,
+    q: str = Query(..., min_length=1),
+    offset: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=500),
+):
+    """Ocorrências de `q` no documento (frase, sem diferenciar acentos nem maiúsculas).
+
+    Responde pelo índice invertido em disco, sem carregar os tokens em memória.
+    """
+    meta = await get_document_meta_async(document_id)
+    if not meta:
+        raise HTTPException(status_code=404, detail="Documento não encontrado")
+    if meta.get("status") != "completed":
+        raise HTTPException(status_code=422, detail="Documento ainda não processado")
+    result = await search_document_async(document_id, q, offset, limit)
+    if result is None:
+        # Sem cache de tokens: reprocessa como as demais leituras e tenta de novo
+        await _load_document_entry(document_id)
+        result = await search_document_async(document_id, q, offset, limit)
+    if result is None:
+        raise HTTPException(status_code=422, detail="Falha ao carregar documento")
+    return result
+
+
+def _seek(entry: Dict[str, Any], page: Optional[int], seconds: Optional[float], wpm: float) -> Dict[str, Any]:
+    tokens = entry.get("tokens") or []
+    token_pages = entry.get("token_pages") or []
+    costs = entry.get("token_costs")
+    if costs is None or len(costs) != len(tokens) + 1:
+        costs = build_cost_prefix(tokens, entry.get("token_weights") or [1] * len(tokens))
+        entry["token_costs"] = costs
+    scale = ms_per_word(wpm) / 1000
+    if page is not None:
+        page_index = entry.get("page_index") or build_page_index(token_pages, entry.get("page_count", 0))
+        index = page_index[min(page, len(page_index) - 1) - 1] if len(page_index) > 1 else 0
+        index = min(index, max(0, len(tokens) - 1))
+    else:
+        index = token_at_cost(costs, seconds / scale)
+    return {
+        "token_index": index,
+        "page": token_pages[index] if index < len(token_pages) else 1,
+        "seconds": costs[index] * scale,
+        "total_seconds": costs[-1] * scale,
+    }
+
+
+@app.get("/documents/{document_id}/seek", response_model=SeekResult)
+async def seek_document(
+    document_id: str,
+    page: Optional[int] = Query(None, ge=1),
+    seconds: Optional[float] = Query(None, ge=0),
+    wpm: float = Query(300, gt=0),
+):
+    """Token para retomar a leitura: primeiro token da `page` ou o token lido após `seconds`
+    de leitura a `wpm` palavras por minuto (mesmo cálculo de tempo do player).
+
+    Ambos por consulta direta (índice página -> token, busca binária na soma acumulada
+    dos custos), sem percorrer os tokens. `seconds` na resposta é o tempo até o token.
+    """
+    if (page is None) == (seconds is None):
+        raise HTTPException(status_code=400, detail="Informe page ou seconds")
+    entry = await _load_document_entry(document_id)
+    if entry.get("status") != "completed":
+        raise HTTPException(status_code=422, detail="Documento ainda não processado")
+    return await _run_entry_response(document_id, None, entry, lambda entry: _seek(entry, page, seconds, wpm))
 
 
 @app.get("/documents/{document_id}/file")
-def get_document_file(document_id: str):
+async def get_document_file(request: Request, document_id: str):
     # Procurar em memória e depois em meta
     entry = db.get(document_id)
+    meta = await get_document_meta_async(document_id)
     file_path = entry.get("file_path") if entry else None
-    if not file_path:
-        meta = get_document_meta(document_id)
-        if meta:
-            file_path = meta.get("file_path")
-    if not file_path or not os.path.exists(file_path):
+    if not file_path and meta:
+        file_path = meta.get("file_path")
+    if not file_path or not await aiofiles.os.path.exists(file_path):
         raise HTTPException(status_code=404, detail="Arquivo não disponível")
+    headers = {"Accept-Ranges": "bytes", "Cache-Control": FILE_CACHE_CONTROL}
+    # Arquivo endereçado por conteúdo: o próprio hash é a ETag
+    content_hash = (meta or {}).get("content_hash")
+    if content_hash:
+        headers["ETag"] = f'"{content_hash}"'
+        if _etag_matches(request, headers["ETag"]):
+            return _not_modified(headers["ETag"], FILE_CACHE_CONTROL)
     # Determina o tipo MIME correto
-    meta = get_document_meta(document_id)
     mime = (meta or {}).get("mime_type")
     if not mime:
         guessed, _ = mimetypes.guess_type(file_path)
         mime = guessed or "application/octet-stream"
-    headers = {"Accept-Ranges": "bytes"}
     return FileResponse(file_path, media_type=mime, headers=headers)
 
 
 @app.post("/documents/{document_id}/progress")
-def set_last_read_page(document_id: str, page: int, token_index: int | None = None):
-    meta = get_document_meta(document_id)
+async def set_last_read_page(document_id: str, page: int, token_index: int | None = None):
+    meta = await get_document_meta_async(document_id)
     if not meta:
         raise HTTPException(status_code=404, detail="Documento não encontrado")
     if page < 1 or (meta.get("page_count") and page > meta.get("page_count")):
@@ -200,25 +694,41 @@ def set_last_read_page(document_id: str, page: int, token_index: int | None = No
 
 
 @app.delete("/documents/{document_id}")
-def delete_document(document_id: str):
-    meta = get_document_meta(document_id)
+async def delete_document(document_id: str):
+    meta = await get_document_meta_async(document_id)
     if not meta:
         raise HTTPException(status_code=404, detail="Documento não encontrado")
     file_path = meta.get("file_path")
+    content_hash = meta.get("content_hash")
+    # interrompe o processamento (tira da fila ou para entre páginas) antes de apagar arquivos
+    job = ingest_queue.get(document_id)
+    if ingest_queue.cancel(document_id):
+        await _wait_for_job(job, CANCEL_WAIT_SECONDS)
     # remove do armazenamento em memória
     if document_id in db:
         try:
             del db[document_id]
         except Exception:
             pass
-    # remove do disco
-    if file_path and os.path.exists(file_path):
+    # remove do disco apenas se nenhum outro documento compartilha o conteúdo
+    ext = Path(file_path or "").suffix.lower()
+    shared = content_hash is not None and await count_documents_by_hash_async(content_hash, ext) > 1
+    if not shared:
+        try:
+            await remove_library_document_async(document_id)
+        except Exception:
+            pass
         try:
-            os.remove(file_path)
+            await delete_tokens_cache_async(document_id)
         except Exception:
             pass
+        if file_path and await aiofiles.os.path.exists(file_path):
+            try:
+                await aiofiles.os.remove(file_path)
+            except Exception:
+                pass
     # remove do banco
-    delete_document_record(document_id)
+    await delete_document_record_async(document_id)
     return JSONResponse({"ok": True}, status_code=status.HTTP_200_OK)
 
 if __name__ == "__main__":
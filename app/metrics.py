@@ -0,0 +1,238 @@
+"""Métricas de processo no formato texto do Prometheus, sem dependências externas.
+
+Contadores, gauges e histogramas com rótulos, protegidos por lock. O custo por
+observação é um lock e uma busca em dicionário, barato o suficiente para ficar
+sempre ligado. Tudo é exposto em GET /metrics.
+"""
+import bisect
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = []
+    for name, value in zip(names, values):
+        escaped = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        parts.append(f'{name}="{escaped}"')
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), fn: Callable[[], float] | None = None) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        # Valor calculado na coleta (ex.: estatísticas do cache em memória)
+        self._fn = fn
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        if self._fn is not None:
+            try:
+                lines.append(f"{self.name} {_format_value(self._fn())}")
+            except Exception:
+                pass
+            return lines
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), fn: Callable[[], float] | None = None) -> None:
+        super().__init__(name, help, labelnames, fn)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(v)}" for key, v in items]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), fn: Callable[[], float] | None = None) -> None:
+        super().__init__(name, help, labelnames, fn)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    @contextmanager
+    def track_inprogress(self, **labels: str) -> Iterator[None]:
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(v)}" for key, v in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Por conjunto de rótulos: [contagem por bucket (não cumulativa) + overflow, soma]
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            data = self._values.get(key)
+            if data is None:
+                data = ([0] * (len(self.buckets) + 1), [0.0])
+                self._values[key] = data
+            data[0][idx] += 1
+            data[1][0] += value
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels: str) -> int:
+        data = self._values.get(self._key(labels))
+        return sum(data[0]) if data else 0
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = [(key, list(counts), total[0]) for key, (counts, total) in self._values.items()]
+        lines: List[str] = []
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, c in zip(self.buckets + (float("inf"),), counts):
+                cumulative += c
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def counter(name: str, help: str, labelnames: Sequence[str] = (), fn: Callable[[], float] | None = None) -> Counter:
+    return REGISTRY.register(Counter(name, help, labelnames, fn))  # type: ignore[return-value]
+
+
+def gauge(name: str, help: str, labelnames: Sequence[str] = (), fn: Callable[[], float] | None = None) -> Gauge:
+    return REGISTRY.register(Gauge(name, help, labelnames, fn))  # type: ignore[return-value]
+
+
+def histogram(name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, help, labelnames, buckets))  # type: ignore[return-value]
+
+
+def render() -> str:
+    return REGISTRY.render()
+
+
+# Métricas da aplicação, definidas aqui para que processing/storage/main compartilhem as mesmas instâncias
+STAGE_SECONDS = histogram(
+    "leitor_processing_stage_seconds",
+    "Tempo por estágio do processamento de documentos",
+    ("stage", "format"),
+)
+DOCUMENT_SECONDS = histogram(
+    "leitor_document_processing_seconds",
+    "Tempo total de processamento por documento",
+    ("format",),
+)
+DOCUMENTS_PROCESSED = counter("leitor_documents_processed_total", "Documentos processados", ("format", "status"))
+PAGES_PROCESSED = counter("leitor_pages_processed_total", "Páginas extraídas", ("format",))
+TOKENS_PRODUCED = counter("leitor_tokens_produced_total", "Tokens gerados", ("format",))
+PROCESSING_IN_PROGRESS = gauge("leitor_processing_in_progress", "Documentos sendo processados agora")
+
+STORAGE_SECONDS = histogram("leitor_storage_seconds", "Tempo das operações de armazenamento", ("operation",))
+TOKENS_CACHE_LOOKUPS = counter("leitor_tokens_cache_lookups_total", "Leituras do cache de tokens em disco", ("result",))
+REPROCESS_ON_MISS = counter("leitor_reprocess_on_miss_total", "Documentos reprocessados por falta de cache")
+RETOKENIZED = counter("leitor_retokenized_total", "Caches de tokens de outra versão do tokenizador refeitos", ("source",))
+
+HTTP_REQUEST_SECONDS = histogram("leitor_http_request_seconds", "Duração das requisições HTTP", ("method", "route", "status"))
+HTTP_IN_PROGRESS = gauge("leitor_http_requests_in_progress", "Requisições HTTP em andamento", ("method",))
+
+
+def timed(metric: Histogram, **labels: str) -> Callable:
+    """Decorador: observa a duração de cada chamada no histograma."""
+    def decorator(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                metric.observe(time.perf_counter() - start, **labels)
+        return wrapper
+    return decorator
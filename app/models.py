@@ -1,10 +1,12 @@
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional
 
 
 class DocumentStatus(BaseModel):
     status: str
     word_count: int
+    pages_done: int = 0
+    page_count: int = 0
 
 
 class DocumentWords(BaseModel):
@@ -21,5 +23,53 @@ class DocumentTokens(BaseModel):
     pages: List[int]
     page_count: int
     weights: List[int]
+    offset: int = 0
+    total: int = 0
+    complete: bool = True
 
 
+class JobStatus(BaseModel):
+    document_id: str
+    status: str
+    priority: int
+    position: int = -1
+    enqueued_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    error: Optional[str] = None
+
+
+class SearchHit(BaseModel):
+    token_index: int
+    page: int
+    snippet: str
+
+
+class SearchResults(BaseModel):
+    query: str
+    terms: List[str]
+    total: int
+    offset: int = 0
+    hits: List[SearchHit]
+
+
+class LibraryHit(BaseModel):
+    document_id: str
+    filename: str
+    token_index: int
+    snippet: str
+    score: float
+
+
+class LibrarySearchResults(BaseModel):
+    query: str
+    total: int
+    offset: int = 0
+    hits: List[LibraryHit]
+
+
+class SeekResult(BaseModel):
+    token_index: int
+    page: int
+    seconds: float
+    total_seconds: float
@@ -1,128 +1,929 @@
+import logging
+import multiprocessing
 import os
-from typing import List, Tuple
+import posixpath
+import re
+import threading
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from html.parser import HTMLParser
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Tuple
 from pathlib import Path
+from urllib.parse import unquote
+from xml.etree import ElementTree
 
 import pdfplumber
 
-from .storage import db, update_document_after_processing, save_tokens_cache
-from .textutils import group_words_with_pages, preprocess_hyphens
+from .metrics import DOCUMENT_SECONDS, DOCUMENTS_PROCESSED, PAGES_PROCESSED, PROCESSING_IN_PROGRESS, RETOKENIZED, STAGE_SECONDS, TOKENS_PRODUCED
+from .search import index_library_document, remove_library_document, save_search_index
+from .storage import RawWordsWriter, _cache_key, _async_version, build_tokens_payload, count_documents_by_hash, db, delete_tokens_cache, get_document_meta, iter_raw_words, load_tokens_cache, raw_words_exists, raw_words_path, update_document_after_processing, save_tokens_cache, save_tokens_payloads
+from .textutils import TOKENIZER_VERSION, build_cost_prefix, build_page_index, iter_tokens
 
 
-def _extract_words_with_pages_pdf(file_path: str) -> Tuple[List[str], List[int], int]:
+def _available_cpus() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # Windows/macOS
+        return os.cpu_count() or 1
+
+
+# Extração paralela de PDF: número de processos (compartilhados por todos os documentos)
+# e tamanho mínimo para compensar o envio das páginas. Configurável por variável de ambiente.
+PDF_WORKERS = int(os.environ.get("LEITOR_PDF_WORKERS", "0")) or _available_cpus()
+PDF_PARALLEL_MIN_PAGES = int(os.environ.get("LEITOR_PDF_PARALLEL_MIN_PAGES", "32"))
+PDF_CHUNK_PAGES = int(os.environ.get("LEITOR_PDF_CHUNK_PAGES", "16"))
+# Processamento incremental: tokens prontos são publicados a cada N páginas extraídas
+PUBLISH_BATCH_PAGES = int(os.environ.get("LEITOR_PUBLISH_BATCH_PAGES", "8"))
+# Versão da extração (_open_pages): incrementar quando as palavras por página mudarem.
+# Faz parte do nome da camada de palavras extraídas, que deixa de valer.
+EXTRACTOR_VERSION = 1
+# Documentos acima deste tempo total geram log com o tempo de cada estágio
+SLOW_DOCUMENT_SECONDS = float(os.environ.get("LEITOR_SLOW_DOCUMENT_SECONDS", "10"))
+
+logger = logging.getLogger(__name__)
+
+
+class ProcessingCancelled(Exception):
+    """Processamento interrompido a pedido (DELETE do documento ou desligamento)."""
+
+
+def _split_page_text(page_text: str) -> List[str]:
+    normalized = page_text.replace("\r\n", " ").replace("\n", " ")
+    return [w for w in normalized.split(" ") if w]
+
+
+# Extratores de PDF registrados por nome. Cada um informa o total de páginas e devolve o
+# texto de um intervalo [start, end) de páginas (0-based); a divisão em palavras é comum.
+# O nome (e não a função) é o que vai para os processos worker e para o banco.
+class PdfBackend:
+    def __init__(self, name: str, count_pages: Callable[[str], int], iter_page_texts: Callable[[str, int, int], Iterator[str]]) -> None:
+        self.name = name
+        self.count_pages = count_pages
+        self.iter_page_texts = iter_page_texts
+
+
+PDF_BACKENDS: Dict[str, PdfBackend] = {}
+
+
+def register_pdf_backend(name: str, count_pages: Callable[[str], int], iter_page_texts: Callable[[str, int, int], Iterator[str]]) -> None:
+    PDF_BACKENDS[name] = PdfBackend(name, count_pages, iter_page_texts)
+
+
+def _pdfplumber_count_pages(file_path: str) -> int:
+    with pdfplumber.open(file_path) as pdf:
+        return len(pdf.pages)
+
+
+def _pdfplumber_page_texts(file_path: str, start: int, end: int) -> Iterator[str]:
+    with pdfplumber.open(file_path) as pdf:
+        for page in pdf.pages[start:end]:
+            yield page.extract_text() or ""
+
+
+register_pdf_backend("pdfplumber", _pdfplumber_count_pages, _pdfplumber_page_texts)
+
+# pypdfium2: camada de texto do PDFium, muito mais rápida; vem como dependência do pdfplumber
+try:
+    import pypdfium2  # type: ignore
+except Exception:  # opcional
+    pypdfium2 = None
+
+if pypdfium2 is not None:
+    def _pdfium_count_pages(file_path: str) -> int:
+        pdf = pypdfium2.PdfDocument(file_path)
+        try:
+            return len(pdf)
+        finally:
+            pdf.close()
+
+    def _pdfium_page_texts(file_path: str, start: int, end: int) -> Iterator[str]:
+        pdf = pypdfium2.PdfDocument(file_path)
+        try:
+            for index in range(start, min(end, len(pdf))):
+                page = pdf[index]
+                try:
+                    textpage = page.get_textpage()
+                    try:
+                        # Hífen de quebra de linha: o PDFium já junta as metades e deixa U+FFFE no meio
+                        yield textpage.get_text_range().replace("\ufffe\r\n", "").replace("\ufffe", "")
+                    finally:
+                        textpage.close()
+                finally:
+                    page.close()
+        finally:
+            pdf.close()
+
+    register_pdf_backend("pypdfium2", _pdfium_count_pages, _pdfium_page_texts)
+
+# pdfminer.six puro (o pdfplumber roda sobre ele), sem a análise de ordem dos blocos
+try:
+    from pdfminer.high_level import extract_pages as _pdfminer_extract_pages
+    from pdfminer.layout import LAParams, LTTextContainer
+    from pdfminer.pdfpage import PDFPage
+except Exception:  # opcional
+    _pdfminer_extract_pages = None
+
+if _pdfminer_extract_pages is not None:
+    PDFMINER_LAPARAMS = {"line_margin": 0.5, "char_margin": 2.0, "word_margin": 0.1, "boxes_flow": None}
+
+    def _pdfminer_count_pages(file_path: str) -> int:
+        with open(file_path, "rb") as f:
+            return sum(1 for _ in PDFPage.get_pages(f))
+
+    def _pdfminer_page_texts(file_path: str, start: int, end: int) -> Iterator[str]:
+        for layout in _pdfminer_extract_pages(file_path, page_numbers=range(start, end), laparams=LAParams(**PDFMINER_LAPARAMS)):
+            yield "".join(element.get_text() for element in layout if isinstance(element, LTTextContainer))
+
+    register_pdf_backend("pdfminer", _pdfminer_count_pages, _pdfminer_page_texts)
+
+
+def _default_pdf_backend() -> str:
+    name = os.environ.get("LEITOR_PDF_BACKEND", "pdfplumber")
+    if name not in PDF_BACKENDS:
+        logger.warning("LEITOR_PDF_BACKEND=%s indisponível; usando pdfplumber", name)
+        return "pdfplumber"
+    return name
+
+
+# Extrator dos novos uploads de PDF; cada upload pode pedir outro (POST /documents?pdf_backend=)
+PDF_BACKEND = _default_pdf_backend()
+
+
+# Processos de extração (PDF/EPUB) compartilhados por todos os documentos, criados na
+# primeira extração paralela e encerrados no desligamento. spawn em vez de fork: o
+# servidor tem threads (workers da fila, flusher do progresso, pools de I/O) e um filho
+# criado por fork pode herdar um lock preso por uma delas e travar.
+_extraction_pool: Optional[ProcessPoolExecutor] = None
+_extraction_pool_lock = threading.Lock()
+
+
+def _get_extraction_pool() -> ProcessPoolExecutor:
+    global _extraction_pool
+    with _extraction_pool_lock:
+        if _extraction_pool is None:
+            _extraction_pool = ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _extraction_pool
+
+
+def shutdown_extraction_pool() -> None:
+    """Encerra os processos de extração; a próxima extração paralela cria outros."""
+    global _extraction_pool
+    with _extraction_pool_lock:
+        pool, _extraction_pool = _extraction_pool, None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def _map_extraction(fn: Callable[..., Any], calls: List[Tuple[Any, ...]], workers: int) -> Iterator[Any]:
+    """`fn(*args)` para cada `args` de `calls` nos processos de extração, em ordem.
+
+    No máximo 2 * `workers` chamadas do documento em andamento (a memória não cresce com
+    o tamanho do arquivo e um documento não ocupa a fila do pool inteira). Ao sair — fim,
+    erro ou cancelamento do processamento — as que ainda não começaram são canceladas.
+    """
+    global _extraction_pool
+    pool = _get_extraction_pool()
+    pending: Deque[Future] = deque()
+    try:
+        for args in calls:
+            pending.append(pool.submit(fn, *args))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    except BrokenProcessPool:
+        # Um processo morreu (ex.: falta de memória): o próximo documento cria outro pool
+        with _extraction_pool_lock:
+            if _extraction_pool is pool:
+                _extraction_pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+        raise
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def _extract_pdf_page_range(file_path: str, start: int, end: int, backend: str = "pdfplumber") -> List[List[str]]:
+    """Extrai as palavras das páginas [start, end) (0-based). Roda em processo worker."""
+    return [_split_page_text(text) for text in PDF_BACKENDS[backend].iter_page_texts(file_path, start, end)]
+
+
+def _iter_pdf_pages_serial(file_path: str, page_count: int, backend: str) -> Iterator[Tuple[int, List[str]]]:
+    for idx, text in enumerate(PDF_BACKENDS[backend].iter_page_texts(file_path, 0, page_count)):
+        yield idx + 1, _split_page_text(text)  # 1-based
+
+
+def _iter_pdf_pages_parallel(file_path: str, page_count: int, workers: int, backend: str) -> Iterator[Tuple[int, List[str]]]:
+    # Blocos de páginas nos processos de extração; voltam na ordem das páginas
+    chunk = max(1, min(PDF_CHUNK_PAGES, -(-page_count // workers)))
+    starts = list(range(0, page_count, chunk))
+    calls = [(file_path, s, min(s + chunk, page_count), backend) for s in starts]
+    for start, chunk_pages in zip(starts, _map_extraction(_extract_pdf_page_range, calls, workers)):
+        for offset, page_words in enumerate(chunk_pages):
+            yield start + offset + 1, page_words
+
+
+def _open_pages_pdf(file_path: str, workers: int | None = None, backend: str | None = None) -> Tuple[int, Iterator[Tuple[int, List[str]]]]:
+    """Retorna (page_count, iterador de (página, palavras)) na ordem das páginas."""
+    workers = workers if workers is not None else PDF_WORKERS
+    backend = backend or PDF_BACKEND
+    if backend not in PDF_BACKENDS:
+        raise ValueError(f"Extrator de PDF indisponível: {backend}")
+    page_count = PDF_BACKENDS[backend].count_pages(file_path)
+    if workers <= 1 or page_count < PDF_PARALLEL_MIN_PAGES:
+        return page_count, _iter_pdf_pages_serial(file_path, page_count, backend)
+    return page_count, _iter_pdf_pages_parallel(file_path, page_count, workers, backend)
+
+
+def _extract_words_with_pages_pdf(file_path: str, workers: int | None = None, backend: str | None = None) -> Tuple[List[str], List[int], int]:
     words: List[str] = []
     pages: List[int] = []
-    page_count = 0
-    with pdfplumber.open(file_path) as pdf:
-        page_count = len(pdf.pages)
-        for idx, page in enumerate(pdf.pages):
-            page_num = idx + 1  # 1-based
-            page_text = page.extract_text() or ""
-            normalized = page_text.replace("\r\n", " ").replace("\n", " ")
-            page_words = [w for w in normalized.split(" ") if w]
-            words.extend(page_words)
-            pages.extend([page_num] * len(page_words))
+    page_count, page_iter = _open_pages_pdf(file_path, workers, backend)
+    for page_num, page_words in page_iter:
+        words.extend(page_words)
+        pages.extend([page_num] * len(page_words))
     return words, pages, page_count
 
 
-def _extract_words_with_pages_txt(file_path: str) -> Tuple[List[str], List[int], int]:
+# TXT e Markdown: leitura em blocos de tamanho fixo, sem carregar o arquivo inteiro.
+# As páginas têm TEXT_WORDS_PER_PAGE palavras e saem conforme as palavras são lidas.
+TEXT_WORDS_PER_PAGE = 300
+TEXT_CHUNK_CHARS = 256 * 1024
+# Markdown é renderizado em trechos de ~MD_BATCH_CHARS, sempre cortados em linha em branco
+MD_BATCH_CHARS = 64 * 1024
+_MD_FENCE_RE = re.compile(r"^ {0,3}(```|~~~)")
+_MD_REFERENCE_RE = re.compile(r"^ {0,3}\[[^\]]+\]:\s*\S")
+
+
+def _paginate(word_lists: Iterable[List[str]]) -> Iterator[Tuple[int, List[str]]]:
+    """Reagrupa listas de palavras em páginas de TEXT_WORDS_PER_PAGE palavras."""
+    page = 1
+    batch: List[str] = []
+    for words in word_lists:
+        i = 0
+        while i < len(words):
+            take = TEXT_WORDS_PER_PAGE - len(batch)
+            batch.extend(words[i:i + take])
+            i += take
+            if len(batch) == TEXT_WORDS_PER_PAGE:
+                yield page, batch
+                page += 1
+                batch = []
+    if batch:
+        yield page, batch
+
+
+def _iter_txt_words(file_path: str) -> Iterator[List[str]]:
+    """Palavras do arquivo, bloco a bloco; mesmo resultado de ler tudo e separar por
+    espaço e quebra de linha (o modo texto já converte \r\n e \r em \n, inclusive
+    quando o par cai na divisa entre blocos). A palavra incompleta no fim de um bloco
+    passa para o próximo.
+    """
+    carry = ""
     with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
-        text = f.read()
-    normalized = text.replace("\r\n", " ").replace("\n", " ")
-    words = [w for w in normalized.split(" ") if w]
-    words_per_page = 300
-    pages = [max(1, (i // words_per_page) + 1) for i in range(len(words))]
-    page_count = max(pages) if pages else 0
-    return words, pages, page_count
+        while True:
+            chunk = f.read(TEXT_CHUNK_CHARS)
+            if not chunk:
+                break
+            buf = carry + chunk
+            cut = max(buf.rfind(" "), buf.rfind("\n")) + 1
+            carry = buf[cut:]
+            if cut:
+                yield [w for w in buf[:cut].replace("\n", " ").split(" ") if w]
+    if carry:
+        yield [carry]
 
 
-def _extract_words_with_pages_md(file_path: str) -> Tuple[List[str], List[int], int]:
+def _iter_md_batches(file_path: str) -> Iterator[str]:
+    """Trechos do Markdown cortados em linhas em branco fora de blocos de código cercados."""
+    lines: List[str] = []
+    size = 0
+    fence = None
     with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
-        md = f.read()
+        for line in f:
+            lines.append(line)
+            size += len(line)
+            m = _MD_FENCE_RE.match(line)
+            if m:
+                fence = None if fence == m.group(1) else (fence or m.group(1))
+            if fence is None and size >= MD_BATCH_CHARS and not line.strip():
+                yield "".join(lines)
+                lines = []
+                size = 0
+    if lines:
+        yield "".join(lines)
+
+
+def _md_reference_definitions(file_path: str) -> str:
+    """Definições de links por referência ([id]: url), que valem para o documento inteiro."""
+    with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
+        return "".join(line for line in f if _MD_REFERENCE_RE.match(line))
+
+
+def _iter_md_words(file_path: str) -> Iterator[List[str]]:
+    """Palavras do texto renderizado, trecho a trecho; separadas como no TXT e no PDF
+    (espaço e quebra de linha: tabulações e espaços não separáveis ficam na palavra).
+    """
     try:
-        from markdown import markdown  # type: ignore
-        from bs4 import BeautifulSoup  # type: ignore
-        html = markdown(md)
-        text = BeautifulSoup(html, "html.parser").get_text(separator=" ")
+        from markdown import Markdown  # type: ignore
     except Exception:
-        text = md.replace("#", " ").replace("*", " ").replace("_", " ")
-    normalized = text.replace("\r\n", " ").replace("\n", " ")
-    words = [w for w in normalized.split(" ") if w]
-    words_per_page = 300
-    pages = [max(1, (i // words_per_page) + 1) for i in range(len(words))]
-    page_count = max(pages) if pages else 0
+        Markdown = None
+    if Markdown is None:
+        for batch in _iter_md_batches(file_path):
+            yield _split_page_text(batch.replace("#", " ").replace("*", " ").replace("_", " "))
+        return
+    md = Markdown()
+    # As referências ficam na instância entre as chamadas de convert
+    md.convert(_md_reference_definitions(file_path))
+    for batch in _iter_md_batches(file_path):
+        yield _split_page_text(_html_to_text(md.convert(batch).encode("utf-8")))
+
+
+def _collect_pages(page_iter: Iterator[Tuple[int, List[str]]]) -> Tuple[List[str], List[int], int]:
+    words: List[str] = []
+    pages: List[int] = []
+    page_count = 0
+    for page_count, page_words in page_iter:
+        words.extend(page_words)
+        pages.extend([page_count] * len(page_words))
     return words, pages, page_count
 
 
-def _extract_words_with_pages_epub(file_path: str) -> Tuple[List[str], List[int], int]:
+def _extract_words_with_pages_txt(file_path: str) -> Tuple[List[str], List[int], int]:
+    return _collect_pages(_paginate(_iter_txt_words(file_path)))
+
+
+def _extract_words_with_pages_md(file_path: str) -> Tuple[List[str], List[int], int]:
+    return _collect_pages(_paginate(_iter_md_words(file_path)))
+
+
+# EPUB: capítulos lidos do zip na ordem do spine, sob demanda, sem carregar o livro
+# inteiro. Cada capítulo começa numa página nova e capítulos longos são quebrados a cada
+# EPUB_WORDS_PER_PAGE palavras, para que os saltos de página sigam a estrutura do livro.
+# Livros grandes têm os capítulos convertidos em paralelo (processos, como o PDF).
+EPUB_WORDS_PER_PAGE = 300
+EPUB_PARALLEL_MIN_BYTES = int(os.environ.get("LEITOR_EPUB_PARALLEL_MIN_KB", "4096")) * 1024
+_HTML_MEDIA_TYPES = ("application/xhtml+xml", "text/html")
+_SKIPPED_HTML_TAGS = ("head", "script", "style")
+
+try:
+    from lxml import etree as _lxml_etree  # type: ignore
+except Exception:  # opcional: sem lxml, usa o HTMLParser da biblioteca padrão
+    _lxml_etree = None
+
+
+class _HTMLTextCollector(HTMLParser):
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        self.parts: List[str] = []
+        self._skip = 0
+
+    def handle_starttag(self, tag, attrs) -> None:
+        if tag in _SKIPPED_HTML_TAGS:
+            self._skip += 1
+
+    def handle_endtag(self, tag) -> None:
+        if tag in _SKIPPED_HTML_TAGS and self._skip:
+            self._skip -= 1
+
+    def handle_data(self, data) -> None:
+        if not self._skip:
+            self.parts.append(data)
+
+
+def _html_to_text(data: bytes) -> str:
+    """Texto visível de um documento (X)HTML, com espaço entre os nós de texto."""
+    if _lxml_etree is not None:
+        parser = _lxml_etree.HTMLParser(encoding="utf-8", remove_comments=True, remove_pis=True)
+        root = _lxml_etree.fromstring(data, parser)
+        if root is None:
+            return ""
+        _lxml_etree.strip_elements(root, *_SKIPPED_HTML_TAGS, with_tail=False)
+        return " ".join(root.itertext())
+    collector = _HTMLTextCollector()
+    collector.feed(data.decode("utf-8", errors="ignore"))
+    collector.close()
+    return " ".join(collector.parts)
+
+
+def _local_name(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+
+def _epub_chapters(zf: zipfile.ZipFile) -> List[str]:
+    """Arquivos (X)HTML do livro na ordem de leitura (spine do OPF)."""
+    names = set(zf.namelist())
     try:
-        from ebooklib import epub  # type: ignore
-        from bs4 import BeautifulSoup  # type: ignore
+        container = ElementTree.fromstring(zf.read("META-INF/container.xml"))
+        rootfile = next(el.get("full-path") for el in container.iter() if _local_name(el.tag) == "rootfile")
+        opf = ElementTree.fromstring(zf.read(rootfile))
     except Exception:
-        raise ValueError("EPUB não suportado: instale 'ebooklib' e 'beautifulsoup4'")
-    book = epub.read_epub(file_path)
-    all_words: List[str] = []
-    for item in book.get_items_of_type(9):  # 9 = DOCUMENT
-        try:
-            html = item.get_content().decode("utf-8", errors="ignore")
-        except Exception:
-            continue
-        text = BeautifulSoup(html, "html.parser").get_text(separator=" ")
-        words = [w for w in text.replace("\r\n", " ").replace("\n", " ").split(" ") if w]
-        all_words.extend(words)
-    words_per_page = 300
-    pages = [max(1, (i // words_per_page) + 1) for i in range(len(all_words))]
-    page_count = max(pages) if pages else 0
-    return all_words, pages, page_count
+        # Sem container/OPF legível: todos os (X)HTML na ordem do zip
+        return [n for n in zf.namelist() if n.lower().endswith((".xhtml", ".html", ".htm"))]
+    base = posixpath.dirname(rootfile)
+    manifest: Dict[str, Tuple[str, str]] = {}
+    spine: List[str] = []
+    for el in opf.iter():
+        name = _local_name(el.tag)
+        if name == "item" and el.get("id") and el.get("href"):
+            manifest[el.get("id")] = (el.get("href"), el.get("media-type", ""))
+        elif name == "itemref" and el.get("idref"):
+            spine.append(el.get("idref"))
+    chapters = []
+    for idref in spine:
+        href, media_type = manifest.get(idref, ("", ""))
+        path = posixpath.normpath(posixpath.join(base, unquote(href.split("#", 1)[0])))
+        if media_type in _HTML_MEDIA_TYPES and path in names:
+            chapters.append(path)
+    return chapters
 
 
-def process_pdf(document_id: str, file_path: str) -> None:
-    """Processa arquivo por extensão: pdf, txt, md, epub.
-    Mantém nome para compatibilidade.
+def _extract_epub_chapter(file_path: str, name: str) -> str:
+    """Texto de um capítulo. Roda em processo worker; devolve uma string só, bem mais
+    barata de serializar de volta que a lista de palavras."""
+    with zipfile.ZipFile(file_path) as zf:
+        return _html_to_text(zf.read(name))
+
+
+def _iter_epub_chapters_serial(file_path: str, chapters: List[str]) -> Iterator[str]:
+    with zipfile.ZipFile(file_path) as zf:
+        for name in chapters:
+            yield _html_to_text(zf.read(name))
+
+
+def _iter_epub_chapters_parallel(file_path: str, chapters: List[str], workers: int) -> Iterator[str]:
+    return _map_extraction(_extract_epub_chapter, [(file_path, name) for name in chapters], workers)
+
+
+def _iter_epub_pages(file_path: str, workers: int | None = None) -> Iterator[Tuple[int, List[str]]]:
+    workers = workers if workers is not None else PDF_WORKERS
+    with zipfile.ZipFile(file_path) as zf:
+        chapters = _epub_chapters(zf)
+        size = sum(zf.getinfo(name).file_size for name in chapters)
+    if workers > 1 and len(chapters) > 1 and size >= EPUB_PARALLEL_MIN_BYTES:
+        chapter_iter = _iter_epub_chapters_parallel(file_path, chapters, workers)
+    else:
+        chapter_iter = _iter_epub_chapters_serial(file_path, chapters)
+    page = 0
+    for text in chapter_iter:
+        words = text.split()
+        for start in range(0, len(words), EPUB_WORDS_PER_PAGE):
+            page += 1
+            yield page, words[start:start + EPUB_WORDS_PER_PAGE]
+
+
+def _extract_words_with_pages_epub(file_path: str, workers: int | None = None) -> Tuple[List[str], List[int], int]:
+    return _collect_pages(_iter_epub_pages(file_path, workers))
+
+
+def _open_pages(file_path: str, workers: int | None = None, pdf_backend: str | None = None) -> Tuple[int, Iterator[Tuple[int, List[str]]]]:
+    """(page_count, iterador de (página, palavras)). Fora o PDF, o total de páginas só é
+    conhecido no fim (0 aqui); o processamento o atualiza conforme as páginas chegam.
+    `workers` limita os processos de extração que o PDF/EPUB ocupa (padrão e tamanho do
+    pool: PDF_WORKERS) e `pdf_backend` escolhe o extrator de PDF (padrão: PDF_BACKEND).
     """
     suffix = Path(file_path).suffix.lower()
     if suffix == ".pdf":
-        words, pages, page_count = _extract_words_with_pages_pdf(file_path)
-    elif suffix == ".txt":
-        words, pages, page_count = _extract_words_with_pages_txt(file_path)
-    elif suffix == ".md":
-        words, pages, page_count = _extract_words_with_pages_md(file_path)
-    elif suffix == ".epub":
-        words, pages, page_count = _extract_words_with_pages_epub(file_path)
+        return _open_pages_pdf(file_path, workers, pdf_backend)
+    if suffix == ".epub":
+        return 0, _iter_epub_pages(file_path, workers)
+    if suffix == ".txt":
+        return 0, _paginate(_iter_txt_words(file_path))
+    if suffix == ".md":
+        return 0, _paginate(_iter_md_words(file_path))
+    raise ValueError("Formato de arquivo não suportado")
+
+
+def _words_version(file_path: str | None, pdf_backend: str) -> str:
+    """Versão da camada de palavras extraídas: o extrator de PDF faz parte dela (o
+    pdfplumber, anterior ao registro de extratores, fica só com o número).
+    """
+    if Path(file_path or "").suffix.lower() == ".pdf" and pdf_backend != "pdfplumber":
+        return f"{EXTRACTOR_VERSION}-{pdf_backend}"
+    return str(EXTRACTOR_VERSION)
+
+
+def document_extraction(document_id: str, file_path: str | None = None) -> Tuple[str, str]:
+    """(extrator de PDF, versão da camada de palavras) do documento. O extrator é o
+    gravado no upload; documentos anteriores a essa coluna foram extraídos pelo pdfplumber.
+    """
+    try:
+        meta = get_document_meta(document_id)
+    except Exception:
+        meta = None
+    return meta_extraction(meta, file_path)
+
+
+def meta_extraction(meta: Dict[str, Any] | None, file_path: str | None = None) -> Tuple[str, str]:
+    """Como document_extraction, a partir dos metadados já lidos."""
+    if meta is None:
+        pdf_backend = PDF_BACKEND
     else:
-        raise ValueError("Formato de arquivo não suportado")
-    # Corrige hífens sempre que possível
+        pdf_backend = meta.get("pdf_backend") or "pdfplumber"
+        file_path = file_path or meta.get("file_path")
+    return pdf_backend, _words_version(file_path, pdf_backend)
+
+
+def tokens_variant(words_version: str) -> str:
+    """Versão dos tokens de um conteúdo: tokenizador + camada de palavras (que inclui o
+    extrator de PDF). Vai na ETag de /tokens, no nome dos payloads comprimidos e nas
+    entradas de `db`, para reconhecer tokens regravados com outro extrator.
+    """
+    return f"{TOKENIZER_VERSION}.x{words_version}"
+
+
+def _raw_words_available(document_id: str, version: str) -> bool:
     try:
-        words, pages = preprocess_hyphens(words, pages)
+        return raw_words_exists(document_id, version)
     except Exception:
-        pass
-    tokens, token_pages = group_words_with_pages(words, pages)
-    # Aplica regra nova: bloco que termina em monossílabo com pontuação conta como 1
-    from .textutils import build_tokens_with_rules
-    tokens, token_pages, token_weights = build_tokens_with_rules(tokens, token_pages)
-    db[document_id] = {
-        "status": "completed",
+        return False
+
+
+def _open_raw_words_writer(document_id: str, version: str) -> RawWordsWriter | None:
+    # Sem a camada o processamento segue normal; só perde o atalho da retokenização
+    try:
+        return RawWordsWriter(raw_words_path(document_id, version))
+    except Exception:
+        return None
+
+
+def _publish_tokens(document_id: str, entry: Dict[str, Any], batch: List[Tuple[str, int, int]]) -> None:
+    # As três listas crescem juntas; leitores usam `available` como limite consistente
+    for token, page, weight in batch:
+        entry["tokens"].append(token)
+        entry["token_pages"].append(page)
+        entry["token_weights"].append(weight)
+    entry["available"] = len(entry["tokens"])
+    # Entrada cresceu no lugar: o orçamento de memória de `db` passa a contar o novo tamanho
+    db.refresh(document_id)
+
+
+def _save_full_payloads(document_id: str, tokens: List[str], token_pages: List[int], token_weights: List[int], page_count: int, words_version: str) -> None:
+    """Comprime já o payload de /tokens do documento inteiro (br/gzip), para a primeira
+    leitura não pagar a compressão. Só documentos anteriores a isso o geram sob demanda.
+    """
+    body = build_tokens_payload(tokens=tokens, token_pages=token_pages, token_weights=token_weights, page_count=page_count)
+    save_tokens_payloads(document_id, body, tokens_variant(words_version))
+
+
+def _record_metrics(document_id: str, fmt: str, status: str, timings: Dict[str, float], total: float, page_count: int, token_count: int) -> None:
+    for stage, seconds in timings.items():
+        STAGE_SECONDS.observe(seconds, stage=stage, format=fmt)
+    DOCUMENT_SECONDS.observe(total, format=fmt)
+    DOCUMENTS_PROCESSED.inc(format=fmt, status=status)
+    PAGES_PROCESSED.inc(page_count, format=fmt)
+    TOKENS_PRODUCED.inc(token_count, format=fmt)
+    if total >= SLOW_DOCUMENT_SECONDS:
+        breakdown = " ".join(f"{stage}={seconds:.3f}s" for stage, seconds in timings.items())
+        logger.warning(
+            "documento lento %s (%s, %d páginas, %d tokens, %s): %.3fs | %s",
+            document_id, fmt, page_count, token_count, status, total, breakdown,
+        )
+
+
+def process_pdf(document_id: str, file_path: str, cancel_event: threading.Event | None = None) -> None:
+    """Processa arquivo por extensão: pdf, txt, md, epub.
+    Mantém nome para compatibilidade.
+
+    O processamento é incremental: as páginas são tokenizadas conforme são extraídas
+    e os tokens prontos são publicados em `db` a cada PUBLISH_BATCH_PAGES páginas.
+    Enquanto isso a entrada fica em "processing" com `pages_done` e `available`.
+
+    As palavras extraídas ficam numa camada própria em disco (raw_words); se ela já
+    existe para o conteúdo, a extração é pulada e só a tokenização roda.
+
+    O tempo de cada estágio (extract, tokenize, raw_words, metadata, tokens_cache,
+    payloads, search_index, library_index) vai para /metrics.
+
+    `cancel_event` é verificado entre páginas e antes de cada etapa de gravação; se
+    sinalizado, a entrada sai de `db`, o que já foi gravado em disco é apagado e
+    ProcessingCancelled é levantada sem marcar o documento como falho.
+    """
+    fmt = Path(file_path).suffix.lower().lstrip(".") or "unknown"
+    started = time.perf_counter()
+    timings = {"extract": 0.0, "tokenize": 0.0, "raw_words": 0.0, "metadata": 0.0, "tokens_cache": 0.0, "payloads": 0.0, "search_index": 0.0, "library_index": 0.0}
+    with PROCESSING_IN_PROGRESS.track_inprogress():
+        _process_document(document_id, file_path, fmt, started, timings, cancel_event)
+
+
+def _process_document(document_id: str, file_path: str, fmt: str, started: float, timings: Dict[str, float], cancel_event: threading.Event | None) -> None:
+    words: List[str] = []
+    tokens: List[str] = []
+    token_pages: List[int] = []
+    token_weights: List[int] = []
+    entry = {
+        "status": "processing",
         "words": words,
         "tokens": tokens,
         "token_pages": token_pages,
-        "page_count": page_count,
         "token_weights": token_weights,
+        "page_count": 0,
+        "pages_done": 0,
+        "available": 0,
         "file_path": file_path,
     }
-    # Mantemos o arquivo para visualização posterior via endpoint
+    db[document_id] = entry
+
+    def check_cancel() -> None:
+        if cancel_event is not None and cancel_event.is_set():
+            raise ProcessingCancelled(document_id)
+
+    def cancelled() -> None:
+        # Documento continua "processing" no banco: pode ser retomado ou já está sendo removido
+        entry["status"] = "cancelled"
+        try:
+            del db[document_id]
+        except KeyError:
+            pass
+        _record_metrics(document_id, fmt, "cancelled", timings, time.perf_counter() - started, entry["pages_done"], len(tokens))
+
+    def word_pairs(page_iter: Iterator[Tuple[int, List[str]]]) -> Iterator[Tuple[str, int]]:
+        # Extração e tokenização se intercalam; o tempo dentro do iterador de páginas é extração
+        page_iter = iter(page_iter)
+        while True:
+            t0 = time.perf_counter()
+            item = next(page_iter, None)
+            timings["extract"] += time.perf_counter() - t0
+            check_cancel()
+            if item is None:
+                return
+            page_num, page_words = item
+            if raw_writer is not None:
+                raw_writer.write_page(page_num, page_words)
+            for w in page_words:
+                yield w, page_num
+            entry["pages_done"] = page_num
+            if page_num > entry["page_count"]:
+                entry["page_count"] = page_num
+
+    # Aplica regra nova: bloco que termina em monossílabo com pontuação conta como 1
+    pending: List[Tuple[str, int, int]] = []
+    published_pages = 0
+    page_count = 0
+    raw_writer = None
+    from_raw = False
+    try:
+        t0 = time.perf_counter()
+        # Palavras já extraídas deste conteúdo: pula a extração. Senão extrai e grava a camada.
+        pdf_backend, words_version = document_extraction(document_id, file_path)
+        from_raw = _raw_words_available(document_id, words_version)
+        if from_raw:
+            page_iter = iter_raw_words(document_id, words_version)
+        else:
+            page_count, page_iter = _open_pages(file_path, pdf_backend=pdf_backend)
+            raw_writer = _open_raw_words_writer(document_id, words_version)
+        timings["extract"] += time.perf_counter() - t0
+        entry["page_count"] = page_count
+        # Pipeline em uma passada; `words` recebe as palavras com hífens corrigidos (/words)
+        t0 = time.perf_counter()
+        extract_before = timings["extract"]
+        for token in iter_tokens(word_pairs(page_iter), words_out=words):
+            pending.append(token)
+            if entry["pages_done"] - published_pages >= PUBLISH_BATCH_PAGES:
+                _publish_tokens(document_id, entry, pending)
+                pending = []
+                published_pages = entry["pages_done"]
+        _publish_tokens(document_id, entry, pending)
+        page_count = entry["page_count"]
+        timings["tokenize"] = time.perf_counter() - t0 - (timings["extract"] - extract_before)
+        if raw_writer is not None:
+            t0 = time.perf_counter()
+            try:
+                raw_writer.commit(page_count)
+            except Exception:
+                raw_writer.discard()
+            raw_writer = None
+            timings["raw_words"] = time.perf_counter() - t0
+    except ProcessingCancelled:
+        if raw_writer is not None:
+            raw_writer.discard()
+        cancelled()
+        raise
+    except Exception:
+        if raw_writer is not None:
+            raw_writer.discard()
+        if from_raw:
+            # Camada ilegível: a próxima tentativa extrai do arquivo
+            try:
+                raw_words_path(document_id, words_version).unlink(missing_ok=True)
+            except Exception:
+                pass
+        entry["status"] = "failed"
+        try:
+            update_document_after_processing(document_id, page_count, status="failed")
+        except Exception:
+            pass
+        _record_metrics(document_id, fmt, "failed", timings, time.perf_counter() - started, entry["pages_done"], len(tokens))
+        raise
+
+    marked_completed = False
+    try:
+        # A partir daqui cada etapa grava em disco: o cancelamento é conferido antes de
+        # cada uma, e o que já foi gravado (inclusive a camada de palavras extraída agora) é apagado
+        check_cancel()
+        page_index = build_page_index(token_pages, page_count)
+        token_costs = build_cost_prefix(tokens, token_weights)
+        db[document_id] = {
+            "status": "completed",
+            "words": words,
+            "tokens": tokens,
+            "token_pages": token_pages,
+            "page_count": page_count,
+            "token_weights": token_weights,
+            "page_index": page_index,
+            "token_costs": token_costs,
+            "file_path": file_path,
+            "variant": tokens_variant(words_version),
+        }
+        # Mantemos o arquivo para visualização posterior via endpoint
+        t0 = time.perf_counter()
+        try:
+            update_document_after_processing(document_id, page_count, status="completed")
+            marked_completed = True
+        except Exception:
+            # Persistência não deve quebrar o processamento principal
+            pass
+        timings["metadata"] = time.perf_counter() - t0
+        check_cancel()
+        t0 = time.perf_counter()
+        try:
+            save_tokens_cache(
+                document_id,
+                tokens=tokens,
+                token_pages=token_pages,
+                token_weights=token_weights,
+                page_count=page_count,
+                page_index=page_index,
+                token_costs=token_costs,
+            )
+        except Exception:
+            pass
+        timings["tokens_cache"] = time.perf_counter() - t0
+        check_cancel()
+        t0 = time.perf_counter()
+        try:
+            _save_full_payloads(document_id, tokens, token_pages, token_weights, page_count, words_version)
+        except Exception:
+            # Sem payload pronto, /tokens o gera na primeira requisição
+            pass
+        timings["payloads"] = time.perf_counter() - t0
+        check_cancel()
+        t0 = time.perf_counter()
+        try:
+            save_search_index(document_id, tokens)
+        except Exception:
+            # Sem índice a busca o monta na primeira consulta
+            pass
+        timings["search_index"] = time.perf_counter() - t0
+        check_cancel()
+        t0 = time.perf_counter()
+        try:
+            index_library_document(document_id, tokens)
+        except Exception:
+            # Fica de fora da busca na biblioteca até `python -m app.search --rebuild-library`
+            pass
+        timings["library_index"] = time.perf_counter() - t0
+    except ProcessingCancelled:
+        if marked_completed:
+            try:
+                update_document_after_processing(document_id, page_count, status="processing")
+            except Exception:
+                pass
+        _discard_outputs(document_id, raw_words=not from_raw)
+        cancelled()
+        raise
+    _record_metrics(document_id, fmt, "completed", timings, time.perf_counter() - started, page_count, len(tokens))
+
+
+def _discard_outputs(document_id: str, raw_words: bool) -> None:
+    """Apaga o que um processamento cancelado gravou: cache de tokens, payloads, índice de
+    busca, linhas da busca da biblioteca e, com `raw_words`, a camada de palavras. Nada é
+    apagado se outro documento compartilha o conteúdo (os arquivos também são dele).
+    """
+    meta = get_document_meta(document_id)
+    content_hash = meta.get("content_hash") if meta else None
+    if content_hash is not None and count_documents_by_hash(content_hash, Path(meta.get("file_path") or "").suffix.lower()) > 1:
+        return
     try:
-        update_document_after_processing(document_id, page_count, status="completed")
+        remove_library_document(document_id)
     except Exception:
-        # Persistência não deve quebrar o processamento principal
         pass
     try:
-        save_tokens_cache(
-            document_id,
-            tokens=tokens,
-            token_pages=token_pages,
-            token_weights=token_weights,
-            page_count=page_count,
-        )
+        delete_tokens_cache(document_id, raw_words=raw_words)
+    except Exception:
+        pass
+
+
+# Retokenização: caches de tokens gravados por outra versão do tokenizador são refeitos
+# a partir da camada de palavras extraídas, sem reabrir o arquivo original.
+_retokenize_locks: Dict[str, threading.Lock] = {}
+_retokenize_locks_guard = threading.Lock()
+
+
+def _retokenize_lock(key: str) -> threading.Lock:
+    with _retokenize_locks_guard:
+        return _retokenize_locks.setdefault(key, threading.Lock())
+
+
+def rebuild_tokens_cache(document_id: str, file_path: str | None = None, workers: int | None = None, pdf_backend: str | None = None) -> Tuple[str, int, List[str]]:
+    """Regrava o cache de tokens, os payloads comprimidos e o índice de busca do
+    documento, sem passar por `db` nem gravar no SQLite. As palavras vêm da camada de
+    palavras extraídas; sem ela, são extraídas de `file_path` e a camada é gravada. `pdf_backend` troca o extrator gravado
+    no upload. Devolve (origem, page_count, tokens).
+    """
+    stored_backend, words_version = document_extraction(document_id, file_path)
+    if pdf_backend is not None:
+        words_version = _words_version(file_path, pdf_backend)
+    raw_writer = None
+    if raw_words_exists(document_id, words_version):
+        source, page_iter = "raw_words", iter_raw_words(document_id, words_version)
+    elif file_path is not None:
+        source, (_, page_iter) = "extract", _open_pages(file_path, workers, pdf_backend or stored_backend)
+        raw_writer = _open_raw_words_writer(document_id, words_version)
+    else:
+        raise FileNotFoundError(f"Sem palavras extraídas nem arquivo para {document_id}")
+    tokens: List[str] = []
+    token_pages: List[int] = []
+    token_weights: List[int] = []
+    page_count = 0
+
+    def word_pairs() -> Iterator[Tuple[str, int]]:
+        nonlocal page_count
+        for page, words in page_iter:
+            if raw_writer is not None:
+                raw_writer.write_page(page, words)
+            page_count = page
+            for w in words:
+                yield w, page
+
+    try:
+        for token, page, weight in iter_tokens(word_pairs()):
+            tokens.append(token)
+            token_pages.append(page)
+            token_weights.append(weight)
+    except Exception:
+        if raw_writer is not None:
+            raw_writer.discard()
+        raise
+    if raw_writer is not None:
+        try:
+            raw_writer.commit(page_count)
+        except Exception:
+            raw_writer.discard()
+    save_tokens_cache(
+        document_id,
+        tokens=tokens,
+        token_pages=token_pages,
+        token_weights=token_weights,
+        page_count=page_count,
+    )
+    try:
+        _save_full_payloads(document_id, tokens, token_pages, token_weights, page_count, words_version)
     except Exception:
         pass
+    try:
+        save_search_index(document_id, tokens)
+    except Exception:
+        pass
+    return source, page_count, tokens
+
+
+def retokenize_document(document_id: str) -> bool:
+    """Refaz tokens, índice de busca e busca da biblioteca a partir das palavras extraídas.
+    False se o documento não tem a camada de palavras (precisa ser reprocessado).
+    """
+    with _retokenize_lock(_cache_key(document_id)):
+        cached = load_tokens_cache(document_id)
+        if cached is not None and cached.get("tokenizer_version") == TOKENIZER_VERSION:
+            # Outra requisição retokenizou enquanto esta esperava
+            return True
+        if not raw_words_exists(document_id, document_extraction(document_id)[1]):
+            RETOKENIZED.inc(source="missing")
+            return False
+        _, _, tokens = rebuild_tokens_cache(document_id)
+        try:
+            index_library_document(document_id, tokens)
+        except Exception:
+            pass
+        RETOKENIZED.inc(source="raw_words")
+        return True
+
+
+def load_current_tokens_cache(document_id: str) -> Dict[str, Any] | None:
+    """Como load_tokens_cache, mas só devolve tokens da versão atual do tokenizador:
+    caches de outra versão são retokenizados na hora; sem a camada de palavras, None
+    (o documento precisa ser reprocessado).
+    """
+    cached = load_tokens_cache(document_id)
+    if cached is None or cached.get("tokenizer_version") == TOKENIZER_VERSION:
+        return cached
+    if not retokenize_document(document_id):
+        return None
+    return load_tokens_cache(document_id)
 
 
+load_current_tokens_cache_async = _async_version(load_current_tokens_cache)
+document_extraction_async = _async_version(document_extraction)
@@ -0,0 +1,291 @@
+"""Reconstrução em lote dos caches de tokens (após mudança no tokenizador ou no extrator).
+
+Refaz, para a biblioteca inteira ou um subconjunto, o cache de tokens, o índice de busca
+do documento e as linhas da busca da biblioteca. Documentos com a camada de palavras
+extraídas (data/tokens/<chave>.x<versão>.words.gz) só são retokenizados, sem reabrir os
+arquivos; os demais são extraídos de novo, o que também grava a camada.
+
+- Paralelo: um processo por documento (uploads com o mesmo conteúdo contam uma vez),
+  com prioridade reduzida (nice) para não competir com o servidor no ar.
+- SQLite: status/page_count e a busca da biblioteca são gravados pelo processo
+  principal, em transações de até --batch documentos.
+- Retomável: o progresso vai para data/rebuild_state.json; interrompido (Ctrl+C), o
+  próximo comando com os mesmos argumentos continua de onde parou (--restart ignora o
+  estado; outra versão do tokenizador/extrator ou outros argumentos também).
+
+Por padrão só entram documentos sem cache ou com cache de outra versão do tokenizador;
+sem este comando eles são retokenizados do mesmo jeito, no primeiro acesso.
+
+    python -m app.rebuild
+    python -m app.rebuild --all --format pdf --workers 2
+    python -m app.rebuild --dry-run
+    python -m app.rebuild --pdf-backend pypdfium2
+
+Com --pdf-backend, reextrai com esse extrator os PDFs extraídos por outro e grava a
+troca no documento.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import signal
+import sqlite3
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from pathlib import Path
+from typing import Any, Dict, List, Set, Tuple
+
+from .processing import EXTRACTOR_VERSION, PDF_BACKENDS, _available_cpus, _words_version, document_extraction, rebuild_tokens_cache
+from .search import _insert_library_rows
+from .storage import DATA_DIR, _get_conn, content_key, init_db, load_tokens_cache, raw_words_exists
+from .textutils import TOKENIZER_VERSION
+
+REBUILD_STATE_PATH = DATA_DIR / "rebuild_state.json"
+REBUILD_WORKERS = int(os.environ.get("LEITOR_REBUILD_WORKERS", "0")) or max(1, _available_cpus() // 2)
+REBUILD_NICE = int(os.environ.get("LEITOR_REBUILD_NICE", "10"))
+REBUILD_BATCH = int(os.environ.get("LEITOR_REBUILD_BATCH", "50"))
+# Transação pendente também é gravada após este intervalo, mesmo com o lote incompleto
+FLUSH_SECONDS = 5.0
+
+
+def _init_worker(nice: int) -> None:
+    # Ctrl+C é tratado só no processo principal, que espera os documentos em andamento
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        os.nice(nice)
+    except (AttributeError, OSError):  # Windows / sem permissão
+        pass
+
+
+def _rebuild_worker(document_id: str, file_path: str | None, pdf_backend: str | None, pause: float) -> Dict[str, Any]:
+    """Roda no processo worker: grava só arquivos em data/tokens; o SQLite fica com o pai."""
+    if pdf_backend and file_path is None:
+        # Trocar de extrator exige o arquivo original
+        raise FileNotFoundError(f"Arquivo de {document_id} não encontrado")
+    started = time.perf_counter()
+    source, page_count, tokens = rebuild_tokens_cache(document_id, file_path, workers=1, pdf_backend=pdf_backend)
+    seconds = time.perf_counter() - started
+    if pause:
+        time.sleep(pause)
+    return {"source": source, "page_count": page_count, "tokens": len(tokens), "seconds": seconds}
+
+
+def _select_documents(statuses: List[str], formats: List[str], ids: List[str], pdf_backend: str | None) -> List[Tuple[str, List[str], str | None]]:
+    """(chave do conteúdo, ids dos documentos, arquivo) na ordem de upload. Com
+    `pdf_backend`, só PDFs extraídos por outro extrator. `ids` escolhe conteúdos: entram
+    todos os uploads de um conteúdo que tenha algum dos ids, já que compartilham os
+    tokens e o extrator.
+    """
+    with _get_conn() as conn:
+        rows = conn.execute(
+            f"SELECT id, content_hash, file_path, pdf_backend FROM documents WHERE status IN ({','.join('?' * len(statuses))}) ORDER BY uploaded_at",
+            statuses,
+        ).fetchall()
+    groups: Dict[str, Tuple[List[str], str | None]] = {}
+    for doc_id, content_hash, file_path, stored_backend in rows:
+        if pdf_backend and (not (file_path or "").lower().endswith(".pdf") or (stored_backend or "pdfplumber") == pdf_backend):
+            continue
+        if formats and Path(file_path or "").suffix.lower().lstrip(".") not in formats:
+            continue
+        key = content_key(doc_id, content_hash, file_path)
+        doc_ids, current_path = groups.setdefault(key, ([], None))
+        doc_ids.append(doc_id)
+        if current_path is None and file_path and os.path.exists(file_path):
+            groups[key] = (doc_ids, file_path)
+    return [
+        (key, doc_ids, file_path)
+        for key, (doc_ids, file_path) in groups.items()
+        if not ids or any(doc_id in ids for doc_id in doc_ids)
+    ]
+
+
+def _is_current(document_id: str) -> bool:
+    cached = load_tokens_cache(document_id)
+    return cached is not None and cached.get("tokenizer_version") == TOKENIZER_VERSION
+
+
+def _state_params(args: argparse.Namespace, statuses: List[str], formats: List[str]) -> Dict[str, Any]:
+    """O que define uma execução: versões do tokenizador/extrator e a seleção pedida.
+    Progresso gravado com outros valores não vale para esta execução.
+    """
+    return {
+        "tokenizer_version": TOKENIZER_VERSION,
+        "extractor_version": EXTRACTOR_VERSION,
+        "all": args.all,
+        "status": sorted(statuses),
+        "format": sorted(formats),
+        "ids": sorted(args.ids),
+        "pdf_backend": args.pdf_backend,
+    }
+
+
+def _load_state(params: Dict[str, Any]) -> Set[str]:
+    try:
+        with open(REBUILD_STATE_PATH, "r", encoding="utf-8") as f:
+            state = json.load(f)
+    except Exception:
+        return set()
+    if state.get("params") != params:
+        print("progresso gravado é de outra versão ou de outros argumentos: começando do zero")
+        return set()
+    return set(state.get("done", []))
+
+
+def _save_state(done: Set[str], params: Dict[str, Any]) -> None:
+    tmp = REBUILD_STATE_PATH.with_suffix(".json.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"params": params, "done": sorted(done)}, f)
+    os.replace(tmp, REBUILD_STATE_PATH)
+
+
+def _flush(batch: List[Tuple[str, List[str], int]], done: Set[str], pdf_backend: str | None, params: Dict[str, Any]) -> None:
+    """Grava um lote numa transação: status/page_count (e o extrator, com --pdf-backend)
+    de todos os uploads de cada conteúdo e as linhas da busca da biblioteca. Depois marca
+    o lote no estado.
+    """
+    if not batch:
+        return
+    # Tokens abertos antes da transação: a leitura do cache também consulta o SQLite
+    tokens = {key: (load_tokens_cache(doc_ids[0]) or {}).get("tokens", []) for key, doc_ids, _ in batch}
+    with _get_conn() as conn:
+        for key, doc_ids, page_count in batch:
+            conn.executemany(
+                "UPDATE documents SET status = 'completed', page_count = ?, last_read_page = COALESCE(last_read_page, 1) WHERE id = ?",
+                [(page_count, doc_id) for doc_id in doc_ids],
+            )
+            if pdf_backend:
+                conn.executemany("UPDATE documents SET pdf_backend = ? WHERE id = ?", [(pdf_backend, doc_id) for doc_id in doc_ids])
+            try:
+                _insert_library_rows(conn, key, tokens[key])
+            except sqlite3.OperationalError:
+                # SQLite sem FTS5: sem busca na biblioteca
+                pass
+        conn.commit()
+    done.update(key for key, _, _ in batch)
+    _save_state(done, params)
+    batch.clear()
+
+
+def _format_rate(count: float, seconds: float) -> str:
+    return f"{count / seconds:.1f}" if seconds > 0 else "-"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--all", action="store_true", help="refaz também caches já na versão atual")
+    parser.add_argument("--status", default="completed", help="status dos documentos, separados por vírgula (padrão: completed)")
+    parser.add_argument("--format", default="", help="só estes formatos, separados por vírgula (pdf,epub,txt,md)")
+    parser.add_argument("--ids", nargs="*", default=[], help="só estes documentos")
+    parser.add_argument("--pdf-backend", choices=list(PDF_BACKENDS), help="reextrai com este extrator os PDFs extraídos por outro")
+    parser.add_argument("--workers", type=int, default=REBUILD_WORKERS, help="processos paralelos (padrão: metade das CPUs)")
+    parser.add_argument("--nice", type=int, default=REBUILD_NICE, help="redução de prioridade dos workers")
+    parser.add_argument("--pause", type=float, default=0.0, help="pausa de cada worker entre documentos, em segundos")
+    parser.add_argument("--batch", type=int, default=REBUILD_BATCH, help="documentos por transação no SQLite")
+    parser.add_argument("--restart", action="store_true", help="ignora o progresso gravado de uma execução interrompida")
+    parser.add_argument("--dry-run", action="store_true", help="só lista o que seria refeito")
+    args = parser.parse_args()
+
+    init_db()
+    statuses = [s for s in args.status.split(",") if s]
+    formats = [f.lower().lstrip(".") for f in args.format.split(",") if f]
+    params = _state_params(args, statuses, formats)
+    done = set() if args.restart else _load_state(params)
+    pending = []
+    skipped = 0
+    for key, doc_ids, file_path in _select_documents(statuses, formats, args.ids, args.pdf_backend):
+        # Feito nesta execução só conta se o cache continua atual (pode ter sido apagado ou regravado depois)
+        if _is_current(doc_ids[0]) and (key in done or not (args.all or args.pdf_backend)):
+            skipped += 1
+            continue
+        pending.append((key, doc_ids, file_path))
+    print(f"{len(pending)} documentos a refazer, {skipped} ignorados (atuais ou já feitos)" + (f", retomando {len(done)}" if done else ""))
+    if args.dry_run:
+        for key, doc_ids, file_path in pending:
+            version = _words_version(file_path, args.pdf_backend) if args.pdf_backend else document_extraction(doc_ids[0], file_path)[1]
+            action = "retokenizar" if raw_words_exists(doc_ids[0], version) else ("extrair" if file_path else "sem arquivo")
+            print(f"{doc_ids[0]}: {action}")
+        return
+    if not pending:
+        if REBUILD_STATE_PATH.exists():
+            REBUILD_STATE_PATH.unlink()
+        return
+
+    workers = max(1, min(args.workers, len(pending)))
+    totals = {"done": 0, "failed": 0, "pages": 0, "tokens": 0}
+    batch: List[Tuple[str, List[str], int]] = []
+    started = last_flush = time.perf_counter()
+    queue = iter(pending)
+    running: Dict[Future, Tuple[str, List[str], str | None]] = {}
+    # spawn: o worker abre a própria conexão SQLite em vez de herdar a do pai
+    pool = ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(args.nice,),
+    )
+
+    def collect(future: Future) -> None:
+        key, doc_ids, _ = running.pop(future)
+        position = totals["done"] + totals["failed"] + 1
+        try:
+            result = future.result()
+        except Exception as e:
+            totals["failed"] += 1
+            print(f"[{position}/{len(pending)}] {doc_ids[0]}: falhou ({e.__class__.__name__}: {e})")
+            return
+        totals["done"] += 1
+        totals["pages"] += result["page_count"]
+        totals["tokens"] += result["tokens"]
+        batch.append((key, doc_ids, result["page_count"]))
+        elapsed = time.perf_counter() - started
+        eta = elapsed / position * (len(pending) - position)
+        print(
+            f"[{position}/{len(pending)}] {doc_ids[0]}: {result['source']}, {result['page_count']} páginas, "
+            f"{result['tokens']} tokens em {result['seconds']:.2f}s | "
+            f"{_format_rate(position, elapsed)} docs/s, {_format_rate(totals['pages'], elapsed)} páginas/s, "
+            f"{_format_rate(totals['tokens'], elapsed)} tokens/s, faltam ~{eta:.0f}s"
+        )
+
+    interrupted = False
+    try:
+        while True:
+            # No máximo 2 documentos por worker em voo: o Ctrl+C espera pouco
+            while len(running) < workers * 2:
+                item = next(queue, None)
+                if item is None:
+                    break
+                running[pool.submit(_rebuild_worker, item[1][0], item[2], args.pdf_backend, args.pause)] = item
+            if not running:
+                break
+            finished, _ = wait(running, timeout=FLUSH_SECONDS, return_when=FIRST_COMPLETED)
+            for future in finished:
+                collect(future)
+            if len(batch) >= args.batch or (batch and time.perf_counter() - last_flush >= FLUSH_SECONDS):
+                _flush(batch, done, args.pdf_backend, params)
+                last_flush = time.perf_counter()
+    except KeyboardInterrupt:
+        interrupted = True
+        print("interrompido: terminando os documentos em andamento; rode de novo para continuar")
+        # O cache dos que já começaram é regravado de qualquer jeito: precisam entrar no SQLite
+        for future in list(running):
+            if future.cancel():
+                del running[future]
+        for future in list(running):
+            wait([future])
+            collect(future)
+    finally:
+        _flush(batch, done, args.pdf_backend, params)
+        pool.shutdown(wait=True, cancel_futures=True)
+
+    elapsed = time.perf_counter() - started
+    print(
+        f"refeitos={totals['done']} falhas={totals['failed']} páginas={totals['pages']} tokens={totals['tokens']} "
+        f"em {elapsed:.1f}s ({_format_rate(totals['done'], elapsed)} docs/s, {_format_rate(totals['tokens'], elapsed)} tokens/s)"
+    )
+    if not interrupted and REBUILD_STATE_PATH.exists():
+        # Execução completa: falhas voltam a ser tentadas na próxima
+        REBUILD_STATE_PATH.unlink()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,416 @@
+"""Busca dentro de um documento, por um índice invertido persistido (.idx), e na
+biblioteca inteira, pelo FTS5 do SQLite.
+
+O índice é montado no fim do processamento, a partir dos tokens, e gravado ao lado
+do cache de tokens. Cada palavra dos tokens ganha uma posição sequencial; o índice
+guarda, por termo normalizado (sem acentos, minúsculo), a lista ordenada dessas
+posições, e para cada posição o token onde ela está. Frases são buscadas como
+termos em posições consecutivas.
+
+Assim como o .tok, o arquivo é aberto via mmap: a busca faz uma busca binária na
+tabela de termos e lê só as listas de posições envolvidas, sem carregar os tokens.
+
+Na biblioteca, os tokens de cada conteúdo entram em trechos de LIBRARY_CHUNK_TOKENS
+na tabela library_fts (unicode61, sem acentos) ao fim do processamento e saem quando o
+documento é removido; a ordenação é por bm25. `python -m app.search --rebuild-library`
+refaz tudo a partir dos caches em data/tokens.
+"""
+import argparse
+import bisect
+import os
+import re
+import sqlite3
+import struct
+import sys
+import threading
+from array import array
+from itertools import accumulate
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from .metrics import STORAGE_SECONDS, timed
+from .storage import MappedFile, TokenTexts, _align8, _async_version, _cache_key, _cast_uint, _close_mapping, _get_conn, content_key, db, init_db, load_tokens_cache, mapping_released, release_mapped, search_index_path
+from .textutils import TOKENIZER_VERSION, normalize_term
+
+# Layout (little-endian):
+#   cabeçalho: magic, versão, versão do tokenizador, n_tokens, n_words, n_terms, n_postings, len(blob)
+#   term_offsets:    uint64[n_terms + 1]  início de cada termo no blob (+1 separador no fim)
+#   posting_offsets: uint64[n_terms + 1]  início da lista de cada termo em postings
+#   postings:        uint32[n_postings]   posições de palavra, ordenadas por termo e posição
+#   word_tokens:     uint32[n_words]      token de cada posição de palavra
+#   blob:            termos ordenados em UTF-8 separados por "\n"
+SEARCH_INDEX_MAGIC = b"LRIX"
+SEARCH_INDEX_VERSION = 1
+_INDEX_HEADER = struct.Struct("<4sHHQQQQQ")
+# Tokens de contexto de cada lado do resultado
+SNIPPET_TOKENS = 6
+
+
+def query_terms(query: str) -> List[str]:
+    """Termos normalizados da consulta; aspas e pontuação são ignoradas."""
+    return [t for t in (normalize_term(w) for w in query.split()) if t]
+
+
+def build_search_index(tokens: Sequence[str]) -> Dict[str, Any]:
+    postings: Dict[str, array] = {}
+    word_tokens = array("I")
+    pos = 0
+    for i, token in enumerate(tokens):
+        for word in token.split(" "):
+            term = normalize_term(word)
+            if not term:
+                continue
+            plist = postings.get(term)
+            if plist is None:
+                plist = postings[term] = array("I")
+            plist.append(pos)
+            word_tokens.append(i)
+            pos += 1
+    return {"postings": postings, "word_tokens": word_tokens, "n_tokens": len(tokens)}
+
+
+def _write_search_index(target: Path, index: Dict[str, Any]) -> None:
+    postings: Dict[str, array] = index["postings"]
+    terms = sorted(postings)
+    blob = "\n".join(terms).encode("utf-8")
+    all_postings = array("I")
+    for term in terms:
+        all_postings.extend(postings[term])
+    sections = [
+        array("Q", accumulate((len(t.encode("utf-8")) + 1 for t in terms), initial=0)),
+        array("Q", accumulate((len(postings[t]) for t in terms), initial=0)),
+        all_postings,
+        index["word_tokens"],
+    ]
+    if sys.byteorder != "little":
+        for section in sections:
+            section.byteswap()
+    # Nome único: duas threads (ou o servidor e o rebuild) podem regravar o mesmo índice
+    tmp = target.with_name(f"{target.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp, "wb") as f:
+        f.write(_INDEX_HEADER.pack(
+            SEARCH_INDEX_MAGIC, SEARCH_INDEX_VERSION, TOKENIZER_VERSION,
+            index["n_tokens"], len(index["word_tokens"]), len(terms), len(all_postings), len(blob),
+        ))
+        for section in sections:
+            raw = section.tobytes()
+            f.write(raw)
+            f.write(b"\0" * (_align8(len(raw)) - len(raw)))
+        f.write(blob)
+    release_mapped(target)
+    os.replace(tmp, target)
+
+
+@timed(STORAGE_SECONDS, operation="save_search_index")
+def save_search_index(document_id: str, tokens: Sequence[str]) -> None:
+    _write_search_index(search_index_path(document_id), build_search_index(tokens))
+
+
+def _open_search_index(target: Path) -> Optional[Dict[str, Any]]:
+    """Índice mapeado; o mapeamento vai em "mapping" e é fechado por quem abriu."""
+    mapped = MappedFile(target)
+    view = mapped.view
+    magic, version, tokenizer_version, n_tokens, n_words, n_terms, n_postings, blob_len = _INDEX_HEADER.unpack_from(view, 0)
+    if magic != SEARCH_INDEX_MAGIC or version != SEARCH_INDEX_VERSION or tokenizer_version != TOKENIZER_VERSION:
+        mapped.close()
+        return None
+    pos = _INDEX_HEADER.size
+    sections = []
+    for fmt, count in (("Q", n_terms + 1), ("Q", n_terms + 1), ("I", n_postings), ("I", n_words)):
+        size = count * (8 if fmt == "Q" else 4)
+        sections.append(mapped.track(_cast_uint(view[pos:pos + size], fmt)))
+        pos += _align8(size)
+    term_offsets, posting_offsets, postings, word_tokens = sections
+    if pos + blob_len != len(view):
+        mapped.close()
+        return None
+    return {
+        "terms": TokenTexts(mapped.track(view[pos:pos + blob_len]), term_offsets),
+        "posting_offsets": posting_offsets,
+        "postings": postings,
+        "word_tokens": word_tokens,
+        "n_tokens": n_tokens,
+        "mapping": mapped,
+    }
+
+
+def _postings(index: Dict[str, Any], term: str) -> Sequence[int]:
+    terms = index["terms"]
+    i = bisect.bisect_left(terms, term)
+    if i == len(terms) or terms[i] != term:
+        return []
+    offsets = index["posting_offsets"]
+    return index["postings"][offsets[i]:offsets[i + 1]]
+
+
+def _contains(postings: Sequence[int], value: int) -> bool:
+    i = bisect.bisect_left(postings, value)
+    return i < len(postings) and postings[i] == value
+
+
+def match_positions(index: Dict[str, Any], terms: List[str]) -> Sequence[int]:
+    """Posições (da primeira palavra) onde os termos aparecem em sequência."""
+    lists = [_postings(index, t) for t in terms]
+    if not lists or any(len(p) == 0 for p in lists):
+        return []
+    if len(lists) == 1:
+        return lists[0]
+    # Parte do termo mais raro e filtra pelos demais, do menor para o maior: listas de
+    # tamanho parecido viram conjunto; listas muito maiores, busca binária por candidato
+    order = sorted(range(len(lists)), key=lambda j: len(lists[j]))
+    first = order[0]
+    candidates = [p - first for p in lists[first] if p >= first]
+    for j in order[1:]:
+        if not candidates:
+            break
+        plist = lists[j]
+        if len(plist) <= 16 * len(candidates):
+            present = set(plist)
+            candidates = [c for c in candidates if c + j in present]
+        else:
+            candidates = [c for c in candidates if _contains(plist, c + j)]
+    return candidates
+
+
+def _document_tokens(document_id: str) -> Tuple[Optional[Dict[str, Any]], bool]:
+    """Tokens e páginas do documento concluído: em memória ou mapeados do cache. O
+    segundo valor diz se foram abertos do disco só para quem chamou (que fecha o mapeamento).
+    """
+    entry = db.get(document_id)
+    if entry is not None and entry.get("status") == "completed" and not mapping_released(entry):
+        return {"tokens": entry["tokens"], "pages": entry["token_pages"], "mapping": entry.get("mapping")}, False
+    return load_tokens_cache(document_id), True
+
+
+def load_search_index(document_id: str, tokens: Sequence[str]) -> Dict[str, Any]:
+    """Abre o índice; monta e grava de novo se faltar ou não corresponder aos tokens.
+    Quem chama fecha o mapeamento (`_close_mapping`) ao terminar.
+    """
+    target = search_index_path(document_id)
+    index = None
+    if target.exists():
+        try:
+            index = _open_search_index(target)
+        except Exception:
+            index = None
+    if index is None or index["n_tokens"] != len(tokens):
+        if index is not None:
+            _close_mapping(index)
+        save_search_index(document_id, tokens)
+        index = _open_search_index(target)
+    return index
+
+
+@timed(STORAGE_SECONDS, operation="search_document")
+def search_document(document_id: str, query: str, offset: int = 0, limit: int = 50) -> Optional[Dict[str, Any]]:
+    """Ocorrências de `query` no documento: índice do token, página e um trecho em volta.
+    None se o documento não tem tokens prontos.
+
+    Se o índice ou os tokens forem regravados no meio da busca (outra busca remontando o
+    `.idx`, reconstrução do cache), o mapeamento fecha e as visões dão ValueError: a busca
+    reabre os arquivos novos e recomeça, uma vez.
+    """
+    for attempt in range(2):
+        source, owned = _document_tokens(document_id)
+        if source is None:
+            return None
+        index = None
+        try:
+            tokens, pages = source["tokens"], source["pages"]
+            terms = query_terms(query)
+            index = load_search_index(document_id, tokens)
+            positions = match_positions(index, terms) if terms else []
+            word_tokens = index["word_tokens"]
+            hits = []
+            for p in positions[offset:offset + limit]:
+                t = word_tokens[p]
+                hits.append({
+                    "token_index": t,
+                    "page": pages[t] if t < len(pages) else 1,
+                    "snippet": " ".join(tokens[max(0, t - SNIPPET_TOKENS):t + SNIPPET_TOKENS + 1]),
+                })
+            return {"query": query, "terms": terms, "total": len(positions), "offset": offset, "hits": hits}
+        except ValueError:
+            if attempt or not (mapping_released(source) or mapping_released(index)):
+                raise
+        finally:
+            if index is not None:
+                _close_mapping(index)
+            # Tokens abertos do disco só para esta busca (os de `db` ficam com a entrada)
+            if owned:
+                _close_mapping(source)
+    return None
+
+
+# --- biblioteca (FTS5) ---
+
+# Tokens por linha da tabela FTS. Trechos maiores = menos linhas para ordenar por bm25;
+# o token exato do resultado é achado dentro do trecho
+LIBRARY_CHUNK_TOKENS = int(os.environ.get("LEITOR_LIBRARY_CHUNK_TOKENS", "512"))
+LIBRARY_SNIPPET_WORDS = 16
+LIBRARY_HIGHLIGHT = ("<b>", "</b>")
+_QUERY_PART_RE = re.compile(r'"([^"]*)"|(\S+)')
+
+
+class LibrarySearchUnavailable(Exception):
+    """SQLite sem FTS5 (ou tabela ainda não criada)."""
+
+
+def library_match_expression(query: str) -> str:
+    """Consulta como expressão FTS5: todos os termos, e trechos entre aspas como frase."""
+    parts = []
+    for phrase, word in _QUERY_PART_RE.findall(query):
+        terms = query_terms(phrase or word)
+        if terms:
+            parts.append('"' + " ".join(terms).replace('"', '""') + '"')
+    return " ".join(parts)
+
+
+def _delete_library_rows(conn: sqlite3.Connection, doc_key: str) -> None:
+    conn.execute("DELETE FROM library_fts WHERE rowid IN (SELECT id FROM library_chunks WHERE doc_key = ?)", (doc_key,))
+    conn.execute("DELETE FROM library_chunks WHERE doc_key = ?", (doc_key,))
+
+
+def _insert_library_rows(conn: sqlite3.Connection, doc_key: str, tokens: Sequence[str]) -> None:
+    _delete_library_rows(conn, doc_key)
+    for start in range(0, len(tokens), LIBRARY_CHUNK_TOKENS):
+        # Um token por linha: o resultado volta ao índice do token sem abrir o cache
+        body = "\n".join(tokens[start:start + LIBRARY_CHUNK_TOKENS])
+        cur = conn.execute("INSERT INTO library_chunks (doc_key, token_start) VALUES (?, ?)", (doc_key, start))
+        conn.execute("INSERT INTO library_fts (rowid, body) VALUES (?, ?)", (cur.lastrowid, body))
+
+
+@timed(STORAGE_SECONDS, operation="index_library_document")
+def index_library_document(document_id: str, tokens: Sequence[str]) -> None:
+    """(Re)indexa o conteúdo do documento; uploads com o mesmo hash compartilham as linhas."""
+    doc_key = _cache_key(document_id)
+    with _get_conn() as conn:
+        _insert_library_rows(conn, doc_key, tokens)
+        conn.commit()
+
+
+@timed(STORAGE_SECONDS, operation="remove_library_document")
+def remove_library_document(document_id: str) -> None:
+    doc_key = _cache_key(document_id)
+    with _get_conn() as conn:
+        _delete_library_rows(conn, doc_key)
+        conn.commit()
+
+
+def _first_matching_token(body: str, terms: List[str]) -> int:
+    wanted = set(terms)
+    for i, token in enumerate(body.split("\n")):
+        if any(normalize_term(w) in wanted for w in token.split(" ")):
+            return i
+    return 0
+
+
+def _documents_by_key(conn: sqlite3.Connection, keys: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Documento concluído mais recente para cada chave de conteúdo."""
+    if not keys:
+        return {}
+    marks = ",".join("?" * len(keys))
+    # Chave = hash + extensão (content_key); ids de documentos sem hash não têm ponto
+    hashes = [key.split(".", 1)[0] for key in keys]
+    cur = conn.execute(
+        f"""
+        SELECT id, filename, content_hash, file_path FROM documents
+        WHERE status = 'completed' AND (content_hash IN ({marks}) OR id IN ({marks}))
+        ORDER BY uploaded_at ASC
+        """,
+        (*hashes, *keys),
+    )
+    wanted = set(keys)
+    found: Dict[str, Dict[str, Any]] = {}
+    for doc_id, filename, content_hash, file_path in cur.fetchall():
+        key = content_key(doc_id, content_hash, file_path)
+        if key in wanted:
+            found[key] = {"document_id": doc_id, "filename": filename}
+    return found
+
+
+@timed(STORAGE_SECONDS, operation="search_library")
+def search_library(query: str, offset: int = 0, limit: int = 20) -> Dict[str, Any]:
+    """Trechos da biblioteca que contêm a consulta, do mais ao menos relevante (bm25)."""
+    expression = library_match_expression(query)
+    result: Dict[str, Any] = {"query": query, "total": 0, "offset": offset, "hits": []}
+    if not expression:
+        return result
+    terms = query_terms(query)
+    open_mark, close_mark = LIBRARY_HIGHLIGHT
+    with _get_conn() as conn:
+        try:
+            result["total"] = conn.execute("SELECT count(*) FROM library_fts WHERE library_fts MATCH ?", (expression,)).fetchone()[0]
+            rows = conn.execute(
+                """
+                SELECT c.doc_key, c.token_start, library_fts.body,
+                       snippet(library_fts, 0, ?, ?, '…', ?), bm25(library_fts)
+                FROM library_fts JOIN library_chunks c ON c.id = library_fts.rowid
+                WHERE library_fts MATCH ?
+                ORDER BY rank
+                LIMIT ? OFFSET ?
+                """,
+                (open_mark, close_mark, LIBRARY_SNIPPET_WORDS, expression, limit, offset),
+            ).fetchall()
+        except sqlite3.OperationalError as e:
+            raise LibrarySearchUnavailable(str(e)) from e
+        documents = _documents_by_key(conn, sorted({r[0] for r in rows}))
+    for doc_key, token_start, body, snippet, score in rows:
+        doc = documents.get(doc_key)
+        if doc is None:
+            # Conteúdo sem documento (removido no meio tempo)
+            continue
+        result["hits"].append({
+            **doc,
+            "token_index": token_start + _first_matching_token(body, terms),
+            "snippet": snippet.replace("\n", " "),
+            "score": -score,
+        })
+    return result
+
+
+def rebuild_library_index(verbose: bool = False) -> int:
+    """Refaz a tabela FTS a partir dos caches de tokens dos documentos concluídos."""
+    with _get_conn() as conn:
+        conn.execute("DELETE FROM library_fts")
+        conn.execute("DELETE FROM library_chunks")
+        conn.commit()
+        rows = conn.execute("SELECT id, content_hash, file_path FROM documents WHERE status = 'completed' ORDER BY uploaded_at").fetchall()
+    indexed = 0
+    seen = set()
+    for i, (doc_id, content_hash, file_path) in enumerate(rows, 1):
+        doc_key = content_key(doc_id, content_hash, file_path)
+        if doc_key in seen:
+            continue
+        seen.add(doc_key)
+        cached = load_tokens_cache(doc_id)
+        if cached is None:
+            if verbose:
+                print(f"[{i}/{len(rows)}] {doc_id}: sem cache de tokens, ignorado")
+            continue
+        index_library_document(doc_id, cached["tokens"])
+        indexed += 1
+        if verbose:
+            print(f"[{i}/{len(rows)}] {doc_id}: {len(cached['tokens'])} tokens")
+    return indexed
+
+
+search_document_async = _async_version(search_document)
+search_library_async = _async_version(search_library)
+remove_library_document_async = _async_version(remove_library_document)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Manutenção dos índices de busca")
+    parser.add_argument("--rebuild-library", action="store_true", help="refaz a busca da biblioteca a partir de data/tokens")
+    args = parser.parse_args()
+    if not args.rebuild_library:
+        parser.print_help()
+        return
+    init_db()
+    indexed = rebuild_library_index(verbose=True)
+    print(f"{indexed} documentos indexados")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,162 @@
-from typing import Any, Dict, List, Optional
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from array import array
+from collections import OrderedDict
+from itertools import accumulate
 from pathlib import Path
 import sqlite3
 from datetime import datetime
+import asyncio
+import functools
+import gzip
 import json
+import mmap
+import os
+import struct
+import sys
+import threading
+import weakref
+
+import pydantic_core
+
+from .metrics import STORAGE_SECONDS, TOKENS_CACHE_LOOKUPS, counter, gauge, timed
+from .textutils import TOKENIZER_VERSION, build_cost_prefix, build_page_index
+
+
+def _estimate_bytes(value: Any) -> int:
+    """Estimativa de memória de um valor da entrada. Listas grandes são amostradas.
+
+    Visões sobre o cache mapeado (mmap: TokenTexts, memoryview) contam de propósito só
+    o objeto, não o tamanho do arquivo: as páginas são do page cache do sistema, lidas
+    sob demanda e descartáveis pelo kernel, e não do heap do processo que o orçamento
+    de `DocumentCache` limita. Entradas abertas do disco custam quase nada; as que
+    pesam são as montadas pelo processamento, em listas.
+    """
+    if isinstance(value, list):
+        n = len(value)
+        if n == 0:
+            return sys.getsizeof(value)
+        sample = value[:: max(1, n // 1000)]
+        per_item = sum(sys.getsizeof(v) for v in sample) / len(sample)
+        return sys.getsizeof(value) + int(per_item * n)
+    return sys.getsizeof(value)
+
+
+class DocumentCache:
+    """Cache LRU em memória para o conteúdo processado (tokens/words), com orçamento
+    de memória estimada. Entradas ainda em "processing" nunca são descartadas;
+    entradas descartadas são recarregadas do cache de tokens em disco. Entradas abertas
+    do cache binário trazem o mapeamento em "mapping" (MappedFile). Sair do cache não
+    fecha o mapeamento: leituras em andamento seguram a entrada, e ele some com a última
+    referência. Só `release_mapped` fecha à força, antes de regravar ou apagar o arquivo.
+
+    Exemplo de entrada: {"doc-123": {"status": "completed", "words": ["olá", "mundo"]}}
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self._total_bytes = 0
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, document_id: object) -> bool:
+        return document_id in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __getitem__(self, document_id: str) -> Dict[str, Any]:
+        entry = self.get(document_id)
+        if entry is None:
+            raise KeyError(document_id)
+        return entry
+
+    def get(self, document_id: str, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(document_id)
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(document_id)
+            self.hits += 1
+            return entry
+
+    def __setitem__(self, document_id: str, entry: Dict[str, Any]) -> None:
+        with self._lock:
+            self._entries[document_id] = entry
+            self._entries.move_to_end(document_id)
+            self._resize(document_id)
+            self._evict(keep=document_id)
+
+    def __delitem__(self, document_id: str) -> None:
+        with self._lock:
+            if document_id not in self._entries:
+                raise KeyError(document_id)
+            self._drop(document_id)
+
+    def discard_mapped(self, target: Path) -> None:
+        """Tira as entradas que leem o arquivo mapeado `target` (prestes a ser regravado ou apagado)."""
+        with self._lock:
+            for document_id, entry in list(self._entries.items()):
+                mapping = entry.get("mapping")
+                if mapping is not None and mapping.path == target:
+                    self._drop(document_id)
+
+    def _drop(self, document_id: str) -> None:
+        self._entries.pop(document_id)
+        self._total_bytes -= self._sizes.pop(document_id, 0)
+
+    def refresh(self, document_id: str) -> None:
+        """Recalcula o tamanho de uma entrada alterada no lugar (a publicação
+        incremental do processamento chama a cada lote)."""
+        with self._lock:
+            if document_id in self._entries:
+                self._resize(document_id)
+                self._evict(keep=document_id)
+
+    def _resize(self, document_id: str) -> None:
+        size = sum(_estimate_bytes(v) for v in self._entries[document_id].values())
+        self._total_bytes += size - self._sizes.get(document_id, 0)
+        self._sizes[document_id] = size
+
+    def _evict(self, keep: str) -> None:
+        # Percorre do menos para o mais recente; a entrada recém-gravada fica mesmo
+        # se sozinha exceder o orçamento
+        if self._total_bytes <= self.max_bytes:
+            return
+        for document_id in list(self._entries):
+            if self._total_bytes <= self.max_bytes:
+                break
+            if document_id == keep or self._entries[document_id].get("status") == "processing":
+                continue
+            self._drop(document_id)
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
 
 
 # Banco de dados em memória para conteúdo processado (tokens/words)
-# Exemplo: {"doc-123": {"status": "completed", "words": ["olá", "mundo"]}}
-db: Dict[str, Dict[str, Any]] = {}
+CACHE_MAX_BYTES = int(os.environ.get("LEITOR_CACHE_MAX_MB", "512")) * 1024 * 1024
+db = DocumentCache(CACHE_MAX_BYTES)
+
+gauge("leitor_memory_cache_bytes", "Bytes estimados no cache de documentos em memória", fn=lambda: db.stats()["bytes"])
+gauge("leitor_memory_cache_entries", "Documentos no cache em memória", fn=lambda: db.stats()["entries"])
+counter("leitor_memory_cache_hits_total", "Acertos do cache de documentos em memória", fn=lambda: db.hits)
+counter("leitor_memory_cache_misses_total", "Faltas do cache de documentos em memória", fn=lambda: db.misses)
+counter("leitor_memory_cache_evictions_total", "Documentos removidos do cache em memória por falta de espaço", fn=lambda: db.evictions)
 
 
 # Persistência leve em SQLite para metadados dos documentos
@@ -19,8 +168,29 @@ TOKENS_DIR = DATA_DIR / "tokens"
 TOKENS_DIR.mkdir(parents=True, exist_ok=True)
 
 
+# Uma conexão por thread, reaproveitada entre chamadas. O sqlite3 mantém um cache de
+# statements preparados por conexão, então as consultas fixas deste módulo são
+# compiladas uma única vez por thread.
+_local = threading.local()
+
+
+def _connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(SQLITE_PATH, check_same_thread=False, cached_statements=256)
+    # WAL: leitores não bloqueiam o escritor e o commit não reescreve o journal inteiro
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA cache_size=-8192")  # 8 MiB
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA busy_timeout=5000")
+    return conn
+
+
 def _get_conn() -> sqlite3.Connection:
-    return sqlite3.connect(SQLITE_PATH, check_same_thread=False)
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = _connect()
+        _local.conn = conn
+    return conn
 
 
 def init_db() -> None:
@@ -36,7 +206,9 @@ def init_db() -> None:
                 status TEXT NOT NULL,
                 page_count INTEGER DEFAULT 0,
                 last_read_page INTEGER DEFAULT 1,
-                last_token_index INTEGER DEFAULT 0
+                last_token_index INTEGER DEFAULT 0,
+                content_hash TEXT,
+                pdf_backend TEXT
             )
             """
         )
@@ -48,21 +220,48 @@ def init_db() -> None:
                 conn.execute("ALTER TABLE documents ADD COLUMN mime_type TEXT")
             if "last_token_index" not in cols:
                 conn.execute("ALTER TABLE documents ADD COLUMN last_token_index INTEGER DEFAULT 0")
+            if "content_hash" not in cols:
+                conn.execute("ALTER TABLE documents ADD COLUMN content_hash TEXT")
+            if "pdf_backend" not in cols:
+                conn.execute("ALTER TABLE documents ADD COLUMN pdf_backend TEXT")
         except Exception:
             pass
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_documents_uploaded_at ON documents (uploaded_at DESC)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_documents_content_hash ON documents (content_hash)")
+        # Busca na biblioteca (search.py): trechos de tokens por conteúdo, indexados pelo FTS5.
+        # library_chunks guarda a origem de cada trecho (mesmo rowid da tabela FTS)
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS library_chunks (
+                id INTEGER PRIMARY KEY,
+                doc_key TEXT NOT NULL,
+                token_start INTEGER NOT NULL
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_library_chunks_doc_key ON library_chunks (doc_key)")
+        try:
+            conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS library_fts USING fts5(body, tokenize = 'unicode61 remove_diacritics 2')"
+            )
+        except sqlite3.OperationalError:
+            # SQLite sem FTS5: a busca na biblioteca fica indisponível
+            pass
         conn.commit()
 
 
-def insert_document_record(document_id: str, filename: str, file_path: str, mime_type: str | None, status: str = "processing") -> None:
+@timed(STORAGE_SECONDS, operation="insert_document_record")
+def insert_document_record(document_id: str, filename: str, file_path: str, mime_type: str | None, status: str = "processing", content_hash: str | None = None, pdf_backend: str | None = None) -> None:
     uploaded_at = datetime.utcnow().isoformat()
     with _get_conn() as conn:
         conn.execute(
-            "INSERT OR REPLACE INTO documents (id, filename, file_path, mime_type, uploaded_at, status, page_count, last_read_page) VALUES (?, ?, ?, ?, ?, COALESCE((SELECT status FROM documents WHERE id = ?), ?), COALESCE((SELECT page_count FROM documents WHERE id = ?), 0), COALESCE((SELECT last_read_page FROM documents WHERE id = ?), 1))",
-            (document_id, filename, file_path, mime_type, uploaded_at, document_id, status, document_id, document_id),
+            "INSERT OR REPLACE INTO documents (id, filename, file_path, mime_type, uploaded_at, status, page_count, last_read_page, content_hash, pdf_backend) VALUES (?, ?, ?, ?, ?, COALESCE((SELECT status FROM documents WHERE id = ?), ?), COALESCE((SELECT page_count FROM documents WHERE id = ?), 0), COALESCE((SELECT last_read_page FROM documents WHERE id = ?), 1), ?, ?)",
+            (document_id, filename, file_path, mime_type, uploaded_at, document_id, status, document_id, document_id, content_hash, pdf_backend),
         )
         conn.commit()
 
 
+@timed(STORAGE_SECONDS, operation="update_document_after_processing")
 def update_document_after_processing(document_id: str, page_count: int, status: str = "completed") -> None:
     with _get_conn() as conn:
         conn.execute(
@@ -72,6 +271,7 @@ def update_document_after_processing(document_id: str, page_count: int, status:
         conn.commit()
 
 
+@timed(STORAGE_SECONDS, operation="list_documents")
 def list_documents() -> List[Dict[str, Any]]:
     with _get_conn() as conn:
         cur = conn.execute(
@@ -91,19 +291,21 @@ def list_documents() -> List[Dict[str, Any]]:
         }
         for r in rows
     ]
-    return documents
+    # Reflete o progresso ainda não gravado
+    return [_apply_buffered_progress(d) for d in documents]
 
 
+@timed(STORAGE_SECONDS, operation="get_document_meta")
 def get_document_meta(document_id: str) -> Optional[Dict[str, Any]]:
     with _get_conn() as conn:
         cur = conn.execute(
-            "SELECT id, filename, status, page_count, last_read_page, uploaded_at, file_path, mime_type, last_token_index FROM documents WHERE id = ?",
+            "SELECT id, filename, status, page_count, last_read_page, uploaded_at, file_path, mime_type, last_token_index, content_hash, pdf_backend FROM documents WHERE id = ?",
             (document_id,),
         )
         r = cur.fetchone()
     if not r:
         return None
-    return {
+    return _apply_buffered_progress({
         "id": r[0],
         "filename": r[1],
         "status": r[2],
@@ -113,51 +315,403 @@ def get_document_meta(document_id: str) -> Optional[Dict[str, Any]]:
         "file_path": r[6],
         "mime_type": r[7],
         "last_token_index": int(r[8] or 0),
-    }
-def update_progress(document_id: str, last_read_page: int | None = None, last_token_index: int | None = None) -> None:
+        "content_hash": r[9],
+        "pdf_backend": r[10],
+    })
+
+
+def content_key(document_id: str, content_hash: str | None, file_path: str | None) -> str:
+    """Chave do conteúdo: hash mais extensão, o mesmo nome do arquivo em uploads/. Os
+    mesmos bytes enviados como .txt e como .md são extraídos de formas diferentes e não
+    compartilham tokens. Documentos antigos, sem hash, usam o próprio id.
+    """
+    if not content_hash:
+        return document_id
+    return content_hash + Path(file_path or "").suffix.lower()
+
+
+@timed(STORAGE_SECONDS, operation="find_completed_by_hash")
+def find_completed_by_hash(content_hash: str, ext: str) -> Optional[Dict[str, Any]]:
+    """Documento já processado com o mesmo conteúdo e formato (`ext`, ex. ".md"), para
+    deduplicação de uploads."""
     with _get_conn() as conn:
-        if last_read_page is not None and last_token_index is not None:
-            conn.execute("UPDATE documents SET last_read_page = ?, last_token_index = ? WHERE id = ?", (last_read_page, last_token_index, document_id))
-        elif last_read_page is not None:
-            conn.execute("UPDATE documents SET last_read_page = ? WHERE id = ?", (last_read_page, document_id))
-        elif last_token_index is not None:
-            conn.execute("UPDATE documents SET last_token_index = ? WHERE id = ?", (last_token_index, document_id))
-        else:
-            return
-        conn.commit()
+        cur = conn.execute(
+            "SELECT id, page_count, pdf_backend, file_path FROM documents WHERE content_hash = ? AND status = 'completed' ORDER BY uploaded_at",
+            (content_hash,),
+        )
+        for r in cur:
+            if Path(r[3] or "").suffix.lower() == ext:
+                return {"id": r[0], "page_count": int(r[1] or 0), "pdf_backend": r[2]}
+    return None
 
 
-def update_last_read_page(document_id: str, last_read_page: int) -> None:
+@timed(STORAGE_SECONDS, operation="count_documents_by_hash")
+def count_documents_by_hash(content_hash: str, ext: str) -> int:
+    """Documentos com o mesmo conteúdo e formato: os que compartilham arquivo e caches."""
     with _get_conn() as conn:
-        conn.execute(
-            "UPDATE documents SET last_read_page = ? WHERE id = ?",
-            (last_read_page, document_id),
+        cur = conn.execute("SELECT file_path FROM documents WHERE content_hash = ?", (content_hash,))
+        return sum(1 for (file_path,) in cur if Path(file_path or "").suffix.lower() == ext)
+
+
+# Progresso de leitura com escrita adiada: guarda só o valor mais recente por documento
+# e grava tudo numa única transação a cada PROGRESS_FLUSH_SECONDS (e no shutdown).
+PROGRESS_FLUSH_SECONDS = float(os.environ.get("LEITOR_PROGRESS_FLUSH_SECONDS", "2"))
+_progress_buffer: Dict[str, Tuple[Optional[int], Optional[int]]] = {}
+# Lote sendo gravado: continua visível para leitura até o commit
+_progress_flushing: Dict[str, Tuple[Optional[int], Optional[int]]] = {}
+_progress_lock = threading.Lock()
+_flush_lock = threading.Lock()
+_progress_stop = threading.Event()
+_progress_thread: Optional[threading.Thread] = None
+
+
+def update_progress(document_id: str, last_read_page: int | None = None, last_token_index: int | None = None) -> None:
+    if last_read_page is None and last_token_index is None:
+        return
+    with _progress_lock:
+        prev_page, prev_index = _progress_buffer.get(document_id, (None, None))
+        _progress_buffer[document_id] = (
+            last_read_page if last_read_page is not None else prev_page,
+            last_token_index if last_token_index is not None else prev_index,
         )
-        conn.commit()
 
 
+def _apply_buffered_progress(doc: Dict[str, Any]) -> Dict[str, Any]:
+    with _progress_lock:
+        buffered = _progress_buffer.get(doc["id"]) or _progress_flushing.get(doc["id"])
+    if buffered is not None:
+        page, index = buffered
+        if page is not None:
+            doc["last_read_page"] = page
+        if index is not None:
+            doc["last_token_index"] = index
+    return doc
+
+
+@timed(STORAGE_SECONDS, operation="flush_progress")
+def flush_progress() -> int:
+    """Grava o progresso pendente em lote. Retorna quantos documentos foram atualizados."""
+    global _progress_buffer, _progress_flushing
+    with _flush_lock:
+        with _progress_lock:
+            pending, _progress_buffer = _progress_buffer, {}
+            _progress_flushing = pending
+        if not pending:
+            return 0
+        try:
+            with _get_conn() as conn:
+                conn.executemany(
+                    "UPDATE documents SET last_read_page = COALESCE(?, last_read_page), last_token_index = COALESCE(?, last_token_index) WHERE id = ?",
+                    [(page, index, document_id) for document_id, (page, index) in pending.items()],
+                )
+        except Exception:
+            # Devolve ao buffer sem sobrescrever valores mais novos que chegaram no meio tempo
+            with _progress_lock:
+                for document_id, value in pending.items():
+                    _progress_buffer.setdefault(document_id, value)
+            raise
+        finally:
+            with _progress_lock:
+                _progress_flushing = {}
+        return len(pending)
+
+
+def _progress_flush_loop() -> None:
+    while not _progress_stop.wait(PROGRESS_FLUSH_SECONDS):
+        try:
+            flush_progress()
+        except Exception:
+            pass
+
+
+def start_progress_flusher() -> None:
+    global _progress_thread
+    if _progress_thread is not None and _progress_thread.is_alive():
+        return
+    _progress_stop.clear()
+    _progress_thread = threading.Thread(target=_progress_flush_loop, name="progress-flusher", daemon=True)
+    _progress_thread.start()
+
+
+def stop_progress_flusher() -> None:
+    """Para o flush periódico e grava o que ainda estiver pendente."""
+    global _progress_thread
+    _progress_stop.set()
+    if _progress_thread is not None:
+        _progress_thread.join()
+        _progress_thread = None
+    flush_progress()
+
+
+def update_last_read_page(document_id: str, last_read_page: int) -> None:
+    update_progress(document_id, last_read_page=last_read_page)
+
+
+@timed(STORAGE_SECONDS, operation="delete_document_record")
 def delete_document_record(document_id: str) -> None:
+    with _progress_lock:
+        _progress_buffer.pop(document_id, None)
+        _progress_flushing.pop(document_id, None)
     with _get_conn() as conn:
         conn.execute("DELETE FROM documents WHERE id = ?", (document_id,))
         conn.commit()
 
 
-def save_tokens_cache(document_id: str, *, tokens: List[str], token_pages: List[int], token_weights: List[int], page_count: int) -> None:
-    payload = {
-        "tokens": tokens,
-        "pages": token_pages,
-        "weights": token_weights,
+def _cache_key(document_id: str) -> str:
+    """Chave do cache de tokens: a chave do conteúdo (`content_key`), compartilhada entre
+    uploads iguais do mesmo formato. Documentos antigos, sem hash, continuam usando o próprio id.
+    """
+    with _get_conn() as conn:
+        cur = conn.execute("SELECT content_hash, file_path FROM documents WHERE id = ?", (document_id,))
+        r = cur.fetchone()
+    if r:
+        return content_key(document_id, r[0], r[1])
+    return document_id
+
+
+# Cache binário de tokens (.tok), aberto via mmap e fatiável sem decodificar tudo.
+# Layout (little-endian):
+#   cabeçalho: magic, versão, versão do tokenizador, n_tokens, page_count, len(page_index), len(blob)
+#   offsets:    uint64[n_tokens + 1]  início de cada token no blob (+1 separador no fim)
+#   pages:      uint32[n_tokens]
+#   weights:    uint32[n_tokens]
+#   page_index: uint32[len(page_index)]
+#   costs:      float64[n_tokens + 1]  soma acumulada do custo de leitura (versão 2+)
+#   blob:       tokens em UTF-8 separados por "\n" (a extração nunca gera "\n" em tokens)
+# Arquivos da versão 1 (sem costs) são regravados na primeira leitura. A versão do
+# tokenizador ocupa o antigo campo de flags; 0 (arquivos anteriores a ela) vale 1.
+TOKENS_CACHE_MAGIC = b"LRTK"
+TOKENS_CACHE_VERSION = 2
+_TOKENS_HEADER = struct.Struct("<4sHHQQQQ")
+
+
+def _align8(n: int) -> int:
+    return (n + 7) & ~7
+
+
+# Mapeamentos abertos por arquivo. No Windows um arquivo mapeado não pode ser substituído
+# nem apagado: antes de regravar ou apagar um cache, todos os mapeamentos dele são fechados.
+_mapped_files: Dict[str, "weakref.WeakSet[MappedFile]"] = {}
+_mapped_files_lock = threading.Lock()
+
+
+class MappedFile:
+    """Arquivo de cache mapeado (mmap, só leitura) e as visões criadas sobre ele.
+    `close` solta as visões e desfaz o mapeamento; quem ainda usar uma delas recebe
+    ValueError. Sem `close`, o mapeamento some junto com a última referência às visões.
+    """
+
+    def __init__(self, target: Path) -> None:
+        self.path = target
+        with open(target, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._views: List[memoryview] = []
+        self.closed = False
+        self.view = self.track(memoryview(self._mm))
+        with _mapped_files_lock:
+            _mapped_files.setdefault(str(target), weakref.WeakSet()).add(self)
+
+    def track(self, value):
+        """Registra uma visão (fatia ou cast) para ser solta no `close`."""
+        if isinstance(value, memoryview):
+            self._views.append(value)
+        return value
+
+    def close(self) -> None:
+        self.closed = True
+        with _mapped_files_lock:
+            files = _mapped_files.get(str(self.path))
+            if files is not None:
+                files.discard(self)
+                if not files:
+                    del _mapped_files[str(self.path)]
+        # Derivadas antes da visão base
+        for view in reversed(self._views):
+            try:
+                view.release()
+            except BufferError:
+                pass
+        self._views.clear()
+        try:
+            self._mm.close()
+        except BufferError:
+            # Uma fatia ainda está em uso (leitura em andamento): fecha com a última referência
+            pass
+
+
+def _close_mapping(data: Dict[str, Any]) -> None:
+    mapping = data.get("mapping")
+    if mapping is not None:
+        mapping.close()
+
+
+def mapping_released(data: Optional[Dict[str, Any]]) -> bool:
+    """Se o mapeamento de `data` foi fechado por `release_mapped` (arquivo regravado ou
+    apagado): o ValueError de quem lia é para recarregar, não um erro de verdade."""
+    mapping = data.get("mapping") if data else None
+    return mapping is not None and mapping.closed
+
+
+def release_mapped(target: Path) -> None:
+    """Fecha todos os mapeamentos de `target` e tira de `db` as entradas que os usam."""
+    db.discard_mapped(target)
+    with _mapped_files_lock:
+        files = list(_mapped_files.pop(str(target), ()))
+    for mapped in files:
+        mapped.close()
+
+
+class TokenTexts(Sequence):
+    """Sequência de tokens sobre o blob mapeado; decodifica apenas o trecho acessado."""
+
+    def __init__(self, blob: memoryview, offsets: memoryview) -> None:
+        self._blob = blob
+        self._offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index):
+        n = len(self)
+        if isinstance(index, slice):
+            start, stop, step = index.indices(n)
+            if step != 1:
+                return [self[i] for i in range(start, stop, step)]
+            if start >= stop:
+                return []
+            raw = bytes(self._blob[self._offsets[start]:self._offsets[stop] - 1])
+            return raw.decode("utf-8").split("\n")
+        if index < 0:
+            index += n
+        if not 0 <= index < n:
+            raise IndexError("token index out of range")
+        return bytes(self._blob[self._offsets[index]:self._offsets[index + 1] - 1]).decode("utf-8")
+
+
+def _cast_uint(view: memoryview, fmt: str):
+    if sys.byteorder == "little":
+        return view.cast(fmt)
+    values = array(fmt, bytes(view))
+    values.byteswap()
+    return values
+
+
+def _tokens_paths(document_id: str) -> Tuple[Path, Path]:
+    key = _cache_key(document_id)
+    return TOKENS_DIR / f"{key}.tok", TOKENS_DIR / f"{key}.json"
+
+
+def search_index_path(document_id: str) -> Path:
+    """Índice invertido do documento (search.py), ao lado do cache de tokens."""
+    return TOKENS_DIR / f"{_cache_key(document_id)}.idx"
+
+
+def tokens_cache_exists(document_id: str) -> bool:
+    return any(p.exists() for p in _tokens_paths(document_id))
+
+
+def delete_tokens_cache(document_id: str, raw_words: bool = True) -> None:
+    """Apaga todos os arquivos do conteúdo; cada um é tentado mesmo se outro falhar
+    (ex.: ainda aberto por outro processo no Windows). `raw_words=False` mantém a
+    camada de palavras extraídas.
+    """
+    for target in (*_tokens_paths(document_id), search_index_path(document_id)):
+        release_mapped(target)
+        try:
+            target.unlink()
+        except OSError:
+            pass
+    delete_tokens_payloads(document_id)
+    if raw_words:
+        delete_raw_words(document_id)
+
+
+def _write_tokens_binary(target: Path, *, tokens: Sequence[str], token_pages: Sequence[int], token_weights: Sequence[int], page_count: int, page_index: Sequence[int], token_costs: Sequence[float], tokenizer_version: int = TOKENIZER_VERSION) -> None:
+    n = len(tokens)
+    blob = "\n".join(tokens).encode("utf-8")
+    if blob.count(b"\n") != max(0, n - 1):
+        blob = "\n".join(t.replace("\n", " ") for t in tokens).encode("utf-8")
+    sections = [
+        array("Q", accumulate((len(t.encode("utf-8")) + 1 for t in tokens), initial=0)),
+        array("I", token_pages),
+        array("I", token_weights),
+        array("I", page_index),
+        array("d", token_costs),
+    ]
+    if sys.byteorder != "little":
+        for section in sections:
+            section.byteswap()
+    # Nome único: o servidor e `python -m app.rebuild` podem regravar o mesmo cache
+    tmp = target.with_name(f"{target.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp, "wb") as f:
+        f.write(_TOKENS_HEADER.pack(TOKENS_CACHE_MAGIC, TOKENS_CACHE_VERSION, tokenizer_version, n, page_count, len(page_index), len(blob)))
+        for section in sections:
+            raw = section.tobytes()
+            f.write(raw)
+            f.write(b"\0" * (_align8(len(raw)) - len(raw)))
+        f.write(blob)
+    release_mapped(target)
+    os.replace(tmp, target)
+
+
+def _open_tokens_binary(target: Path) -> Optional[Dict[str, Any]]:
+    mapped = MappedFile(target)
+    view = mapped.view
+    magic, version, tokenizer_version, n, page_count, index_len, blob_len = _TOKENS_HEADER.unpack_from(view, 0)
+    if magic != TOKENS_CACHE_MAGIC or version not in (1, TOKENS_CACHE_VERSION):
+        mapped.close()
+        return None
+    layout = [("Q", n + 1), ("I", n), ("I", n), ("I", index_len)]
+    if version >= 2:
+        layout.append(("d", n + 1))
+    pos = _TOKENS_HEADER.size
+    sections = []
+    for fmt, count in layout:
+        size = count * (4 if fmt == "I" else 8)
+        sections.append(mapped.track(_cast_uint(view[pos:pos + size], fmt)))
+        pos += _align8(size)
+    if pos + blob_len != len(view):
+        mapped.close()
+        return None
+    data = {
+        "tokens": TokenTexts(mapped.track(view[pos:pos + blob_len]), sections[0]),
+        "pages": sections[1],
+        "weights": sections[2],
         "page_count": page_count,
+        "page_index": sections[3],
+        "version": version,
+        "tokenizer_version": tokenizer_version or 1,
+        "mapping": mapped,
     }
-    target = TOKENS_DIR / f"{document_id}.json"
-    with open(target, "w", encoding="utf-8") as f:
-        json.dump(payload, f, ensure_ascii=False)
+    if version >= 2:
+        data["costs"] = sections[4]
+    return data
 
 
-def load_tokens_cache(document_id: str) -> Optional[Dict[str, Any]]:
-    target = TOKENS_DIR / f"{document_id}.json"
-    if not target.exists():
-        return None
+@timed(STORAGE_SECONDS, operation="save_tokens_cache")
+def save_tokens_cache(document_id: str, *, tokens: List[str], token_pages: List[int], token_weights: List[int], page_count: int, page_index: List[int] | None = None, token_costs: Sequence[float] | None = None, tokenizer_version: int = TOKENIZER_VERSION) -> None:
+    target, legacy = _tokens_paths(document_id)
+    if page_index is None:
+        page_index = build_page_index(token_pages, page_count)
+    if token_costs is None:
+        token_costs = build_cost_prefix(tokens, token_weights)
+    _write_tokens_binary(
+        target,
+        tokens=tokens,
+        token_pages=token_pages,
+        token_weights=token_weights,
+        page_count=page_count,
+        page_index=page_index,
+        token_costs=token_costs,
+        tokenizer_version=tokenizer_version,
+    )
+    if legacy.exists():
+        legacy.unlink()
+    # Tokens regravados: payloads comprimidos antigos deixam de valer
+    delete_tokens_payloads(document_id)
+
+
+def _load_tokens_json(target: Path) -> Optional[Dict[str, Any]]:
     try:
         with open(target, "r", encoding="utf-8") as f:
             data = json.load(f)
@@ -169,3 +723,215 @@ def load_tokens_cache(document_id: str) -> Optional[Dict[str, Any]]:
         return None
 
 
+@timed(STORAGE_SECONDS, operation="load_tokens_cache")
+def load_tokens_cache(document_id: str) -> Optional[Dict[str, Any]]:
+    """Abre o cache binário via mmap. Caches .json antigos são migrados na primeira leitura."""
+    cached = _load_tokens_cache(document_id)
+    TOKENS_CACHE_LOOKUPS.inc(result="hit" if cached is not None else "miss")
+    return cached
+
+
+def _load_tokens_cache(document_id: str) -> Optional[Dict[str, Any]]:
+    target, legacy = _tokens_paths(document_id)
+    if not target.exists() and legacy.exists():
+        data = _load_tokens_json(legacy)
+        if data is None:
+            return None
+        tokens = data.get("tokens", [])
+        try:
+            save_tokens_cache(
+                document_id,
+                tokens=tokens,
+                token_pages=data.get("pages") or [1] * len(tokens),
+                token_weights=data.get("weights") or [1] * len(tokens),
+                page_count=data.get("page_count", 0),
+                page_index=data.get("page_index"),
+                # Caches .json são anteriores ao versionamento do tokenizador
+                tokenizer_version=1,
+            )
+        except Exception:
+            return data | {"tokenizer_version": 1}
+    if not target.exists():
+        return None
+    try:
+        data = _open_tokens_binary(target)
+    except Exception:
+        return None
+    if data is not None and data["version"] < TOKENS_CACHE_VERSION:
+        # Migração: regrava no formato atual (acrescenta a soma acumulada dos custos)
+        try:
+            save_tokens_cache(
+                document_id,
+                tokens=data["tokens"][:],
+                token_pages=data["pages"],
+                token_weights=data["weights"],
+                page_count=data["page_count"],
+                page_index=data["page_index"],
+                tokenizer_version=data["tokenizer_version"],
+            )
+        except Exception:
+            pass
+        # A regravação fecha o mapeamento antigo, mesmo se falhar no fim: reabre
+        try:
+            data = _open_tokens_binary(target)
+        except Exception:
+            return None
+    return data
+
+
+# Camada intermediária: palavras por página como saíram da extração, antes da
+# tokenização (<chave>.x<versão do extrator>.words.gz). Com ela, uma mudança no
+# tokenizador refaz só a tokenização, sem abrir o PDF/EPUB de novo.
+# Formato: texto UTF-8 em gzip, uma linha por página, "<página> <palavra> <palavra> ...",
+# entre a linha RAW_WORDS_MAGIC e a linha final "#end <page_count>" (palavras nunca têm
+# espaço nem "\n"; a extração separa por eles).
+RAW_WORDS_MAGIC = "#leitor-words 1"
+RAW_WORDS_COMPRESSLEVEL = 6
+
+
+def raw_words_path(document_id: str, extractor_version: int | str) -> Path:
+    return TOKENS_DIR / f"{_cache_key(document_id)}.x{extractor_version}.words.gz"
+
+
+def raw_words_exists(document_id: str, extractor_version: int | str) -> bool:
+    return raw_words_path(document_id, extractor_version).exists()
+
+
+class RawWordsWriter:
+    """Grava as páginas conforme são extraídas; o arquivo só aparece em `commit`."""
+
+    def __init__(self, target: Path) -> None:
+        self.target = target
+        self._tmp = target.with_name(f"{target.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        self._file = gzip.open(self._tmp, "wt", encoding="utf-8", newline="\n", compresslevel=RAW_WORDS_COMPRESSLEVEL)
+        self._file.write(RAW_WORDS_MAGIC + "\n")
+
+    def write_page(self, page: int, words: Sequence[str]) -> None:
+        self._file.write(f"{page} {' '.join(words)}\n")
+
+    def commit(self, page_count: int) -> None:
+        self._file.write(f"#end {page_count}\n")
+        self._file.close()
+        os.replace(self._tmp, self.target)
+
+    def discard(self) -> None:
+        try:
+            self._file.close()
+            self._tmp.unlink()
+        except Exception:
+            pass
+
+
+def iter_raw_words(document_id: str, extractor_version: int | str) -> Iterator[Tuple[int, List[str]]]:
+    """(página, palavras) na ordem gravada. Arquivo inválido ou truncado levanta ValueError."""
+    with gzip.open(raw_words_path(document_id, extractor_version), "rt", encoding="utf-8", newline="\n") as f:
+        if f.readline() != RAW_WORDS_MAGIC + "\n":
+            raise ValueError("Cache de palavras em formato desconhecido")
+        for line in f:
+            if line.startswith("#end "):
+                return
+            page, _, rest = line[:-1].partition(" ")
+            yield int(page), rest.split(" ") if rest else []
+    raise ValueError("Cache de palavras incompleto")
+
+
+def delete_raw_words(document_id: str) -> None:
+    key = _cache_key(document_id)
+    for target in TOKENS_DIR.glob(f"{key}.x*.words.gz"):
+        try:
+            target.unlink()
+        except OSError:
+            pass
+
+
+# Payload JSON completo de /tokens pré-comprimido, gravado ao lado do cache de tokens
+# (<chave>.v<variante>.json.gz / .json.br, variante = processing.tokens_variant:
+# tokenizador + camada de palavras/extrator) e servido direto do disco.
+try:
+    import brotli  # type: ignore
+except Exception:  # opcional: sem o módulo, só gzip
+    brotli = None
+
+PAYLOAD_ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+_PAYLOAD_SUFFIXES = {"gzip": ".json.gz", "br": ".json.br"}
+
+
+def tokens_payload_path(document_id: str, encoding: str, variant: str) -> Path:
+    return TOKENS_DIR / f"{_cache_key(document_id)}.v{variant}{_PAYLOAD_SUFFIXES[encoding]}"
+
+
+def _compress_payload(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=11)
+    # mtime fixo: o mesmo conteúdo gera sempre os mesmos bytes
+    return gzip.compress(body, compresslevel=9, mtime=0)
+
+
+def build_tokens_payload(*, tokens: Sequence[str], token_pages: Sequence[int], token_weights: Sequence[int], page_count: int) -> bytes:
+    """Corpo de /tokens do documento inteiro (mesmos campos e bytes que a API monta)."""
+    return pydantic_core.to_json({
+        "tokens": list(tokens),
+        "pages": list(token_pages),
+        "page_count": page_count,
+        "weights": list(token_weights),
+        "offset": 0,
+        "total": len(tokens),
+        "complete": True,
+    })
+
+
+@timed(STORAGE_SECONDS, operation="save_tokens_payloads")
+def save_tokens_payloads(document_id: str, body: bytes, variant: str) -> Dict[str, Path]:
+    """Comprime o payload uma vez em cada codificação disponível."""
+    paths: Dict[str, Path] = {}
+    for encoding in PAYLOAD_ENCODINGS:
+        target = tokens_payload_path(document_id, encoding, variant)
+        tmp = target.with_name(f"{target.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp, "wb") as f:
+            f.write(_compress_payload(body, encoding))
+        os.replace(tmp, target)
+        paths[encoding] = target
+    return paths
+
+
+def delete_tokens_payloads(document_id: str) -> None:
+    key = _cache_key(document_id)
+    for target in TOKENS_DIR.glob(f"{key}.v*.json.*"):
+        try:
+            target.unlink()
+        except OSError:
+            pass
+
+
+# API assíncrona: as mesmas funções, executadas num pool de threads próprio para I/O.
+# Handlers async esperam o resultado sem ocupar o event loop nem o threadpool do servidor;
+# como as conexões SQLite são por thread, o pool pequeno também limita as conexões abertas.
+IO_THREADS = int(os.environ.get("LEITOR_IO_THREADS", "8"))
+_io_executor = ThreadPoolExecutor(max_workers=IO_THREADS, thread_name_prefix="storage-io")
+
+
+def run_io(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Awaitable[Any]:
+    """Executa `fn` no pool de I/O e devolve um awaitable com o resultado."""
+    loop = asyncio.get_running_loop()
+    return loop.run_in_executor(_io_executor, functools.partial(fn, *args, **kwargs))
+
+
+def _async_version(fn: Callable[..., Any]) -> Callable[..., Awaitable[Any]]:
+    @functools.wraps(fn)
+    async def wrapper(*args: Any, **kwargs: Any) -> Any:
+        return await run_io(fn, *args, **kwargs)
+    wrapper.__name__ = wrapper.__qualname__ = f"{fn.__name__}_async"
+    return wrapper
+
+
+insert_document_record_async = _async_version(insert_document_record)
+update_document_after_processing_async = _async_version(update_document_after_processing)
+list_documents_async = _async_version(list_documents)
+get_document_meta_async = _async_version(get_document_meta)
+find_completed_by_hash_async = _async_version(find_completed_by_hash)
+count_documents_by_hash_async = _async_version(count_documents_by_hash)
+delete_document_record_async = _async_version(delete_document_record)
+tokens_cache_exists_async = _async_version(tokens_cache_exists)
+delete_tokens_cache_async = _async_version(delete_tokens_cache)
+load_tokens_cache_async = _async_version(load_tokens_cache)
+save_tokens_payloads_async = _async_version(save_tokens_payloads)
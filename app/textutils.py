@@ -1,10 +1,21 @@
 from __future__ import annotations
 
+import os
 import re
-from typing import List, Tuple
+import unicodedata
+from collections import deque
+from functools import lru_cache
+from array import array
+from bisect import bisect_right
+from itertools import accumulate
+from typing import Deque, Dict, Iterable, Iterator, List, NamedTuple, Sequence, Tuple
 import string
 
 
+# Versão das regras de tokenização. Incrementar quando a saída mudar: invalida ETags
+# e payloads pré-comprimidos dos tokens.
+TOKENIZER_VERSION = 1
+
 _VOWELS = "aeiouáéíóúâêôãõàüy"
 _EDGE_PUNCT_RE = re.compile(r"^[\W_]+|[\W_]+$", re.UNICODE)
 _VOWEL_GROUPS_RE = re.compile("[" + _VOWELS + "]+", re.IGNORECASE)
@@ -62,12 +73,12 @@ def group_words_with_pages(words: List[str], pages: List[int]) -> tuple[List[str
         current = words[i]
         current_page = pages[i]
         next_word = words[i + 1] if i + 1 < n else None
-        prev_word = words[i - 1] if i - 1 >= 0 else None
+        info = classify_word(current)
         if (
-            is_monosyllabic(current)
+            info.monosyllabic
             and next_word is not None
-            and not _has_trailing_dot(current)
-            and not (prev_word is not None and _has_trailing_dot(prev_word))
+            and not info.trailing_dot
+            and not (i - 1 >= 0 and classify_word(words[i - 1]).trailing_dot)
         ):
             tokens.append(f"{current} {next_word}")
             token_pages.append(current_page)
@@ -105,7 +116,7 @@ def preprocess_hyphens(words: List[str], pages: List[int]) -> tuple[List[str], L
             current != "-"
             and next_word == "-"
             and (i + 2) < n
-            and _is_alpha_word(words[i + 2])
+            and classify_word(words[i + 2]).alpha
         ):
             merged = f"{current}-{words[i + 2]}"
             result_words.append(merged)
@@ -118,7 +129,7 @@ def preprocess_hyphens(words: List[str], pages: List[int]) -> tuple[List[str], L
             isinstance(current, str)
             and current.endswith("-")
             and next_word is not None
-            and _is_alpha_word(next_word)
+            and classify_word(next_word).alpha
         ):
             merged = current[:-1] + next_word
             result_words.append(merged)
@@ -150,6 +161,64 @@ def _count_words_in_token(token: str) -> int:
     return len([w for w in token.strip().split() if w])
 
 
+class WordInfo(NamedTuple):
+    """Classificação de uma palavra/token, calculada de uma vez só."""
+
+    stripped: str  # sem pontuação nas bordas
+    monosyllabic: bool  # is_monosyllabic(palavra)
+    stripped_monosyllabic: bool  # is_monosyllabic(stripped)
+    alpha: bool  # _is_alpha_word(palavra)
+    stripped_alpha: bool  # _is_alpha_word(stripped)
+    trailing_punct: bool
+    trailing_dot: bool
+    word_count: int
+
+
+# O vocabulário de texto natural é bem concentrado: memoiza a classificação pela
+# palavra crua, com tamanho limitado (LRU)
+CLASSIFY_CACHE_SIZE = int(os.environ.get("LEITOR_CLASSIFY_CACHE_SIZE", "131072"))
+
+
+@lru_cache(maxsize=CLASSIFY_CACHE_SIZE)
+def classify_word(word: str) -> WordInfo:
+    stripped = _strip_punctuation_edges(word)
+    return WordInfo(
+        stripped=stripped,
+        monosyllabic=is_monosyllabic(word),
+        stripped_monosyllabic=is_monosyllabic(stripped),
+        alpha=bool(_is_alpha_word(word)),
+        stripped_alpha=bool(_is_alpha_word(stripped)),
+        trailing_punct=_has_trailing_punct(word),
+        trailing_dot=_has_trailing_dot(word),
+        word_count=_count_words_in_token(word),
+    )
+
+
+def classification_cache_info() -> Dict[str, float]:
+    """Contadores do cache de classificação (para profiling)."""
+    info = classify_word.cache_info()
+    lookups = info.hits + info.misses
+    return {
+        "hits": info.hits,
+        "misses": info.misses,
+        "size": info.currsize,
+        "maxsize": info.maxsize,
+        "hit_rate": round(info.hits / lookups, 4) if lookups else 0.0,
+    }
+
+
+@lru_cache(maxsize=CLASSIFY_CACHE_SIZE)
+def normalize_term(word: str) -> str:
+    """Forma de busca de uma palavra: minúscula, sem acentos e sem pontuação nas pontas.
+    "Coração," e "coracao" viram o mesmo termo; vazio para pontuação solta.
+    """
+    stripped = _strip_punctuation_edges(word.casefold())
+    if stripped.isascii():
+        return stripped
+    decomposed = unicodedata.normalize("NFKD", stripped)
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+
 def build_tokens_with_rules(words: List[str], pages: List[int]) -> Tuple[List[str], List[int], List[int]]:
     """Constrói tokens aplicando as regras:
     1) Monossílabos agrupam com a próxima palavra (regra anterior)
@@ -173,14 +242,14 @@ def build_tokens_with_rules(words: List[str], pages: List[int]) -> Tuple[List[st
     while i < n:
         current = words[i]
         current_page = pages[i]
-        stripped = _strip_punctuation_edges(current)
+        info = classify_word(current)
 
         # Regra 2 AJUSTADA: monossílabo (alfabético) com pontuação no final encerra o segmento,
         # porém NÃO agrega todo o trecho em um único token. Em vez disso, emitimos os tokens
         # do segmento individualmente e o token atual com peso 1. Assim evitamos frases enormes
         # virarem um único token visual.
         # Observação: não disparamos esta regra para tokens numéricos como "1950,".
-        if is_monosyllabic(stripped) and _has_trailing_punct(current) and _is_alpha_word(stripped):
+        if info.stripped_monosyllabic and info.trailing_punct and info.stripped_alpha:
             if seg_first_page is None:
                 tokens.append(current)
                 token_pages.append(current_page)
@@ -189,7 +258,7 @@ def build_tokens_with_rules(words: List[str], pages: List[int]) -> Tuple[List[st
                 for t in seg_tokens:
                     tokens.append(t)
                     token_pages.append(seg_first_page)
-                    token_weights.append(_count_words_in_token(t))
+                    token_weights.append(classify_word(t).word_count)
                 seg_tokens = []
                 # atual é emitido com peso 1 e página própria
                 tokens.append(current)
@@ -202,10 +271,10 @@ def build_tokens_with_rules(words: List[str], pages: List[int]) -> Tuple[List[st
         # Regra 1: monossílabo agrupa com próxima palavra (se existir)
         # NÃO agrupar se o token atual termina com ponto final, ou se o token anterior termina com ponto final
         if (
-            is_monosyllabic(stripped)
+            info.stripped_monosyllabic
             and (i + 1) < n
-            and not _has_trailing_dot(current)
-            and not (i - 1 >= 0 and _has_trailing_dot(words[i - 1]))
+            and not info.trailing_dot
+            and not (i - 1 >= 0 and classify_word(words[i - 1]).trailing_dot)
         ):
             combined = f"{current} {words[i + 1]}"
             if seg_first_page is None:
@@ -213,11 +282,11 @@ def build_tokens_with_rules(words: List[str], pages: List[int]) -> Tuple[List[st
             seg_tokens.append(combined)
             i += 2
             # Se terminou com pontuação, finalizar segmento (modo normal)
-            if _has_trailing_punct(combined):
+            if classify_word(combined).trailing_punct:
                 for t in seg_tokens:
                     tokens.append(t)
                     token_pages.append(seg_first_page)
-                    token_weights.append(_count_words_in_token(t))
+                    token_weights.append(classify_word(t).word_count)
                     seg_first_page = seg_first_page  # unchanged
                 seg_tokens = []
                 seg_first_page = None
@@ -228,12 +297,12 @@ def build_tokens_with_rules(words: List[str], pages: List[int]) -> Tuple[List[st
             seg_first_page = current_page
         seg_tokens.append(current)
         i += 1
-        if _has_trailing_punct(current):
+        if info.trailing_punct:
             # Finaliza segmento com tokens individuais
             for t in seg_tokens:
                 tokens.append(t)
                 token_pages.append(seg_first_page)
-                token_weights.append(_count_words_in_token(t))
+                token_weights.append(classify_word(t).word_count)
             seg_tokens = []
             seg_first_page = None
 
@@ -242,8 +311,195 @@ def build_tokens_with_rules(words: List[str], pages: List[int]) -> Tuple[List[st
         for t in seg_tokens:
             tokens.append(t)
             token_pages.append(seg_first_page if seg_first_page is not None else pages[-1])
-            token_weights.append(_count_words_in_token(t))
+            token_weights.append(classify_word(t).word_count)
 
     return tokens, token_pages, token_weights
 
 
+def build_page_index(token_pages: List[int], page_count: int) -> List[int]:
+    """Índice página -> primeiro token: index[p - 1] é o primeiro token da página p
+    (ou da próxima página com conteúdo). O último elemento é o total de tokens.
+    Depende de token_pages ser não decrescente, o que a tokenização garante.
+    """
+    n = len(token_pages)
+    last_page = max(page_count, token_pages[-1] if n else 0)
+    index: List[int] = []
+    i = 0
+    for page in range(1, last_page + 1):
+        while i < n and token_pages[i] < page:
+            i += 1
+        index.append(i)
+    index.append(n)
+    return index
+
+
+# Custo de leitura por token, portado de web/src/lib/textUtils.ts (endPunctuationMultiplier,
+# complexityMultiplier): tempo do token = msPerWord * max(1, peso) * multiplicadores.
+# msPerWord = max(60000 / ppm, MIN_MS_PER_WORD), como no player.
+MIN_MS_PER_WORD = 50.0
+_NON_ALNUM_RE = re.compile(r"[\W_]+", re.UNICODE)
+
+
+def end_punctuation_multiplier(token: str) -> float:
+    t = token.strip()
+    if t.endswith("..."):
+        return 2.5  # reticências
+    last = t[-1:]
+    if last and last in ".!?":
+        return 2.0  # fim de frase
+    if last and last in ";:":
+        return 1.75  # pausa média
+    if last == ",":
+        return 1.5  # vírgula
+    return 1.0
+
+
+def complexity_multiplier(token: str) -> float:
+    length = len(_NON_ALNUM_RE.sub("", token))
+    if length <= 3:
+        return 0.9
+    if length <= 6:
+        return 1.0
+    if length <= 10:
+        return 1.2
+    return 1.5
+
+
+@lru_cache(maxsize=CLASSIFY_CACHE_SIZE)
+def _token_multiplier(token: str) -> float:
+    return end_punctuation_multiplier(token) * complexity_multiplier(token)
+
+
+def token_cost(token: str, weight: int) -> float:
+    """Custo do token em "tempos de palavra" (multiplicar por msPerWord para ter ms)."""
+    return max(1, weight) * _token_multiplier(token)
+
+
+def build_cost_prefix(tokens: Sequence[str], token_weights: Sequence[int]) -> array:
+    """Soma acumulada dos custos: prefix[i] é o custo dos tokens antes de i; prefix[-1] é o total."""
+    return array("d", accumulate((token_cost(t, w) for t, w in zip(tokens, token_weights)), initial=0.0))
+
+
+def ms_per_word(wpm: float) -> float:
+    return max(60_000 / max(1.0, wpm), MIN_MS_PER_WORD)
+
+
+def token_at_cost(cost_prefix: Sequence[float], cost: float) -> int:
+    """Token em leitura depois de `cost` tempos de palavra (busca binária no prefixo)."""
+    n = len(cost_prefix) - 1
+    if n <= 0:
+        return 0
+    return min(max(0, bisect_right(cost_prefix, cost) - 1), n - 1)
+
+
+def iter_tokens(pairs: Iterable[Tuple[str, int]], words_out: List[str] | None = None) -> Iterator[Tuple[str, int, int]]:
+    """Pipeline completo em uma passada: equivale a `preprocess_hyphens` ->
+    `group_words_with_pages` -> `build_tokens_with_rules`, mas consome pares
+    (palavra, página) de qualquer iterável e produz (token, página, peso) sem
+    listas intermediárias. Cada etapa guarda só o lookahead de que precisa
+    (2, 1 e 1 itens) mais o segmento aberto da última etapa.
+
+    Se `words_out` for informado, recebe as palavras já com hífens corrigidos.
+    """
+    it = iter(pairs)
+
+    # Etapa 1: correção de hífens, com lookahead de 2 palavras
+    raw: Deque[Tuple[str, int]] = deque()
+
+    def next_word() -> Tuple[str, int] | None:
+        while len(raw) < 3:
+            try:
+                raw.append(next(it))
+            except StopIteration:
+                break
+        if not raw:
+            return None
+        current, current_page = raw.popleft()
+        next_word_ = raw[0][0] if raw else None
+        if current != "-" and next_word_ == "-" and len(raw) > 1 and classify_word(raw[1][0]).alpha:
+            current = f"{current}-{raw[1][0]}"
+            raw.popleft()
+            raw.popleft()
+        elif current.endswith("-") and next_word_ is not None and classify_word(next_word_).alpha:
+            current = current[:-1] + next_word_
+            raw.popleft()
+        if words_out is not None:
+            words_out.append(current)
+        return current, current_page
+
+    # Etapa 2: monossílabo agrupa com a próxima palavra, lookahead de 1
+    fixed: Deque[Tuple[str, int]] = deque()
+    prev_fixed_dot = False
+
+    def next_group() -> Tuple[str, int] | None:
+        nonlocal prev_fixed_dot
+        while len(fixed) < 2:
+            item = next_word()
+            if item is None:
+                break
+            fixed.append(item)
+        if not fixed:
+            return None
+        current, current_page = fixed.popleft()
+        info = classify_word(current)
+        if fixed and info.monosyllabic and not info.trailing_dot and not prev_fixed_dot:
+            next_word_ = fixed.popleft()[0]
+            prev_fixed_dot = classify_word(next_word_).trailing_dot
+            return f"{current} {next_word_}", current_page
+        prev_fixed_dot = info.trailing_dot
+        return current, current_page
+
+    # Etapa 3: regras de segmento (build_tokens_with_rules), lookahead de 1
+    buf: Deque[Tuple[str, int]] = deque()
+    seg_tokens: List[Tuple[str, int]] = []  # (token, peso)
+    seg_first_page: int | None = None
+    prev_dot = False
+    while True:
+        while len(buf) < 2:
+            item = next_group()
+            if item is None:
+                break
+            buf.append(item)
+        if not buf:
+            break
+        current, current_page = buf.popleft()
+        info = classify_word(current)
+
+        if info.stripped_monosyllabic and info.trailing_punct and info.stripped_alpha:
+            for t, weight in seg_tokens:
+                yield t, seg_first_page, weight
+            seg_tokens = []
+            seg_first_page = None
+            yield current, current_page, 1
+            prev_dot = info.trailing_dot
+            continue
+
+        if buf and info.stripped_monosyllabic and not info.trailing_dot and not prev_dot:
+            next_word_ = buf.popleft()[0]
+            combined = f"{current} {next_word_}"
+            combined_info = classify_word(combined)
+            if seg_first_page is None:
+                seg_first_page = current_page
+            seg_tokens.append((combined, combined_info.word_count))
+            prev_dot = classify_word(next_word_).trailing_dot
+            if combined_info.trailing_punct:
+                for t, weight in seg_tokens:
+                    yield t, seg_first_page, weight
+                seg_tokens = []
+                seg_first_page = None
+            continue
+
+        if seg_first_page is None:
+            seg_first_page = current_page
+        seg_tokens.append((current, info.word_count))
+        prev_dot = info.trailing_dot
+        if info.trailing_punct:
+            for t, weight in seg_tokens:
+                yield t, seg_first_page, weight
+            seg_tokens = []
+            seg_first_page = None
+
+    for t, weight in seg_tokens:
+        yield t, seg_first_page, weight
+
+
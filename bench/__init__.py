@@ -0,0 +1,4 @@
+"""Benchmarks reprodutíveis dos caminhos críticos. Executar da raiz do repositório:
+
+    python -m bench.<nome> --help
+"""
@@ -0,0 +1,198 @@
+"""Gerador de corpora sintéticos (PDF, TXT, Markdown e EPUB), sem rede nem
+dependências extras. O texto é determinístico para uma mesma semente.
+
+    python -m bench.corpus --words 100000 --out /tmp/corpus
+"""
+import argparse
+import random
+import zipfile
+from pathlib import Path
+from typing import Dict, List
+
+# Vocabulário em português com monossílabos, acentos e palavras longas; tudo
+# representável em cp1252 para caber na fonte padrão do PDF
+VOCAB = (
+    "a o e é de da do em um uma que se por para com não mais mas como já só "
+    "ao à os as no na nos das dos sem sob até eu tu ele ela nós vós eles "
+    "leitura rápida palavra documento página capítulo livro texto frase tempo "
+    "dinheiro trabalho escola família cidade história pessoa governo empresa "
+    "desenvolvimento conhecimento informação educação possibilidade responsabilidade "
+    "financeira investimento oportunidade ativos passivos receita despesa imposto "
+    "aprender ensinar pensar escrever entender construir vender comprar "
+    "sempre nunca também ainda depois antes agora hoje amanhã ontem "
+    "grande pequeno novo velho rico pobre simples difícil importante necessário "
+    "e-mail bem-estar guarda-chuva 1950 2024 15% R$100"
+).split()
+_END_PUNCT = [".", ".", ".", "?", "!", "..."]
+_MID_PUNCT = [",", ",", ";", ":"]
+
+WORDS_PER_PAGE = 300
+WORDS_PER_LINE = 12
+
+
+def generate_words(n: int, seed: int = 42) -> List[str]:
+    rng = random.Random(seed)
+    words: List[str] = []
+    while len(words) < n:
+        sentence = [rng.choice(VOCAB) for _ in range(rng.randint(4, 22))]
+        sentence[0] = sentence[0].capitalize()
+        for i in range(1, len(sentence) - 1):
+            if rng.random() < 0.08:
+                sentence[i] += rng.choice(_MID_PUNCT)
+        sentence[-1] += rng.choice(_END_PUNCT)
+        words.extend(sentence)
+    return words[:n]
+
+
+def _lines(words: List[str], seed: int) -> List[str]:
+    """Quebra em linhas, com hifenização ocasional no fim da linha ("desenvol-" / "vimento")."""
+    rng = random.Random(seed)
+    lines: List[str] = []
+    carry = ""
+    for start in range(0, len(words), WORDS_PER_LINE):
+        line = words[start:start + WORDS_PER_LINE]
+        if carry:
+            line = [carry] + line
+            carry = ""
+        last = line[-1]
+        if len(last) > 8 and last.isalpha() and rng.random() < 0.3:
+            cut = len(last) // 2
+            line[-1] = last[:cut] + "-"
+            carry = last[cut:]
+        lines.append(" ".join(line))
+    if carry:
+        lines.append(carry)
+    return lines
+
+
+def write_txt(path: Path, words: List[str], seed: int = 42) -> None:
+    path.write_text("\n".join(_lines(words, seed)) + "\n", encoding="utf-8")
+
+
+def write_md(path: Path, words: List[str], seed: int = 42) -> None:
+    rng = random.Random(seed)
+    blocks: List[str] = []
+    for chapter, start in enumerate(range(0, len(words), WORDS_PER_PAGE), 1):
+        chunk = words[start:start + WORDS_PER_PAGE]
+        blocks.append(f"## Capítulo {chapter}")
+        for p in range(0, len(chunk), 60):
+            para = chunk[p:p + 60]
+            i = rng.randrange(len(para))
+            para[i] = f"**{para[i]}**"
+            if rng.random() < 0.2:
+                blocks.append("\n".join(f"- {w}" for w in para[:5]))
+                para = para[5:]
+            blocks.append(" ".join(para))
+    path.write_text("\n\n".join(blocks) + "\n", encoding="utf-8")
+
+
+def _xml_escape(text: str) -> str:
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def write_epub(path: Path, words: List[str], words_per_chapter: int = 3000) -> None:
+    chapters = [words[i:i + words_per_chapter] for i in range(0, len(words), words_per_chapter)] or [[]]
+    manifest = []
+    spine = []
+    nav_items = []
+    with zipfile.ZipFile(path, "w") as zf:
+        zf.writestr("mimetype", "application/epub+zip", compress_type=zipfile.ZIP_STORED)
+        zf.writestr(
+            "META-INF/container.xml",
+            '<?xml version="1.0"?><container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">'
+            '<rootfiles><rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/></rootfiles></container>',
+        )
+        for n, chapter in enumerate(chapters, 1):
+            name = f"chap{n:04d}.xhtml"
+            paragraphs = "".join(
+                f"<p>{_xml_escape(' '.join(chapter[i:i + 80]))}</p>" for i in range(0, len(chapter), 80)
+            )
+            zf.writestr(
+                f"OEBPS/{name}",
+                '<?xml version="1.0" encoding="utf-8"?><html xmlns="http://www.w3.org/1999/xhtml">'
+                f"<head><title>Capítulo {n}</title></head><body><h1>Capítulo {n}</h1>{paragraphs}</body></html>",
+            )
+            manifest.append(f'<item id="c{n}" href="{name}" media-type="application/xhtml+xml"/>')
+            spine.append(f'<itemref idref="c{n}"/>')
+            nav_items.append(f'<li><a href="{name}">Capítulo {n}</a></li>')
+        zf.writestr(
+            "OEBPS/nav.xhtml",
+            '<?xml version="1.0" encoding="utf-8"?><html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops">'
+            f'<head><title>Sumário</title></head><body><nav epub:type="toc"><ol>{"".join(nav_items)}</ol></nav></body></html>',
+        )
+        zf.writestr(
+            "OEBPS/content.opf",
+            '<?xml version="1.0" encoding="utf-8"?><package xmlns="http://www.idpf.org/2007/opf" version="3.0" unique-identifier="id">'
+            '<metadata xmlns:dc="http://purl.org/dc/elements/1.1/"><dc:identifier id="id">bench-corpus</dc:identifier>'
+            "<dc:title>Corpus sintético</dc:title><dc:language>pt-BR</dc:language></metadata>"
+            f'<manifest><item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>{"".join(manifest)}</manifest>'
+            f'<spine>{"".join(spine)}</spine></package>',
+        )
+
+
+def _pdf_string(text: str) -> bytes:
+    raw = text.encode("cp1252", errors="replace")
+    return b"(" + raw.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)") + b")"
+
+
+def write_pdf(path: Path, words: List[str], seed: int = 42) -> None:
+    """PDF mínimo escrito à mão: uma página a cada WORDS_PER_PAGE palavras, fonte Helvetica."""
+    lines = _lines(words, seed)
+    lines_per_page = WORDS_PER_PAGE // WORDS_PER_LINE
+    pages = [lines[i:i + lines_per_page] for i in range(0, len(lines), lines_per_page)] or [[]]
+    n = len(pages)
+    font_id = 3 + 2 * n
+    objects: List[bytes] = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        ("<< /Type /Pages /Kids [%s] /Count %d >>" % (" ".join(f"{3 + 2 * i} 0 R" for i in range(n)), n)).encode(),
+    ]
+    for i, page_lines in enumerate(pages):
+        objects.append(
+            (f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents {4 + 2 * i} 0 R "
+             f"/Resources << /Font << /F1 {font_id} 0 R >> >> >>").encode()
+        )
+        content = b"BT /F1 10 Tf 14 TL 40 760 Td " + b" ".join(_pdf_string(line) + b" Tj T*" for line in page_lines) + b" ET"
+        objects.append(b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream")
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>")
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    path.write_bytes(bytes(out))
+
+
+def generate_corpus(out_dir: Path, words: int, seed: int = 42, formats: List[str] | None = None) -> Dict[str, Path]:
+    out_dir.mkdir(parents=True, exist_ok=True)
+    text = generate_words(words, seed)
+    writers = {"pdf": write_pdf, "txt": write_txt, "md": write_md, "epub": write_epub}
+    paths: Dict[str, Path] = {}
+    for fmt in formats or list(writers):
+        path = out_dir / f"corpus-{words}.{fmt}"
+        if fmt == "epub":
+            writers[fmt](path, text)
+        else:
+            writers[fmt](path, text, seed)
+        paths[fmt] = path
+    return paths
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--words", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", type=Path, default=Path("bench_corpus"))
+    parser.add_argument("--formats", nargs="+", choices=["pdf", "txt", "md", "epub"])
+    args = parser.parse_args()
+    for fmt, path in generate_corpus(args.out, args.words, args.seed, args.formats).items():
+        print(f"{fmt}: {path} ({path.stat().st_size} bytes)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""Benchmark de ingestão e tokenização, estágio por estágio.
+
+Gera um corpus sintético (ver bench.corpus) e mede separadamente cada extrator,
+as etapas da tokenização e a gravação/leitura do cache de tokens. Para cada
+estágio reporta palavras/s (melhor de N execuções) e pico de memória
+(tracemalloc, numa execução à parte para não distorcer o tempo).
+
+    python -m bench.ingest --words 50000 --out bench-results.json
+    python -m bench.ingest --words 50000 --baseline bench-results.json --threshold 0.15
+
+Com --baseline, estágios com throughput abaixo de (1 - threshold) do baseline,
+ou pico de memória acima de (1 + threshold), são marcados como regressão e o
+processo termina com código 1.
+"""
+import argparse
+import json
+import platform
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+from app import processing, storage, textutils
+from bench.corpus import generate_corpus
+
+
+def _measure(fn: Callable[[], Any], repeat: int) -> Tuple[float, int]:
+    best = float("inf")
+    for _ in range(repeat):
+        textutils.classify_word.cache_clear()  # cada execução parte do cache frio
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    textutils.classify_word.cache_clear()
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return best, peak
+
+
+def _result(words: int, seconds: float, peak: int) -> Dict[str, Any]:
+    return {
+        "words": words,
+        "seconds": round(seconds, 5),
+        "words_per_sec": round(words / seconds, 1) if seconds > 0 else None,
+        "peak_bytes": peak,
+    }
+
+
+def run(words: int, seed: int, repeat: int, pdf_workers: int, stages: List[str] | None) -> Dict[str, Dict[str, Any]]:
+    results: Dict[str, Dict[str, Any]] = {}
+
+    def wanted(name: str) -> bool:
+        return not stages or name in stages
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp_dir = Path(tmp)
+        corpus = generate_corpus(tmp_dir / "corpus", words, seed)
+
+        extractors = {
+            "extract_pdf": lambda: processing._extract_words_with_pages_pdf(str(corpus["pdf"]), pdf_workers),
+            "extract_txt": lambda: processing._extract_words_with_pages_txt(str(corpus["txt"])),
+            "extract_md": lambda: processing._extract_words_with_pages_md(str(corpus["md"])),
+            "extract_epub": lambda: processing._extract_words_with_pages_epub(str(corpus["epub"]), pdf_workers),
+        }
+        for name, fn in extractors.items():
+            if not wanted(name):
+                continue
+            try:
+                extracted = fn()
+            except Exception as e:  # extrator opcional sem dependência instalada
+                results[name] = {"skipped": str(e)}
+                continue
+            seconds, peak = _measure(fn, repeat)
+            results[name] = _result(len(extracted[0]), seconds, peak)
+
+        # Etapas de tokenização sobre as palavras do TXT (mesmo texto dos outros formatos)
+        raw_words, raw_pages, page_count = processing._extract_words_with_pages_txt(str(corpus["txt"]))
+        fixed_words, fixed_pages = textutils.preprocess_hyphens(raw_words, raw_pages)
+        n = len(raw_words)
+        tokenizer_stages = {
+            "preprocess_hyphens": (n, lambda: textutils.preprocess_hyphens(raw_words, raw_pages)),
+            "group_words_with_pages": (len(fixed_words), lambda: textutils.group_words_with_pages(fixed_words, fixed_pages)),
+            "build_tokens_with_rules": (len(fixed_words), lambda: textutils.build_tokens_with_rules(fixed_words, fixed_pages)),
+            "iter_tokens": (n, lambda: list(textutils.iter_tokens(zip(raw_words, raw_pages)))),
+        }
+        for name, (count, fn) in tokenizer_stages.items():
+            if wanted(name):
+                seconds, peak = _measure(fn, repeat)
+                results[name] = _result(count, seconds, peak)
+
+        if not (wanted("save_tokens_cache") or wanted("load_tokens_cache")):
+            return results
+
+        # Cache de tokens num banco/diretório temporários, sem tocar em data/
+        tokens, token_pages, token_weights = textutils.build_tokens_with_rules(fixed_words, fixed_pages)
+        page_index = textutils.build_page_index(token_pages, page_count)
+        saved = (storage.SQLITE_PATH, storage.TOKENS_DIR, storage._local)
+        storage.SQLITE_PATH = tmp_dir / "leitor.db"
+        storage.TOKENS_DIR = tmp_dir / "tokens"
+        storage.TOKENS_DIR.mkdir()
+        storage._local = threading.local()
+        try:
+            storage.init_db()
+            storage.insert_document_record("bench", "bench.txt", str(corpus["txt"]), "text/plain", status="completed")
+
+            def save() -> None:
+                storage.save_tokens_cache(
+                    "bench",
+                    tokens=tokens,
+                    token_pages=token_pages,
+                    token_weights=token_weights,
+                    page_count=page_count,
+                    page_index=page_index,
+                )
+
+            def load() -> None:
+                # Abre e materializa tudo: abrir o mmap sozinho não depende do tamanho
+                cached = storage.load_tokens_cache("bench")
+                list(cached["tokens"])
+                list(cached["pages"])
+                list(cached["weights"])
+
+            if wanted("save_tokens_cache"):
+                seconds, peak = _measure(save, repeat)
+                results["save_tokens_cache"] = _result(n, seconds, peak)
+            if wanted("load_tokens_cache"):
+                save()
+                seconds, peak = _measure(load, repeat)
+                results["load_tokens_cache"] = _result(n, seconds, peak)
+        finally:
+            storage.SQLITE_PATH, storage.TOKENS_DIR, storage._local = saved
+    return results
+
+
+def compare(current: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]], threshold: float) -> List[str]:
+    """Lista as regressões de throughput e de memória em relação ao baseline."""
+    regressions: List[str] = []
+    for name, cur in current.items():
+        base = baseline.get(name)
+        if not base or "skipped" in cur or "skipped" in base:
+            continue
+        if base.get("words_per_sec") and cur.get("words_per_sec"):
+            ratio = cur["words_per_sec"] / base["words_per_sec"]
+            cur["vs_baseline"] = round(ratio, 3)
+            if ratio < 1 - threshold:
+                regressions.append(f"{name}: {cur['words_per_sec']:.0f} palavras/s vs {base['words_per_sec']:.0f} ({ratio:.2f}x)")
+        if base.get("peak_bytes") and cur.get("peak_bytes"):
+            ratio = cur["peak_bytes"] / base["peak_bytes"]
+            if ratio > 1 + threshold:
+                regressions.append(f"{name}: pico de memória {cur['peak_bytes']} vs {base['peak_bytes']} bytes ({ratio:.2f}x)")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--words", type=int, default=50_000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--pdf-workers", type=int, default=processing.PDF_WORKERS, help="processos de extração (PDF e EPUB)")
+    parser.add_argument("--stages", nargs="+", help="executa só os estágios indicados")
+    parser.add_argument("--out", type=Path, help="grava o resultado em JSON")
+    parser.add_argument("--baseline", type=Path, help="JSON de uma execução anterior para comparação")
+    parser.add_argument("--threshold", type=float, default=0.15)
+    args = parser.parse_args()
+
+    stages = run(args.words, args.seed, args.repeat, args.pdf_workers, args.stages)
+    report: Dict[str, Any] = {
+        "meta": {
+            "words": args.words,
+            "seed": args.seed,
+            "repeat": args.repeat,
+            "pdf_workers": args.pdf_workers,
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "stages": stages,
+    }
+    regressions: List[str] = []
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+        regressions = compare(stages, baseline.get("stages", {}), args.threshold)
+        report["regressions"] = regressions
+
+    print(f"{'estágio':<26}{'palavras/s':>14}{'segundos':>11}{'pico (KiB)':>12}")
+    for name, r in stages.items():
+        if "skipped" in r:
+            print(f"{name:<26}  ignorado: {r['skipped']}")
+            continue
+        print(f"{name:<26}{r['words_per_sec']:>14,.0f}{r['seconds']:>11.4f}{r['peak_bytes'] / 1024:>12,.0f}")
+    for line in regressions:
+        print(f"REGRESSÃO {line}")
+    if args.out:
+        args.out.write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
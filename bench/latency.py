@@ -0,0 +1,170 @@
+"""Teste de carga: latência dos endpoints leves enquanto documentos grandes carregam.
+
+Sobe a API com uvicorn numa thread (banco, tokens e uploads em diretório
+temporário), envia documentos grandes do corpus sintético e mede a latência de
+GET /health e GET /documents em duas fases:
+
+- idle: só os clientes leves;
+- loaded: clientes leves + clientes pesados pedindo /tokens inteiro, alternando entre
+  os documentos com o cache em memória reduzido ao mínimo, o que força a carga do
+  cache em disco a cada requisição.
+
+Os clientes rodam num processo separado para não disputar o GIL com o servidor.
+
+Com o caminho de requisição assíncrono o p99 dos endpoints leves deve ficar
+praticamente igual nas duas fases.
+
+    python -m bench.latency --documents 2 --words 300000 --seconds 10
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import socket
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List
+
+import httpx
+import uvicorn
+
+from app import ingest, main as main_module, storage
+from app.main import app
+from bench.corpus import generate_words, write_txt
+
+LIGHT_PATHS = ["/health", "/documents"]
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _percentiles(samples: List[float]) -> Dict[str, float]:
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def pick(q: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 2)
+
+    return {"count": len(ordered), "p50_ms": pick(0.50), "p95_ms": pick(0.95), "p99_ms": pick(0.99), "max_ms": round(ordered[-1] * 1000, 2)}
+
+
+async def _light_client(client: httpx.AsyncClient, path: str, until: float, out: List[float]) -> None:
+    while time.perf_counter() < until:
+        start = time.perf_counter()
+        res = await client.get(path)
+        res.raise_for_status()
+        out.append(time.perf_counter() - start)
+        await asyncio.sleep(0.005)
+
+
+async def _heavy_client(client: httpx.AsyncClient, doc_ids: List[str], until: float, out: List[float]) -> None:
+    i = 0
+    while time.perf_counter() < until:
+        doc_id = doc_ids[i % len(doc_ids)]
+        i += 1
+        start = time.perf_counter()
+        res = await client.get(f"/documents/{doc_id}/tokens")
+        res.raise_for_status()
+        out.append(time.perf_counter() - start)
+
+
+async def _phase(base_url: str, doc_ids: List[str], seconds: float, light: int, heavy: int) -> Dict[str, Dict[str, float]]:
+    latencies: Dict[str, List[float]] = {path: [] for path in LIGHT_PATHS}
+    heavy_latencies: List[float] = []
+    until = time.perf_counter() + seconds
+    async with httpx.AsyncClient(base_url=base_url, timeout=120) as client:
+        tasks = [
+            _light_client(client, LIGHT_PATHS[i % len(LIGHT_PATHS)], until, latencies[LIGHT_PATHS[i % len(LIGHT_PATHS)]])
+            for i in range(light)
+        ]
+        tasks += [_heavy_client(client, doc_ids, until, heavy_latencies) for _ in range(heavy)]
+        await asyncio.gather(*tasks)
+    result = {path: _percentiles(samples) for path, samples in latencies.items()}
+    if heavy:
+        result["/documents/{id}/tokens (pesado)"] = _percentiles(heavy_latencies)
+    return result
+
+
+def _run_phase(base_url: str, doc_ids: List[str], seconds: float, light: int, heavy: int) -> Dict[str, Dict[str, float]]:
+    return asyncio.run(_phase(base_url, doc_ids, seconds, light, heavy))
+
+
+async def _upload(base_url: str, paths: List[Path]) -> List[str]:
+    doc_ids = []
+    async with httpx.AsyncClient(base_url=base_url, timeout=600) as client:
+        for path in paths:
+            res = await client.post("/documents", files={"file": (path.name, path.read_bytes(), "text/plain")})
+            res.raise_for_status()
+            doc_ids.append(res.json()["document_id"])
+        for doc_id in doc_ids:
+            while (await client.get(f"/documents/{doc_id}/status")).json()["status"] != "completed":
+                await asyncio.sleep(0.2)
+    return doc_ids
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=2, help="mínimo 2, para alternar entre documentos")
+    parser.add_argument("--words", type=int, default=300_000, help="palavras por documento")
+    parser.add_argument("--seconds", type=float, default=10.0, help="duração de cada fase")
+    parser.add_argument("--light", type=int, default=8, help="clientes leves concorrentes")
+    parser.add_argument("--heavy", type=int, default=4, help="clientes pesados concorrentes")
+    parser.add_argument("--out", type=Path, help="grava o resultado em JSON")
+    args = parser.parse_args()
+    args.documents = max(2, args.documents)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp_dir = Path(tmp)
+        storage.SQLITE_PATH = tmp_dir / "leitor.db"
+        storage.TOKENS_DIR = tmp_dir / "tokens"
+        storage.TOKENS_DIR.mkdir()
+        storage._local = threading.local()
+        main_module.UPLOADS_DIR = tmp_dir / "uploads"
+        main_module.UPLOADS_DIR.mkdir()
+        ingest.QUEUE_STATE_PATH = tmp_dir / "ingest_queue.json"
+
+        paths = []
+        for i in range(args.documents):
+            path = tmp_dir / f"doc{i}.txt"
+            write_txt(path, generate_words(args.words, seed=i))
+            paths.append(path)
+
+        port = _free_port()
+        server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+        thread = threading.Thread(target=server.run, daemon=True)
+        thread.start()
+        while not server.started:
+            time.sleep(0.05)
+        base_url = f"http://127.0.0.1:{port}"
+        try:
+            doc_ids = asyncio.run(_upload(base_url, paths))
+            # Um documento por vez na memória: alternar entre eles sempre lê do disco
+            storage.db.max_bytes = 1
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as clients:
+                results = {
+                    "idle": clients.submit(_run_phase, base_url, doc_ids, args.seconds, args.light, 0).result(),
+                    "loaded": clients.submit(_run_phase, base_url, doc_ids, args.seconds, args.light, args.heavy).result(),
+                }
+        finally:
+            server.should_exit = True
+            thread.join(30)
+
+    for path in LIGHT_PATHS:
+        idle, loaded = results["idle"][path], results["loaded"][path]
+        if idle.get("p99_ms") and loaded.get("p99_ms"):
+            results.setdefault("p99_ratio", {})[path] = round(loaded["p99_ms"] / idle["p99_ms"], 2)
+    results["meta"] = vars(args) | {"out": str(args.out) if args.out else None}
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+    if args.out:
+        args.out.write_text(json.dumps(results, indent=2, ensure_ascii=False), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""Benchmark dos extratores de PDF (processing.PDF_BACKENDS): velocidade e qualidade.
+
+Gera PDFs sintéticos (ver bench.corpus) e, para cada extrator disponível, mede
+páginas/s extraindo num único processo (melhor de N execuções) e compara os tokens
+gerados com os do texto original do corpus e com os do extrator de referência:
+
+- similarity: razão do difflib entre as sequências de tokens (1.0 = idênticas);
+- tokens_changed: tokens inseridos, removidos ou trocados;
+- page_mismatches: tokens iguais aos da referência, mas em outra página.
+
+O extrator recomendado é o mais rápido com similaridade em relação à referência de
+pelo menos --min-similarity (o padrão do servidor se escolhe com LEITOR_PDF_BACKEND).
+
+    python -m bench.pdf_backends --documents 3 --words 30000
+    python -m bench.pdf_backends --backends pdfplumber pypdfium2 --out pdf-backends.json
+"""
+import argparse
+import difflib
+import json
+import platform
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+from app import processing, textutils
+from bench.corpus import generate_words, write_pdf
+
+
+def _tokens(words: List[str], pages: List[int]) -> Tuple[List[str], List[int]]:
+    tokens: List[str] = []
+    token_pages: List[int] = []
+    for token, page, _ in textutils.iter_tokens(zip(words, pages)):
+        tokens.append(token)
+        token_pages.append(page)
+    return tokens, token_pages
+
+
+def _diff(expected: List[str], actual: List[str], expected_pages: List[int] | None = None, actual_pages: List[int] | None = None) -> Dict[str, Any]:
+    matcher = difflib.SequenceMatcher(None, expected, actual, autojunk=False)
+    changed = sum(max(i2 - i1, j2 - j1) for tag, i1, i2, j1, j2 in matcher.get_opcodes() if tag != "equal")
+    result: Dict[str, Any] = {"similarity": round(matcher.ratio(), 5), "tokens_changed": changed}
+    if expected_pages is not None and actual_pages is not None:
+        result["page_mismatches"] = sum(
+            1
+            for block in matcher.get_matching_blocks()
+            for k in range(block.size)
+            if expected_pages[block.a + k] != actual_pages[block.b + k]
+        )
+    return result
+
+
+def _extract(path: Path, backend: str, repeat: int) -> Tuple[float, List[str], List[int], int]:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        words, pages, page_count = processing._extract_words_with_pages_pdf(str(path), 1, backend)
+        best = min(best, time.perf_counter() - start)
+    return best, words, pages, page_count
+
+
+def run(documents: int, words: int, seed: int, repeat: int, backends: List[str], reference: str) -> Dict[str, Dict[str, Any]]:
+    totals: Dict[str, Dict[str, Any]] = {
+        name: {"pages": 0, "seconds": 0.0, "tokens": 0, "vs_source": [], "vs_reference": []} for name in backends
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        for i in range(documents):
+            source_words = generate_words(words, seed + i)
+            path = Path(tmp) / f"doc{i}.pdf"
+            write_pdf(path, source_words, seed + i)
+            source_tokens, _ = _tokens(source_words, [1] * len(source_words))
+            extracted = {name: _extract(path, name, repeat) for name in backends}
+            ref_tokens, ref_pages = _tokens(*extracted[reference][1:3])
+            for name, (seconds, doc_words, doc_pages, page_count) in extracted.items():
+                tokens, token_pages = _tokens(doc_words, doc_pages)
+                total = totals[name]
+                total["pages"] += page_count
+                total["seconds"] += seconds
+                total["tokens"] += len(tokens)
+                total["vs_source"].append(_diff(source_tokens, tokens))
+                total["vs_reference"].append(_diff(ref_tokens, tokens, ref_pages, token_pages))
+
+    def merge(diffs: List[Dict[str, Any]]) -> Dict[str, Any]:
+        merged: Dict[str, Any] = {"similarity": min(d["similarity"] for d in diffs)}
+        for field in ("tokens_changed", "page_mismatches"):
+            if field in diffs[0]:
+                merged[field] = sum(d[field] for d in diffs)
+        return merged
+
+    results: Dict[str, Dict[str, Any]] = {}
+    for name, total in totals.items():
+        results[name] = {
+            "pages": total["pages"],
+            "tokens": total["tokens"],
+            "seconds": round(total["seconds"], 4),
+            "pages_per_sec": round(total["pages"] / total["seconds"], 1) if total["seconds"] > 0 else None,
+            "vs_source": merge(total["vs_source"]),
+            "vs_reference": merge(total["vs_reference"]),
+        }
+    ref_speed = results[reference]["pages_per_sec"]
+    for r in results.values():
+        r["speedup"] = round(r["pages_per_sec"] / ref_speed, 2) if ref_speed and r["pages_per_sec"] else None
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=3)
+    parser.add_argument("--words", type=int, default=30_000, help="palavras por documento (300 por página)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--repeat", type=int, default=2)
+    parser.add_argument("--backends", nargs="+", choices=list(processing.PDF_BACKENDS), default=list(processing.PDF_BACKENDS))
+    parser.add_argument("--reference", default="pdfplumber", help="extrator usado como referência de qualidade")
+    parser.add_argument("--min-similarity", type=float, default=0.999, help="similaridade mínima com a referência")
+    parser.add_argument("--out", type=Path, help="grava o resultado em JSON")
+    args = parser.parse_args()
+    if args.reference not in processing.PDF_BACKENDS:
+        parser.error(f"extrator de referência indisponível: {args.reference}")
+    backends = list(dict.fromkeys([args.reference] + args.backends))
+
+    results = run(args.documents, args.words, args.seed, args.repeat, backends, args.reference)
+    passing = [name for name, r in results.items() if r["vs_reference"]["similarity"] >= args.min_similarity]
+    recommended = max(passing, key=lambda name: results[name]["pages_per_sec"] or 0) if passing else None
+    report: Dict[str, Any] = {
+        "meta": {
+            "documents": args.documents,
+            "words": args.words,
+            "seed": args.seed,
+            "repeat": args.repeat,
+            "reference": args.reference,
+            "min_similarity": args.min_similarity,
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "backends": results,
+        "recommended": recommended,
+    }
+
+    print(f"{'extrator':<12}{'páginas/s':>11}{'speedup':>9}{'sim. texto':>12}{'sim. ref.':>11}{'tokens dif.':>13}{'pág. dif.':>11}")
+    for name, r in results.items():
+        ref = r["vs_reference"]
+        print(
+            f"{name:<12}{r['pages_per_sec']:>11,.1f}{r['speedup']:>8.2f}x{r['vs_source']['similarity']:>12.5f}"
+            f"{ref['similarity']:>11.5f}{ref['tokens_changed']:>13}{ref['page_mismatches']:>11}"
+        )
+    print(f"recomendado (similaridade >= {args.min_similarity} com {args.reference}): {recommended or 'nenhum'}")
+    if args.out:
+        args.out.write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
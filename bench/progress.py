@@ -0,0 +1,84 @@
+"""Micro-benchmark de POST /documents/{id}/progress.
+
+Compara a camada antiga de acesso ao SQLite (conexão nova por chamada, journal
+padrão, commit a cada requisição) com a atual (conexão por thread, WAL, pragmas
+ajustados e progresso gravado em lote). Cada modo roda num banco temporário
+próprio, sem tocar em data/leitor.db.
+
+    python -m bench.progress --requests 2000 --documents 50
+"""
+import argparse
+import json
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Dict
+
+from fastapi.testclient import TestClient
+
+from app import main as main_module
+from app import storage
+from app.main import app
+
+
+def _legacy_conn() -> sqlite3.Connection:
+    return sqlite3.connect(storage.SQLITE_PATH, check_same_thread=False)
+
+
+def _legacy_update_progress(document_id: str, **kwargs) -> None:
+    storage.update_progress(document_id, **kwargs)
+    storage.flush_progress()
+
+
+def run_mode(mode: str, requests: int, documents: int, seed: int) -> Dict[str, float]:
+    pooled_get_conn = storage._get_conn
+    buffered_update_progress = main_module.update_progress
+    with tempfile.TemporaryDirectory() as tmp:
+        storage.SQLITE_PATH = Path(tmp) / "leitor.db"
+        storage.TOKENS_DIR = Path(tmp) / "tokens"
+        storage.TOKENS_DIR.mkdir()
+        storage._local = threading.local()
+        if mode == "legacy":
+            storage._get_conn = _legacy_conn
+            main_module.update_progress = _legacy_update_progress
+        try:
+            storage.init_db()
+            ids = [f"bench-{i}" for i in range(documents)]
+            for doc_id in ids:
+                storage.insert_document_record(doc_id, f"{doc_id}.pdf", f"/tmp/{doc_id}.pdf", "application/pdf", status="completed")
+                storage.update_document_after_processing(doc_id, 500, status="completed")
+            rng = random.Random(seed)
+            with TestClient(app) as client:
+                start = time.perf_counter()
+                for i in range(requests):
+                    doc_id = rng.choice(ids)
+                    res = client.post(f"/documents/{doc_id}/progress", params={"page": rng.randint(1, 500), "token_index": i})
+                    assert res.status_code == 200, res.text
+                elapsed = time.perf_counter() - start
+        finally:
+            storage._get_conn = pooled_get_conn
+            main_module.update_progress = buffered_update_progress
+            storage._local = threading.local()
+    return {"requests": requests, "seconds": round(elapsed, 4), "requests_per_sec": round(requests / elapsed, 1)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--documents", type=int, default=50)
+    parser.add_argument("--mode", choices=["legacy", "pooled", "both"], default="both")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    modes = ["legacy", "pooled"] if args.mode == "both" else [args.mode]
+    results = {mode: run_mode(mode, args.requests, args.documents, args.seed) for mode in modes}
+    if len(results) == 2:
+        results["speedup"] = round(results["pooled"]["requests_per_sec"] / results["legacy"]["requests_per_sec"], 2)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,19 @@
+import threading
+
+import pytest
+
+from app import storage
+
+
+@pytest.fixture
+def tmp_storage(tmp_path, monkeypatch):
+    """Banco e diretório de tokens temporários: os testes nunca tocam em data/."""
+    monkeypatch.setattr(storage, "SQLITE_PATH", tmp_path / "leitor.db")
+    monkeypatch.setattr(storage, "TOKENS_DIR", tmp_path / "tokens")
+    monkeypatch.setattr(storage, "_local", threading.local())
+    storage.TOKENS_DIR.mkdir()
+    storage.init_db()
+    yield tmp_path
+    conn = getattr(storage._local, "conn", None)
+    if conn is not None:
+        conn.close()
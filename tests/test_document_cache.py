@@ -0,0 +1,69 @@
+"""DocumentCache: orçamento de memória, entradas em processamento e leitores de uma
+entrada já descartada.
+
+    python -m pytest tests/test_document_cache.py
+"""
+from app import storage
+from app.storage import DocumentCache
+
+
+def _entry(n: int, status: str = "completed"):
+    return {"status": status, "tokens": [f"token{i}" for i in range(n)]}
+
+
+def test_lru_order_and_budget():
+    cache = DocumentCache(max_bytes=10 ** 9)
+    cache["a"] = _entry(100)
+    cache["b"] = _entry(100)
+    cache.get("a")
+    cache.max_bytes = cache.stats()["bytes"] - 1
+    cache["c"] = _entry(1)
+    # "b" é o menos recente depois do get("a")
+    assert "b" not in cache
+    assert "a" in cache and "c" in cache
+    assert cache.stats()["evictions"] == 1
+
+
+def test_newest_entry_stays_even_over_budget():
+    cache = DocumentCache(max_bytes=1)
+    cache["a"] = _entry(1000)
+    assert "a" in cache
+    cache["b"] = _entry(10)
+    assert "a" not in cache and "b" in cache
+
+
+def test_processing_entries_are_never_evicted():
+    cache = DocumentCache(max_bytes=1)
+    cache["a"] = _entry(100, status="processing")
+    cache["b"] = _entry(100)
+    assert "a" in cache and "b" in cache
+
+
+def test_refresh_tracks_growth():
+    cache = DocumentCache(max_bytes=10 ** 9)
+    entry = _entry(0, status="processing")
+    cache["a"] = entry
+    before = cache.stats()["bytes"]
+    entry["tokens"].extend(f"t{i}" for i in range(1000))
+    cache.refresh("a")
+    assert cache.stats()["bytes"] > before
+    del cache["a"]
+    assert cache.stats()["bytes"] == 0
+
+
+def test_evicted_entry_still_readable(tmp_storage):
+    storage.save_tokens_cache("held", tokens=["um", "dois", "três"], token_pages=[1, 1, 2], token_weights=[1, 1, 1], page_count=2)
+    cached = storage.load_tokens_cache("held")
+    cache = DocumentCache(max_bytes=1)
+    cache["held"] = {"status": "completed", "tokens": cached["tokens"], "mapping": cached["mapping"]}
+    # Leitor em andamento segura a entrada enquanto outra a tira do cache
+    held = cache.get("held")
+    cache["other"] = _entry(10)
+    assert "held" not in cache
+    assert list(held["tokens"]) == ["um", "dois", "três"]
+    # Substituir a entrada (duas cargas concorrentes do mesmo documento) também não fecha
+    cache["held"] = held
+    cache["held"] = dict(held)
+    assert not storage.mapping_released(held)
+    assert held["tokens"][2] == "três"
+    storage._close_mapping(held)
@@ -0,0 +1,163 @@
+"""Fila de ingestão: prioridade, limite com Retry-After, cancelamento, persistência no
+desligamento e retomada no startup; cancelamento durante a gravação do processamento.
+
+    python -m pytest tests/test_ingest_queue.py
+"""
+import json
+import threading
+
+import pytest
+
+from app import ingest, processing, storage
+from app.ingest import CANCELLED, COMPLETED, PRIORITY_HIGH, PRIORITY_NORMAL, QUEUED, IngestQueue, QueueFull
+from app.processing import ProcessingCancelled
+
+WAIT = 10
+
+
+class Runner:
+    """Runner de teste: registra a ordem dos documentos e segura cada um até `release`."""
+
+    def __init__(self) -> None:
+        self.order = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self, document_id, file_path, cancel_event):
+        self.order.append(document_id)
+        self.started.set()
+        while not self.release.wait(0.01):
+            if cancel_event.is_set():
+                raise ProcessingCancelled(document_id)
+
+
+@pytest.fixture
+def queue_state(tmp_path, monkeypatch):
+    path = tmp_path / "ingest_queue.json"
+    monkeypatch.setattr(ingest, "QUEUE_STATE_PATH", path)
+    return path
+
+
+def _busy_queue(runner: Runner, max_depth: int = 8, busy_path: str = "busy.txt") -> IngestQueue:
+    # Um worker ocupado com "busy": os próximos jobs ficam na fila
+    queue = IngestQueue(runner, workers=1, max_depth=max_depth)
+    queue.start()
+    queue.submit("busy", busy_path)
+    assert runner.started.wait(WAIT)
+    return queue
+
+
+def test_priority_and_promotion(queue_state):
+    runner = Runner()
+    queue = _busy_queue(runner)
+    try:
+        a = queue.submit("a", "a.txt")
+        b = queue.submit("b", "b.txt")
+        c = queue.submit("c", "c.txt", priority=PRIORITY_HIGH)
+        assert [queue.position(j) for j in (c, a, b)] == [0, 1, 2]
+        # Leitor esperando "b": o mesmo job é promovido, não duplicado
+        job, created = queue.join_or_submit("b", "b.txt", priority=PRIORITY_HIGH)
+        assert job is b and not created
+        assert b.priority == PRIORITY_HIGH
+        assert [queue.position(j) for j in (c, b, a)] == [0, 1, 2]
+        assert queue.depth() == 3
+        runner.release.set()
+        for job in (a, b, c):
+            assert job.done.wait(WAIT)
+        assert runner.order == ["busy", "c", "b", "a"]
+        assert all(job.status == COMPLETED for job in (a, b, c))
+    finally:
+        runner.release.set()
+        queue.stop()
+
+
+def test_queue_full(queue_state):
+    runner = Runner()
+    queue = _busy_queue(runner, max_depth=2)
+    try:
+        queue.submit("a", "a.txt")
+        queue.submit("b", "b.txt")
+        assert queue.is_full()
+        with pytest.raises(QueueFull) as exc:
+            queue.submit("c", "c.txt")
+        # Dois na fila e um rodando, com a média inicial de 5 s por job
+        assert exc.value.retry_after == queue.retry_after() == 15
+        # Documento já na fila não conta de novo; `force` ignora o limite
+        assert queue.submit("a", "a.txt").status == QUEUED
+        assert queue.submit("c", "c.txt", force=True).status == QUEUED
+        assert queue.depth() == 3
+    finally:
+        runner.release.set()
+        queue.stop()
+
+
+def test_cancel_queued_and_running(queue_state):
+    runner = Runner()
+    queue = _busy_queue(runner)
+    try:
+        a = queue.submit("a", "a.txt")
+        assert queue.cancel("a")
+        assert a.status == CANCELLED and queue.depth() == 0
+        assert queue.cancel("busy", wait=WAIT)
+        assert queue.get("busy").status == CANCELLED
+        assert not queue.cancel("busy")
+    finally:
+        runner.release.set()
+        queue.stop()
+    assert "a" not in runner.order
+
+
+def test_persist_and_resume(queue_state, tmp_storage, tmp_path):
+    for name in ("busy", "a", "b", "done"):
+        path = tmp_path / f"{name}.txt"
+        path.write_text(name, encoding="utf-8")
+        storage.insert_document_record(name, path.name, str(path), "text/plain")
+    storage.update_document_after_processing("done", 1)
+    runner = Runner()
+    queue = _busy_queue(runner, busy_path=str(tmp_path / "busy.txt"))
+    queue.submit("a", str(tmp_path / "a.txt"))
+    queue.submit("b", str(tmp_path / "b.txt"), priority=PRIORITY_HIGH)
+    queue.submit("done", str(tmp_path / "done.txt"))
+    queue.stop()
+    # O interrompido volta na frente, depois os pendentes na ordem da fila
+    assert queue.get("busy").status == CANCELLED
+    persisted = json.loads(queue_state.read_text(encoding="utf-8"))
+    assert [item["document_id"] for item in persisted] == ["busy", "b", "a", "done"]
+
+    resumed = Runner()
+    resumed.release.set()
+    queue = IngestQueue(resumed, workers=1, max_depth=8)
+    # Pausa o worker até a fila inteira ser retomada
+    with queue._cond:
+        queue.start()
+        assert not queue_state.exists()
+        assert queue.get("done") is None
+        jobs = [queue.get(name) for name in ("busy", "b", "a")]
+        assert [job.priority for job in jobs] == [PRIORITY_NORMAL, PRIORITY_HIGH, PRIORITY_NORMAL]
+    try:
+        for job in jobs:
+            assert job.done.wait(WAIT)
+        assert resumed.order == ["b", "busy", "a"]
+    finally:
+        queue.stop()
+    assert not queue_state.exists()
+
+
+def test_cancel_during_persistence(tmp_storage, tmp_path, monkeypatch):
+    path = tmp_path / "doc.txt"
+    path.write_text("uma frase curta para processar. " * 50, encoding="utf-8")
+    storage.insert_document_record("doc", path.name, str(path), "text/plain", content_hash="hash-doc")
+    cancel_event = threading.Event()
+    save_search_index = processing.save_search_index
+
+    def cancel_then_save(document_id, tokens):
+        # DELETE ou desligamento chega com tokens e payloads já gravados
+        save_search_index(document_id, tokens)
+        cancel_event.set()
+
+    monkeypatch.setattr(processing, "save_search_index", cancel_then_save)
+    with pytest.raises(ProcessingCancelled):
+        processing.process_pdf("doc", str(path), cancel_event=cancel_event)
+    assert "doc" not in storage.db
+    assert storage.get_document_meta("doc")["status"] == "processing"
+    assert list(storage.TOKENS_DIR.iterdir()) == []
@@ -0,0 +1,73 @@
+"""Progresso de leitura com escrita adiada: atualizações do mesmo documento viram uma
+só escrita, leituras veem o valor pendente e o desligamento grava o que faltou.
+
+    python -m pytest tests/test_progress.py
+"""
+import pytest
+
+from app import storage
+
+
+@pytest.fixture
+def progress_docs(tmp_storage, monkeypatch):
+    monkeypatch.setattr(storage, "_progress_buffer", {})
+    for document_id in ("a", "b"):
+        storage.insert_document_record(document_id, f"{document_id}.txt", f"{document_id}.txt", "text/plain", status="completed")
+    return tmp_storage
+
+
+def _stored(document_id: str):
+    row = storage._get_conn().execute(
+        "SELECT last_read_page, last_token_index FROM documents WHERE id = ?", (document_id,)
+    ).fetchone()
+    return row[0], row[1]
+
+
+def test_updates_are_coalesced(progress_docs):
+    for i in range(1, 101):
+        storage.update_progress("a", last_read_page=i // 10 + 1, last_token_index=i)
+    # Campos informados em chamadas separadas se somam
+    storage.update_progress("b", last_read_page=7)
+    storage.update_progress("b", last_token_index=300)
+    assert _stored("a") == (1, 0)
+    # Leituras já veem o valor pendente
+    meta = storage.get_document_meta("a")
+    assert (meta["last_read_page"], meta["last_token_index"]) == (11, 100)
+    assert storage.flush_progress() == 2
+    assert _stored("a") == (11, 100)
+    assert _stored("b") == (7, 300)
+    assert storage.flush_progress() == 0
+
+
+def test_failed_flush_keeps_newer_values(progress_docs, monkeypatch):
+    storage.update_progress("a", last_read_page=2, last_token_index=20)
+    get_conn = storage._get_conn
+
+    def failing_conn():
+        # Leitor avança durante a gravação que vai falhar
+        storage.update_progress("a", last_read_page=3, last_token_index=30)
+        raise OSError("disco cheio")
+
+    monkeypatch.setattr(storage, "_get_conn", failing_conn)
+    with pytest.raises(OSError):
+        storage.flush_progress()
+    monkeypatch.setattr(storage, "_get_conn", get_conn)
+    assert storage.flush_progress() == 1
+    assert _stored("a") == (3, 30)
+
+
+def test_flush_on_shutdown(progress_docs, monkeypatch):
+    # Intervalo longo: só o desligamento grava
+    monkeypatch.setattr(storage, "PROGRESS_FLUSH_SECONDS", 3600)
+    storage.start_progress_flusher()
+    try:
+        storage.update_progress("a", last_read_page=4, last_token_index=40)
+    finally:
+        storage.stop_progress_flusher()
+    assert _stored("a") == (4, 40)
+
+
+def test_deleted_document_drops_pending_progress(progress_docs):
+    storage.update_progress("a", last_read_page=5)
+    storage.delete_document_record("a")
+    assert storage.flush_progress() == 0
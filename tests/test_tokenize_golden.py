@@ -0,0 +1,99 @@
+"""Saída dourada da tokenização: `iter_tokens` (uma passada, em streaming) tem de
+produzir exatamente o mesmo que o pipeline antigo em listas
+(`preprocess_hyphens` -> `group_words_with_pages` -> `build_tokens_with_rules`):
+tokens, páginas, pesos e as palavras com hífens corrigidos (`words_out`).
+
+    python -m pytest tests/test_tokenize_golden.py
+"""
+import random
+from pathlib import Path
+from typing import List, Tuple
+
+import pytest
+
+from app import processing
+from app.textutils import build_tokens_with_rules, group_words_with_pages, iter_tokens, preprocess_hyphens
+
+UPLOADS_DIR = Path(__file__).resolve().parent.parent / "uploads"
+
+# Casos de borda das três etapas: hífen solto e no fim da linha, monossílabos antes de
+# ponto, pontuação no fim do segmento, números, palavras repetidas e troca de página
+EDGE_CASES = {
+    "vazio": "",
+    "uma palavra": "a",
+    "hifen solto": "bem - estar e guarda - chuva - . fim - 2024",
+    "hifen no fim": "desenvol- vimento da informa- ção e pala- 15% e -",
+    "monossilabos": "a o e é de da do em um. e, só! já? tu eu ele.",
+    "pontuacao": "Ele disse: não, não e não; mas se... Tudo bem? Sim! é.",
+    "numeros": "R$100 em 1950 e 15% de 2024. a 1 e 2, 3.",
+    "repetidas": "a a a a a. e e e e, o o o!",
+    "hifens seguidos": "- - a - - b- - c- -d e-",
+}
+
+
+def _list_pipeline(words: List[str], pages: List[int]) -> Tuple[List[str], List[str], List[int], List[int]]:
+    words, pages = preprocess_hyphens(list(words), list(pages))
+    tokens, token_pages = group_words_with_pages(words, pages)
+    tokens, token_pages, token_weights = build_tokens_with_rules(tokens, token_pages)
+    return words, tokens, token_pages, token_weights
+
+
+def _streaming(words: List[str], pages: List[int]) -> Tuple[List[str], List[str], List[int], List[int]]:
+    words_out: List[str] = []
+    tokens: List[str] = []
+    token_pages: List[int] = []
+    token_weights: List[int] = []
+    # Gerador: o pipeline não pode depender de len() nem de indexar a entrada
+    for token, page, weight in iter_tokens(((w, p) for w, p in zip(words, pages)), words_out=words_out):
+        tokens.append(token)
+        token_pages.append(page)
+        token_weights.append(weight)
+    return words_out, tokens, token_pages, token_weights
+
+
+def _assert_same(words: List[str], pages: List[int]) -> None:
+    expected_words, expected_tokens, expected_pages, expected_weights = _list_pipeline(words, pages)
+    words_out, tokens, token_pages, token_weights = _streaming(words, pages)
+    assert tokens == expected_tokens
+    assert token_pages == expected_pages
+    assert token_weights == expected_weights
+    assert words_out == expected_words
+
+
+def _paged(words: List[str], per_page: int) -> List[int]:
+    return [i // per_page + 1 for i in range(len(words))]
+
+
+@pytest.mark.parametrize("name", sorted(EDGE_CASES))
+def test_edge_cases(name):
+    words = EDGE_CASES[name].split(" ") if EDGE_CASES[name] else []
+    # Página por palavra: qualquer erro de página no lookahead aparece
+    _assert_same(words, _paged(words, 1))
+    _assert_same(words, _paged(words, 3))
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_random_text(seed):
+    rng = random.Random(seed)
+    vocab = [w for text in EDGE_CASES.values() for w in text.split(" ") if w] + [
+        "leitura", "rápida", "capítulo", "possibilidade", "responsabilidade", "com", "para", "não", "à",
+    ]
+    words = [rng.choice(vocab) for _ in range(rng.randint(0, 2000))]
+    _assert_same(words, _paged(words, rng.randint(1, 300)))
+
+
+@pytest.mark.parametrize(
+    "path",
+    sorted(p for p in UPLOADS_DIR.glob("*") if p.suffix.lower() in (".txt", ".md", ".epub", ".pdf")),
+    ids=lambda p: p.suffix.lstrip("."),
+)
+def test_sample_uploads(path):
+    extractor = {
+        ".txt": processing._extract_words_with_pages_txt,
+        ".md": processing._extract_words_with_pages_md,
+        ".epub": lambda file_path: processing._extract_words_with_pages_epub(file_path, workers=1),
+        ".pdf": lambda file_path: processing._extract_words_with_pages_pdf(file_path, workers=1),
+    }[path.suffix.lower()]
+    words, pages, _ = extractor(str(path))
+    assert words
+    _assert_same(words, pages)
@@ -0,0 +1,123 @@
+"""Cache binário de tokens (.tok): ida e volta contra o formato JSON antigo, migração
+dos caches .json e leitores de um mapeamento fechado por regravação.
+
+    python -m pytest tests/test_tokens_cache.py
+"""
+import json
+
+import pytest
+
+from app import search, storage
+from app.textutils import build_cost_prefix, build_page_index
+
+TOKENS = ["Olá", "mundo,", "ação", "é", "—", "fim.", "emoji 📚", ""]
+PAGES = [1, 1, 1, 2, 2, 3, 3, 3]
+WEIGHTS = [1, 2, 1, 1, 3, 2, 1, 1]
+
+
+def _save(document_id: str, tokens=TOKENS) -> None:
+    storage.save_tokens_cache(
+        document_id, tokens=list(tokens), token_pages=PAGES[:len(tokens)], token_weights=WEIGHTS[:len(tokens)], page_count=3
+    )
+
+
+def _assert_matches(cached, tokens=TOKENS) -> None:
+    n = len(tokens)
+    assert list(cached["tokens"]) == tokens
+    assert cached["tokens"][2:5] == tokens[2:5]
+    assert list(cached["pages"]) == PAGES[:n]
+    assert list(cached["weights"]) == WEIGHTS[:n]
+    assert cached["page_count"] == 3
+    assert list(cached["page_index"]) == build_page_index(PAGES[:n], 3)
+    assert list(cached["costs"]) == pytest.approx(build_cost_prefix(tokens, WEIGHTS[:n]))
+
+
+def test_round_trip(tmp_storage):
+    _save("doc")
+    cached = storage.load_tokens_cache("doc")
+    try:
+        _assert_matches(cached)
+        assert cached["version"] == storage.TOKENS_CACHE_VERSION
+    finally:
+        storage._close_mapping(cached)
+
+
+def test_empty_document(tmp_storage):
+    _save("vazio", tokens=[])
+    cached = storage.load_tokens_cache("vazio")
+    try:
+        assert list(cached["tokens"]) == []
+        assert list(cached["costs"]) == [0.0]
+    finally:
+        storage._close_mapping(cached)
+
+
+def test_legacy_json_is_migrated(tmp_storage):
+    target, legacy = storage._tokens_paths("antigo")
+    legacy.write_text(
+        json.dumps({"tokens": TOKENS, "pages": PAGES, "weights": WEIGHTS, "page_count": 3}), encoding="utf-8"
+    )
+    cached = storage.load_tokens_cache("antigo")
+    try:
+        _assert_matches(cached)
+        # Caches .json são anteriores ao versionamento do tokenizador
+        assert cached["tokenizer_version"] == 1
+    finally:
+        storage._close_mapping(cached)
+    assert target.exists()
+    assert not legacy.exists()
+
+
+def test_invalid_legacy_json(tmp_storage):
+    _, legacy = storage._tokens_paths("quebrado")
+    legacy.write_text('{"tokens": "não é lista"}', encoding="utf-8")
+    assert storage.load_tokens_cache("quebrado") is None
+
+
+def test_rewrite_releases_readers(tmp_storage):
+    _save("doc")
+    held = storage.load_tokens_cache("doc")
+    storage.db["doc"] = {"status": "completed", "tokens": held["tokens"], "mapping": held["mapping"]}
+    _save("doc", tokens=TOKENS[:4])
+    # A regravação fecha o mapeamento antigo e tira de `db` quem o usava
+    assert storage.mapping_released(held)
+    assert "doc" not in storage.db
+    with pytest.raises(ValueError):
+        held["tokens"][0]
+    cached = storage.load_tokens_cache("doc")
+    try:
+        _assert_matches(cached, TOKENS[:4])
+    finally:
+        storage._close_mapping(cached)
+
+
+def test_search_retries_after_index_rewrite(tmp_storage, monkeypatch):
+    _save("doc")
+    match_positions = search.match_positions
+    rewrites = []
+
+    def rewrite_then_match(index, terms):
+        # Outra busca remonta o .idx enquanto esta ainda o tem aberto
+        if not rewrites:
+            rewrites.append(index)
+            search.save_search_index("doc", TOKENS)
+        return match_positions(index, terms)
+
+    monkeypatch.setattr(search, "match_positions", rewrite_then_match)
+    result = search.search_document("doc", "ação")
+    assert storage.mapping_released(rewrites[0])
+    assert result["total"] == 1
+    assert result["hits"][0]["token_index"] == 2
+
+
+def test_dedupe_key_includes_format(tmp_storage):
+    # Mesmos bytes como .txt e como .md: tokens diferentes, caches separados
+    storage.insert_document_record("txt", "a.txt", "uploads/abc.txt", "text/plain", status="completed", content_hash="abc")
+    storage.insert_document_record("md", "a.md", "uploads/abc.md", "text/markdown", status="completed", content_hash="abc")
+    storage.insert_document_record("txt2", "b.txt", "uploads/abc.txt", "text/plain", status="completed", content_hash="abc")
+    assert storage._cache_key("txt") == storage._cache_key("txt2") == "abc.txt"
+    assert storage._cache_key("md") == "abc.md"
+    assert storage.find_completed_by_hash("abc", ".md")["id"] == "md"
+    assert storage.find_completed_by_hash("abc", ".epub") is None
+    assert storage.count_documents_by_hash("abc", ".txt") == 2
+    assert storage.count_documents_by_hash("abc", ".md") == 1
@@ -8,6 +8,12 @@ import { Toast } from "./components/Toast";
 
 type UploadResponse = { document_id: string; status: string };
 type StatusResponse = { status: string; word_count: number };
+type TokensResponse = { tokens: string[]; pages?: number[]; page_count?: number; weights?: number[]; offset?: number; total?: number; complete?: boolean };
+type SeekResponse = { token_index: number; page: number; seconds: number; total_seconds: number };
+
+// Tokens chegam em duas etapas: primeiro a janela em torno da posição salva, depois o
+// documento inteiro em segundo plano (pré-comprimido e com ETag, o navegador reaproveita)
+const TOKEN_WINDOW = 2000;
 
 // Define a URL base da API. Se não houver VITE_API_BASE, usa o host atual com porta 8000.
 const DEFAULT_API_BASE = `http://${window.location.hostname}:8000`;
@@ -34,6 +40,7 @@ export function App() {
   const [currentMime, setCurrentMime] = useState<string | null>(null);
   const [lastTokenIndex, setLastTokenIndex] = useState<number>(0);
   const [startPageDirty, setStartPageDirty] = useState<boolean>(false);
+  const [tokensRetry, setTokensRetry] = useState<number>(0);
 
   // Intervalo por palavra em ms
   // Duração base por palavra em ms
@@ -155,26 +162,73 @@ export function App() {
     setSuppressProgressSync(true);
     (async () => {
       try {
-        const tres = await fetch(`${API_BASE}/documents/${documentId}/tokens`);
+        const firstWindow = lastTokenIndex > 0
+          ? `offset=${Math.max(0, lastTokenIndex - TOKEN_WINDOW / 4)}&limit=${TOKEN_WINDOW}`
+          : startPage > 1
+            ? `page_from=${startPage}&limit=${TOKEN_WINDOW}`
+            : `offset=0&limit=${TOKEN_WINDOW}`;
+        const tres = await fetch(`${API_BASE}/documents/${documentId}/tokens?${firstWindow}`);
+        const retryLater = (seconds: number) => {
+          setToast("Reprocessando documento...");
+          setTimeout(() => {
+            if (!cancelled) setTokensRetry((n) => n + 1);
+          }, Math.max(1, seconds) * 1000);
+        };
+        // 202: cache perdido no servidor e documento sendo reprocessado
+        if (tres.status === 202) {
+          retryLater(Number(tres.headers.get("Retry-After")) || 2);
+          return;
+        }
         if (tres.ok) {
-          const tdata: { tokens: string[]; pages?: number[]; page_count?: number; weights?: number[] } = await tres.json();
+          const tdata: TokensResponse = await tres.json();
+          if (tdata.complete === false) {
+            retryLater(2);
+            return;
+          }
           if (!cancelled) {
-            setDisplayTokens(tdata.tokens);
-            setTokenPages(tdata.pages ?? []);
+            const total = tdata.total ?? tdata.tokens.length;
+            const windowStart = tdata.offset ?? 0;
+            const windowEnd = windowStart + tdata.tokens.length;
+            const allTokens: string[] = new Array(total).fill("");
+            const allPages: number[] = new Array(total).fill(0);
+            const allWeights: number[] = new Array(total).fill(1);
+            const merge = (chunk: TokensResponse) => {
+              const base = chunk.offset ?? 0;
+              chunk.tokens.forEach((t, i) => {
+                allTokens[base + i] = t;
+                allPages[base + i] = chunk.pages?.[i] ?? 1;
+                allWeights[base + i] = chunk.weights?.[i] ?? countWordsInToken(t);
+              });
+            };
+            const publish = () => {
+              setDisplayTokens(allTokens.slice());
+              setTokenPages(allPages.slice());
+              setTokenWeights(allWeights.slice());
+            };
+            merge(tdata);
+            publish();
             setPageCount(tdata.page_count ?? 0);
-            setTokenWeights(tdata.weights ?? Array(tdata.tokens.length).fill(1));
             // prioridade: token salvo > startPage > início
-            if (lastTokenIndex > 0 && lastTokenIndex < (tdata.tokens?.length ?? 0)) {
+            if (lastTokenIndex > 0 && lastTokenIndex < total) {
               setCurrentIndex(lastTokenIndex);
-            } else if (startPage > 1 && (tdata.pages?.length ?? 0) > 0) {
-              const idx = (tdata.pages ?? []).findIndex((p) => p >= startPage);
-              setCurrentIndex(Math.max(0, idx));
+            } else if (startPage > 1 && tdata.page_count) {
+              setCurrentIndex(Math.min(windowStart, Math.max(0, total - 1)));
             } else {
               setCurrentIndex(0);
             }
             // Libera sincronização após um micro delay para garantir currentIndex aplicado
             setTimeout(() => setSuppressProgressSync(false), 0);
             setToast("Documento carregado");
+
+            // Pré-carrega o documento inteiro, se a janela não cobriu tudo
+            if (windowStart > 0 || windowEnd < total) {
+              const cres = await fetch(`${API_BASE}/documents/${documentId}/tokens`);
+              if (!cres.ok || cancelled) return;
+              const cdata: TokensResponse = await cres.json();
+              if (cancelled) return;
+              merge(cdata);
+              publish();
+            }
           }
         } else {
           setToast("Carregando do cache/arquivo...");
@@ -184,24 +238,29 @@ export function App() {
     return () => {
       cancelled = true;
     };
-  }, [documentId, status?.status, startPage, lastTokenIndex]);
+  }, [documentId, status?.status, startPage, lastTokenIndex, tokensRetry]);
 
-  // Salto para página inicial selecionada
+  // Salto para página inicial selecionada: o backend resolve página -> token sem varrer os tokens
   useEffect(() => {
     if (!tokenPages.length) return;
-    if (lastTokenIndex > 0 && !startPageDirty) return;
-    const idx = tokenPages.findIndex((p) => p >= startPage);
-    if (idx >= 0) {
-      setCurrentIndex(idx);
-      if (documentId && startPageDirty) {
-        const ctrl = new AbortController();
-        fetch(`${API_BASE}/documents/${documentId}/progress?page=${tokenPages[idx]}&token_index=${idx}`,
-          { method: "POST", signal: ctrl.signal }).catch(() => {});
+    // Só reage a mudanças feitas pelo usuário; a carga inicial já posiciona o índice
+    // (evita voltar ao início da página a cada janela pré-carregada)
+    if (!startPageDirty || !documentId) return;
+    const ctrl = new AbortController();
+    (async () => {
+      try {
+        const res = await fetch(`${API_BASE}/documents/${documentId}/seek?page=${startPage}`, { signal: ctrl.signal });
+        if (!res.ok) return;
+        const seek: SeekResponse = await res.json();
+        setCurrentIndex(seek.token_index);
+        fetch(`${API_BASE}/documents/${documentId}/progress?page=${seek.page}&token_index=${seek.token_index}`,
+          { method: "POST" }).catch(() => {});
         setStartPageDirty(false);
         setLastTokenIndex(0);
-      }
-    }
-  }, [startPage, tokenPages, lastTokenIndex, startPageDirty, documentId]);
+      } catch {}
+    })();
+    return () => ctrl.abort();
+  }, [startPage, tokenPages.length, startPageDirty, documentId]);
 
   // Atualiza progresso de página lida
   useEffect(() => {